@@ -58,6 +58,9 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# StreakMiddleware ignores requests to these paths (polling, partials, files)
+STREAK_SKIP_PATHS = ['/task-status/', '/static/', '/media/']
+
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
@@ -174,9 +177,153 @@ LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/chatbot/'
 LOGOUT_REDIRECT_URL = '/'
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Local memory by default (single node). Set CACHE_BACKEND=file to share the
+# cache between workers on one machine, or CACHE_BACKEND=redis for several nodes.
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
+
+# Lesson chatbot answers get their own cache alias (see core/chat_cache.py)
+LESSON_CHATBOT_CACHE_TIMEOUT = int(os.getenv('LESSON_CHATBOT_CACHE_TIMEOUT', str(24 * 3600)))
+LESSON_CHATBOT_CACHE_MAX_ENTRIES = int(os.getenv('LESSON_CHATBOT_CACHE_MAX_ENTRIES', '5000'))
+# Optional second tier: reuse answers to questions with similar embeddings
+LESSON_CHATBOT_SEMANTIC_CACHE = os.getenv('LESSON_CHATBOT_SEMANTIC_CACHE', 'False') == 'True'
+LESSON_CHATBOT_SIMILARITY = float(os.getenv('LESSON_CHATBOT_SIMILARITY', '0.92'))
+LESSON_CHATBOT_SEMANTIC_CANDIDATES = int(os.getenv('LESSON_CHATBOT_SEMANTIC_CANDIDATES', '50'))
+
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_LOCATION', 'redis://redis:6379/1'),
+        },
+        # Eviction follows the server's maxmemory-policy (use allkeys-lru)
+        'lesson_chatbot': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_LOCATION', 'redis://redis:6379/1'),
+            'KEY_PREFIX': 'lesson-chatbot',
+            'TIMEOUT': LESSON_CHATBOT_CACHE_TIMEOUT,
+        },
+    }
+elif CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('CACHE_LOCATION', str(BASE_DIR / '.cache')),
+        },
+        'lesson_chatbot': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(os.getenv('CACHE_LOCATION', str(BASE_DIR / '.cache')), 'lesson-chatbot'),
+            'TIMEOUT': LESSON_CHATBOT_CACHE_TIMEOUT,
+            'OPTIONS': {'MAX_ENTRIES': LESSON_CHATBOT_CACHE_MAX_ENTRIES},
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'study',
+        },
+        # Least recently used answers are evicted beyond MAX_ENTRIES
+        'lesson_chatbot': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'lesson-chatbot',
+            'TIMEOUT': LESSON_CHATBOT_CACHE_TIMEOUT,
+            'OPTIONS': {'MAX_ENTRIES': LESSON_CHATBOT_CACHE_MAX_ENTRIES},
+        },
+    }
+
+# Rendered lesson Markdown is cached per content hash for this many seconds
+RENDERED_MARKDOWN_CACHE_TIMEOUT = int(os.getenv('RENDERED_MARKDOWN_CACHE_TIMEOUT', str(7 * 24 * 3600)))
+
+# Cached module/lesson outline of a course (see services.get_course_tree), not cached while
+# the course is generating. Edits and generation only invalidate it in the process making
+# them, so with several processes or Celery use a shared cache (CACHE_BACKEND=redis)
+COURSE_TREE_CACHE_TIMEOUT = int(os.getenv('COURSE_TREE_CACHE_TIMEOUT', str(24 * 3600)))
+
+# Leaderboard snapshot: rebuilt after this many seconds or this many XP changes
+LEADERBOARD_SNAPSHOT_TTL = int(os.getenv('LEADERBOARD_SNAPSHOT_TTL', '60'))
+LEADERBOARD_SNAPSHOT_MAX_EVENTS = int(os.getenv('LEADERBOARD_SNAPSHOT_MAX_EVENTS', '50'))
+
+# Ranking backend: 'db' (queries on total_xp), 'memory' (in-process sorted set,
+# resynced from the DB every LEADERBOARD_RANKING_RESYNC seconds, so only
+# consistent with a single process) or 'redis' (shared ZSET, needs redis-py)
+LEADERBOARD_BACKEND = os.getenv('LEADERBOARD_BACKEND', 'db')
+LEADERBOARD_REDIS_URL = os.getenv('LEADERBOARD_REDIS_URL', 'redis://redis:6379/0')
+LEADERBOARD_RANKING_RESYNC = int(os.getenv('LEADERBOARD_RANKING_RESYNC', '300'))
+
+# Reuse an existing course in the same language instead of generating a new
+# one when its topic is at least this similar (trigram similarity, 1 = exact only)
+# and has the same numbers, so "Python 3.10" doesn't reuse "Python 3.11"
+COURSE_REUSE_SIMILARITY = float(os.getenv('COURSE_REUSE_SIMILARITY', '0.7'))
+
+# Generate courses in stages: an outline, then one prompt per module in
+# parallel, retrying each failed piece on its own (see core/generation.py).
+# False uses the single whole-course prompt.
+COURSE_GENERATION_STAGED = os.getenv('COURSE_GENERATION_STAGED', 'True') == 'True'
+COURSE_GENERATION_WORKERS = int(os.getenv('COURSE_GENERATION_WORKERS', '4'))
+COURSE_GENERATION_PIECE_ATTEMPTS = int(os.getenv('COURSE_GENERATION_PIECE_ATTEMPTS', '3'))
+# With Celery: save the outline first and fill lessons in as their module
+# arrives, so users can start the first lesson while the rest is generated
+COURSE_GENERATION_PROGRESSIVE = os.getenv('COURSE_GENERATION_PROGRESSIVE', 'True') == 'True'
+# generate_course_task retries only transient AI errors (rate limits, timeouts,
+# 5xx), waiting as long as the provider asks or backing off exponentially
+COURSE_TASK_MAX_RETRIES = int(os.getenv('COURSE_TASK_MAX_RETRIES', '5'))
+COURSE_TASK_RETRY_BACKOFF_MAX = int(os.getenv('COURSE_TASK_RETRY_BACKOFF_MAX', '600'))  # seconds
+# /task-status/<id>/?wait= holds a request open until the task's status
+# changes (long polling). It re-reads the status after TASK_STATUS_POLL_INTERVAL
+# seconds, backing off to TASK_STATUS_POLL_MAX_INTERVAL while nothing changes
+TASK_STATUS_LONG_POLL_TIMEOUT = float(os.getenv('TASK_STATUS_LONG_POLL_TIMEOUT', '25'))
+TASK_STATUS_POLL_INTERVAL = float(os.getenv('TASK_STATUS_POLL_INTERVAL', '2'))
+TASK_STATUS_POLL_MAX_INTERVAL = float(os.getenv('TASK_STATUS_POLL_MAX_INTERVAL', '5'))
+# With Celery, refuse new generations while this many tasks wait in the
+# heavy_tasks queue (0 disables); the length is re-read every CHECK_INTERVAL seconds
+COURSE_GENERATION_MAX_BACKLOG = int(os.getenv('COURSE_GENERATION_MAX_BACKLOG', '50'))
+COURSE_GENERATION_BACKLOG_CHECK_INTERVAL = int(os.getenv('COURSE_GENERATION_BACKLOG_CHECK_INTERVAL', '5'))
+# Identical generation requests (same normalized topic, language and settings)
+# join the task already in flight for at most this many seconds (see core/singleflight.py).
+# With Celery this needs a cache the workers share, e.g. CACHE_BACKEND=redis
+COURSE_GENERATION_INFLIGHT_TIMEOUT = int(os.getenv('COURSE_GENERATION_INFLIGHT_TIMEOUT', '1800'))
+
+# Token buckets for the AI endpoints, per user and shared by all users, as
+# "<requests>/<period>" (s, min, hour, day); empty means unlimited (see core/ratelimit.py).
+# AI_RATE_LIMIT_BACKEND: 'cache' (the default cache, shared between workers with CACHE_BACKEND=redis;
+# with locmem or file, whose add() can't serve as a lock, it falls back to 'local') or 'local' (per process)
+AI_RATE_LIMIT_BACKEND = os.getenv('AI_RATE_LIMIT_BACKEND', 'cache')
+AI_RATE_LIMITS = {
+    'chat': {
+        'user': os.getenv('CHAT_RATE_LIMIT', '20/min'),
+        'global': os.getenv('CHAT_GLOBAL_RATE_LIMIT', '600/min'),
+    },
+    'lesson_chat': {
+        'user': os.getenv('LESSON_CHAT_RATE_LIMIT', '20/min'),
+        'global': os.getenv('LESSON_CHAT_GLOBAL_RATE_LIMIT', '600/min'),
+    },
+    'course_generation': {
+        'user': os.getenv('COURSE_GENERATION_RATE_LIMIT', '5/hour'),
+        'global': os.getenv('COURSE_GENERATION_GLOBAL_RATE_LIMIT', '200/hour'),
+    },
+}
+
 # Gemini API Key (loaded from .env file)
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
+# AI client (see core/ai_client.py)
+# AI_BACKEND: 'gemini', 'fake' (offline, for load tests) or a dotted class path
+AI_BACKEND = os.getenv('AI_BACKEND', 'gemini')
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.5-flash')
+GEMINI_EMBEDDING_MODEL = os.getenv('GEMINI_EMBEDDING_MODEL', 'models/text-embedding-004')
+GEMINI_TIMEOUT = float(os.getenv('GEMINI_TIMEOUT', '60'))  # seconds per request
+# 'rest' is recommended with gevent workers; empty uses the SDK default (grpc)
+GEMINI_TRANSPORT = os.getenv('GEMINI_TRANSPORT') or None
+AI_FAKE_LATENCY = float(os.getenv('AI_FAKE_LATENCY', '0.5'))  # seconds, fake backend only
+
+# Chatbot prompt: the last CHATBOT_CONTEXT_MESSAGES messages plus a rolling summary
+# of older ones, updated once CHATBOT_SUMMARY_BATCH messages have left the window
+# (see core/chat_context.py)
+CHATBOT_CONTEXT_MESSAGES = int(os.getenv('CHATBOT_CONTEXT_MESSAGES', '5'))
+CHATBOT_SUMMARY_BATCH = int(os.getenv('CHATBOT_SUMMARY_BATCH', '10'))
+
 # ============================================================================
 # CELERY CONFIGURATION (Optional - only for VPS deployments with Redis)
 # ============================================================================
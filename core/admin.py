@@ -1,10 +1,13 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from .models import CustomUser, Course, Module, Lesson, Quiz, UserProgress, UserCourse, ChatMessage
+from .services import index_course_lessons, invalidate_course_tree
+from .rendering import invalidate_rendered_html
+from .chat_cache import invalidate_lesson
 
 @admin.register(CustomUser)
 class CustomUserAdmin(UserAdmin):
-    list_display = ['username', 'email', 'first_name', 'last_name', 'preferred_language', 'age','date_joined']
+    list_display = ['username', 'email', 'first_name', 'last_name', 'preferred_language', 'age', 'total_xp', 'date_joined']
     fieldsets = UserAdmin.fieldsets + (
         ('Additional Info', {'fields': ('phone_number', 'age', 'preferred_language')}),
     )
@@ -24,17 +27,56 @@ class ModuleAdmin(admin.ModelAdmin):
     list_filter = ['course']
     ordering = ['course', 'order']
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        index_course_lessons(obj.course_id)
+        invalidate_course_tree(obj.course_id)
+
+    def delete_model(self, request, obj):
+        course_id = obj.course_id
+        super().delete_model(request, obj)
+        index_course_lessons(course_id)
+        invalidate_course_tree(course_id)
+
 @admin.register(Lesson)
 class LessonAdmin(admin.ModelAdmin):
-    list_display = ['title', 'module', 'order']
+    list_display = ['title', 'module', 'order', 'position']
     list_filter = ['module__course']
     ordering = ['module', 'order']
 
+    def save_model(self, request, obj, form, change):
+        if change and 'content' in form.changed_data:
+            # Drop the rendered HTML cached for the old content
+            invalidate_rendered_html(form.initial.get('content'))
+            # Cached lesson chatbot answers were based on the old content
+            invalidate_lesson(obj.id)
+        super().save_model(request, obj, form, change)
+        index_course_lessons(obj.module.course_id)
+        invalidate_course_tree(obj.module.course_id)
+
+    def delete_model(self, request, obj):
+        course_id = obj.module.course_id
+        invalidate_lesson(obj.id)
+        super().delete_model(request, obj)
+        index_course_lessons(course_id)
+        invalidate_course_tree(course_id)
+
 @admin.register(Quiz)
 class QuizAdmin(admin.ModelAdmin):
     list_display = ['lesson', 'question']
     list_filter = ['lesson__module__course']
 
+    # The lesson chatbot prompt lists the lesson's quiz questions
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        invalidate_lesson(obj.lesson_id)
+        if change and 'lesson' in form.changed_data and form.initial.get('lesson'):
+            invalidate_lesson(form.initial['lesson'])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        invalidate_lesson(obj.lesson_id)
+
 @admin.register(UserProgress)
 class UserProgressAdmin(admin.ModelAdmin):
     list_display = ['user', 'lesson', 'is_completed', 'score', 'completed_at']
@@ -0,0 +1,328 @@
+"""
+Process-wide AI client.
+
+All Gemini calls (chatbot, lesson chatbot, course generation) go through
+generate_text() here (or agenerate_text() from async views) instead of
+calling genai.configure() and building a new GenerativeModel on every
+request. The backend is created lazily, once
+per process, behind a lock (gevent patches threading, so this is also
+greenlet-safe) and then reused, so its underlying connection is reused too.
+
+The backend is selected with AI_BACKEND:
+- 'gemini' (default): Google Gemini via google-generativeai
+- 'fake': canned responses without network access, for load tests
+- a dotted path to any class with the same generate(), agenerate(),
+  stream() and embed() methods (astream() is optional, stream() is run
+  in a thread otherwise)
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+import weakref
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+try:
+    import google.generativeai as genai
+    from google.generativeai import client as genai_client
+    GENAI_AVAILABLE = True
+except ImportError:
+    GENAI_AVAILABLE = False
+    genai = None
+    genai_client = None
+
+try:
+    from google.api_core.exceptions import InvalidArgument
+except ImportError:
+    InvalidArgument = ValueError
+
+
+async def iterate_in_thread(iterator):
+    """Yield from a blocking iterator, fetching each item in a worker thread"""
+    done = object()
+    next_item = sync_to_async(next, thread_sensitive=False)
+    while True:
+        item = await next_item(iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+class GeminiBackend:
+    """Google Gemini, one configured GenerativeModel per process"""
+
+    def __init__(self):
+        if not GENAI_AVAILABLE:
+            raise ImportError(
+                "google-generativeai package is not installed. "
+                "Install it with: pip install google-generativeai"
+            )
+        options = {'api_key': settings.GEMINI_API_KEY}
+        if settings.GEMINI_TRANSPORT:
+            options['transport'] = settings.GEMINI_TRANSPORT
+        genai.configure(**options)
+        self.model = genai.GenerativeModel(settings.GEMINI_MODEL)
+        self._async_models = weakref.WeakKeyDictionary()
+        self._async_loops = 0
+        self._use_async_client = True
+
+    def generate(self, prompt, json_mode=False, timeout=None):
+        request_options = {'timeout': timeout or settings.GEMINI_TIMEOUT}
+        if json_mode:
+            # Try to use JSON mode if available (works with newer models/SDKs)
+            try:
+                response = self.model.generate_content(
+                    prompt,
+                    generation_config={'response_mime_type': 'application/json'},
+                    request_options=request_options
+                )
+                return response.text
+            except (TypeError, InvalidArgument):
+                # Fallback for older SDK versions / models without JSON mode
+                pass
+        response = self.model.generate_content(prompt, request_options=request_options)
+        return response.text
+
+    def _async_model(self):
+        """
+        A model using the SDK's asyncio gRPC client, or None to run the sync
+        call in a thread instead.
+
+        The SDK has no public way to build a model on the async client, so
+        this reaches into genai_client._client_manager and the model's
+        _async_client; if a google-generativeai upgrade changes either,
+        the thread path is used. gRPC asyncio channels belong to the event
+        loop that created them: an ASGI worker runs one loop for its whole
+        life, but async views under WSGI get a new loop per request, which
+        would build a new client every time. Once a second loop shows up
+        the thread path is used from then on.
+        """
+        loop = asyncio.get_running_loop()
+        model = self._async_models.get(loop)
+        if model is not None or not self._use_async_client:
+            return model
+        if self._async_loops:
+            self._use_async_client = False
+            return None
+        make_client = getattr(getattr(genai_client, '_client_manager', None), 'make_client', None)
+        try:
+            model = genai.GenerativeModel(settings.GEMINI_MODEL)
+            if make_client is None or not hasattr(model, '_async_client'):
+                raise AttributeError('google-generativeai no longer exposes its async client')
+            model._async_client = make_client('generative_async')
+        except Exception as e:
+            print(f"Gemini async client unavailable, calling the API from threads: {e}")
+            self._use_async_client = False
+            return None
+        self._async_loops += 1
+        self._async_models[loop] = model
+        return model
+
+    async def agenerate(self, prompt, json_mode=False, timeout=None):
+        # The SDK's async client only speaks gRPC, run REST calls in a thread
+        model = None if settings.GEMINI_TRANSPORT == 'rest' else self._async_model()
+        if model is None:
+            return await sync_to_async(self.generate, thread_sensitive=False)(prompt, json_mode, timeout)
+
+        request_options = {'timeout': timeout or settings.GEMINI_TIMEOUT}
+        if json_mode:
+            try:
+                response = await model.generate_content_async(
+                    prompt,
+                    generation_config={'response_mime_type': 'application/json'},
+                    request_options=request_options
+                )
+                return response.text
+            except (TypeError, InvalidArgument):
+                pass
+        response = await model.generate_content_async(prompt, request_options=request_options)
+        return response.text
+
+    async def astream(self, prompt, timeout=None):
+        model = None if settings.GEMINI_TRANSPORT == 'rest' else self._async_model()
+        if model is None:
+            async for text in iterate_in_thread(self.stream(prompt, timeout)):
+                yield text
+            return
+
+        request_options = {'timeout': timeout or settings.GEMINI_TIMEOUT}
+        response = await model.generate_content_async(prompt, stream=True, request_options=request_options)
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                continue
+            if text:
+                yield text
+
+    def embed(self, text, timeout=None):
+        result = genai.embed_content(
+            model=settings.GEMINI_EMBEDDING_MODEL,
+            content=text,
+            request_options={'timeout': timeout or settings.GEMINI_TIMEOUT}
+        )
+        return result['embedding']
+
+    def stream(self, prompt, timeout=None):
+        request_options = {'timeout': timeout or settings.GEMINI_TIMEOUT}
+        response = self.model.generate_content(prompt, stream=True, request_options=request_options)
+        for chunk in response:
+            # Chunks with no candidates (e.g. safety metadata only) raise on .text
+            try:
+                text = chunk.text
+            except ValueError:
+                continue
+            if text:
+                yield text
+
+
+FAKE_REPLY = "This is a placeholder reply from the fake AI backend."
+
+
+class FakeBackend:
+    """
+    Offline backend for load testing.
+
+    Sleeps AI_FAKE_LATENCY seconds to imitate the model (without blocking
+    the event loop in agenerate), then returns a valid course JSON in JSON
+    mode and a short chat reply otherwise.
+    """
+
+    def generate(self, prompt, json_mode=False, timeout=None):
+        time.sleep(settings.AI_FAKE_LATENCY)
+        return self.reply(prompt, json_mode)
+
+    async def agenerate(self, prompt, json_mode=False, timeout=None):
+        await asyncio.sleep(settings.AI_FAKE_LATENCY)
+        return self.reply(prompt, json_mode)
+
+    def reply(self, prompt, json_mode):
+        if not json_mode:
+            return FAKE_REPLY
+        # Staged generation (core.generation) asks for a module's lessons, a
+        # single lesson or an outline
+        lesson_title = re.search(r'REWRITE LESSON: (.*)', prompt)
+        if lesson_title:
+            quiz_count = 10 if 'at least 10 quizzes' in prompt else 1
+            return json.dumps(self.fake_lesson(lesson_title.group(1).strip(), quiz_count))
+        lesson_titles = re.search(r'LESSON TITLES: (\[.*\])', prompt)
+        if lesson_titles:
+            return json.dumps({'lessons': self.fake_lessons(json.loads(lesson_titles.group(1)), prompt)})
+        course = self.fake_course(prompt)
+        if 'Return only the outline' in prompt:
+            for module in course['modules']:
+                module['lessons'] = [lesson['title'] for lesson in module['lessons']]
+        return json.dumps(course)
+
+    def fake_lessons(self, titles, prompt):
+        quiz_count = 10 if 'at least 10 quizzes' in prompt else 1
+        return [self.fake_lesson(title, quiz_count) for title in titles]
+
+    def fake_lesson(self, title, quiz_count):
+        return {
+            'title': title,
+            'content': f'## {title}\n\nPlaceholder lesson content.',
+            'quizzes': [
+                {
+                    'question': f'Question {q + 1} about {title}?',
+                    'options': ['Option A', 'Option B', 'Option C', 'Option D'],
+                    'correct_answer': 0,
+                }
+                for q in range(quiz_count)
+            ],
+        }
+
+    def stream(self, prompt, timeout=None):
+        words = FAKE_REPLY.split(' ')
+        for index, word in enumerate(words):
+            time.sleep(settings.AI_FAKE_LATENCY / len(words))
+            yield word if index == 0 else ' ' + word
+
+    async def astream(self, prompt, timeout=None):
+        words = FAKE_REPLY.split(' ')
+        for index, word in enumerate(words):
+            await asyncio.sleep(settings.AI_FAKE_LATENCY / len(words))
+            yield word if index == 0 else ' ' + word
+
+    def embed(self, text, timeout=None):
+        # Hashed bag of words: texts sharing most words get similar vectors
+        vector = [0.0] * 64
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode('utf-8')).hexdigest(), 16) % 64] += 1.0
+        return vector
+
+    def fake_course(self, prompt):
+        match = re.search(r'"([^"]+)"', prompt)
+        topic = match.group(1) if match else 'Topic'
+
+        def lesson(number, quiz_count):
+            return self.fake_lesson(f'{topic} lesson {number}', quiz_count)
+
+        return {
+            'title': topic,
+            'description': f'A generated course about {topic}.',
+            'modules': [
+                {'title': 'Module 1', 'order': 1, 'lessons': [lesson(n, 1) for n in range(1, 6)]},
+                {'title': 'Module 2', 'order': 2, 'lessons': [lesson(n, 2) for n in range(6, 11)]},
+                {'title': 'Final Exam', 'order': 3, 'lessons': [lesson(11, 10)]},
+            ],
+        }
+
+
+BACKENDS = {
+    'gemini': GeminiBackend,
+    'fake': FakeBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """The process-wide backend, created on first use"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend_class = BACKENDS.get(settings.AI_BACKEND) or import_string(settings.AI_BACKEND)
+                _backend = backend_class()
+    return _backend
+
+
+def is_available():
+    """False when the Gemini backend is selected but its SDK is not installed"""
+    return settings.AI_BACKEND != 'gemini' or GENAI_AVAILABLE
+
+
+def generate_text(prompt, json_mode=False, timeout=None):
+    """Send one prompt to the configured backend and return the stripped reply text"""
+    return get_backend().generate(prompt, json_mode=json_mode, timeout=timeout).strip()
+
+
+async def agenerate_text(prompt, json_mode=False, timeout=None):
+    """Async generate_text() for async views, does not block the event loop"""
+    reply = await get_backend().agenerate(prompt, json_mode=json_mode, timeout=timeout)
+    return reply.strip()
+
+
+def stream_text(prompt, timeout=None):
+    """Send one prompt to the configured backend and yield the reply as it arrives"""
+    return get_backend().stream(prompt, timeout=timeout)
+
+
+def astream_text(prompt, timeout=None):
+    """Async stream_text() for async views, does not block the event loop"""
+    backend = get_backend()
+    if hasattr(backend, 'astream'):
+        return backend.astream(prompt, timeout=timeout)
+    return iterate_in_thread(backend.stream(prompt, timeout=timeout))
+
+
+def embed_text(text, timeout=None):
+    """Embedding vector (list of floats) for `text`"""
+    return get_backend().embed(text, timeout=timeout)
@@ -0,0 +1,369 @@
+"""
+Tolerant parsing and schema validation of AI course payloads.
+
+The model is asked for JSON but sometimes wraps it in prose or Markdown
+fences, leaves raw newlines or stray backslashes (LaTeX, Windows paths)
+inside strings, adds trailing commas or stops mid-object. parse_json()
+handles these without touching replies that are already valid:
+
+1. JSONScanner walks the reply once, tracking strings and nesting, to find
+   the first complete top-level object (it can be fed chunk by chunk, e.g.
+   from a streamed reply). Braces inside strings and prose before or after
+   the object are ignored, unlike a greedy regex.
+2. json.loads() is tried on that object as-is.
+3. Only if that fails, repair() fixes the problems above in one pass and
+   closes a truncated object, and parsing is tried again.
+
+The validators then check parsed data against COURSE_SCHEMA and return
+the path of every problem (e.g. "lessons[2].quizzes[0].correct_answer"),
+so callers can re-request just the broken lesson instead of the course.
+"""
+
+import json
+
+# Shape requested by the course generation prompts
+COURSE_SCHEMA = {
+    'modules': 3,
+    'lessons_per_module': 5,
+    'final_exam_lessons': 1,
+    'min_quizzes': 1,
+    'max_quizzes': 2,
+    'final_exam_min_quizzes': 10,
+    'min_options': 2,
+}
+
+VALID_ESCAPES = set('"\\/bfnrtu')
+CLOSERS = {'{': '}', '[': ']'}
+
+
+class AIResponseError(ValueError):
+    """The reply could not be parsed or does not match the schema"""
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+class JSONScanner:
+    """
+    Incremental scanner for the first top-level JSON object in a text.
+
+    feed() consumes text and returns True once the object is complete;
+    text holds the object's source so far.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.stack = []
+        self.started = False
+        self.complete = False
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, chunk):
+        if self.complete:
+            return True
+        start = 0
+        if not self.started:
+            start = chunk.find('{')
+            if start == -1:
+                return False
+            self.started = True
+        for index in range(start, len(chunk)):
+            char = chunk[index]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in CLOSERS:
+                self.stack.append(char)
+            elif char in '}]' and self.stack:
+                self.stack.pop()
+                if not self.stack:
+                    self.parts.append(chunk[start:index + 1])
+                    self.complete = True
+                    return True
+        self.parts.append(chunk[start:])
+        return False
+
+    @property
+    def text(self):
+        return ''.join(self.parts)
+
+
+def strip_code_fences(text):
+    """Drop Markdown ``` fence lines, keeping what is between them"""
+    lines = [line for line in text.strip().splitlines() if not line.strip().startswith('```')]
+    return '\n'.join(lines)
+
+
+def extract_object(text):
+    """Source of the first top-level JSON object and whether it was cut off"""
+    scanner = JSONScanner()
+    scanner.feed(strip_code_fences(text))
+    if not scanner.started:
+        raise AIResponseError("Reply contains no JSON object")
+    return scanner.text, not scanner.complete
+
+
+def repair(text):
+    """
+    Fix common model mistakes in one pass: raw control characters and
+    invalid escapes inside strings, trailing commas, and (for truncated
+    replies) a dangling key or comma, an unterminated string and unclosed
+    containers.
+    """
+    out = []
+    stack = []
+    in_string = False
+    # Where the last object key started, while it has no value yet
+    key_start = None
+    index = 0
+    while index < len(text):
+        char = text[index]
+        if in_string:
+            if char == '\\':
+                following = text[index + 1:index + 2]
+                if following in VALID_ESCAPES and following:
+                    out.append(text[index:index + 2])
+                    index += 2
+                    continue
+                # A lone backslash (e.g. LaTeX "\alpha", a Windows path) is meant literally
+                out.append('\\\\')
+            elif char == '"':
+                in_string = False
+                out.append(char)
+            elif char == '\n':
+                out.append('\\n')
+            elif char == '\t':
+                out.append('\\t')
+            elif char == '\r':
+                pass
+            else:
+                out.append(char)
+            index += 1
+            continue
+        if key_start is not None and not char.isspace() and char != ':':
+            key_start = None
+        if char == '"':
+            if stack and stack[-1] == '{' and _last_char(out) in '{,':
+                key_start = len(out)
+            in_string = True
+            out.append(char)
+        elif char in CLOSERS:
+            stack.append(char)
+            out.append(char)
+        elif char in '}]':
+            _drop_trailing_comma(out)
+            if stack:
+                stack.pop()
+            out.append(char)
+        else:
+            out.append(char)
+        index += 1
+
+    if key_start is not None:
+        # Truncated inside or right after a key: the key has no value
+        del out[key_start:]
+    elif in_string:
+        out.append('"')
+    repaired = ''.join(out)
+    if stack:
+        # Truncated: drop a dangling comma, then close everything
+        for opener in reversed(stack):
+            repaired = _strip_trailing_comma(repaired) + CLOSERS[opener]
+    return repaired
+
+
+def _last_char(out):
+    """Last non-whitespace character outside strings, '' at the start"""
+    position = len(out) - 1
+    while position >= 0 and out[position].isspace():
+        position -= 1
+    return out[position] if position >= 0 else ''
+
+
+def _drop_trailing_comma(out):
+    position = len(out) - 1
+    while position >= 0 and out[position].isspace():
+        position -= 1
+    if position >= 0 and out[position] == ',':
+        del out[position:]
+
+
+def _strip_trailing_comma(text):
+    text = text.rstrip()
+    return text[:-1].rstrip() if text.endswith(',') else text
+
+
+def parse_json(text):
+    """Parse the first JSON object in a model reply, repairing it if needed"""
+    source, truncated = extract_object(text)
+    if not truncated:
+        try:
+            return json.loads(source)
+        except json.JSONDecodeError:
+            pass
+    repaired = repair(source)
+    try:
+        return json.loads(repaired)
+    except json.JSONDecodeError as e:
+        raise AIResponseError(f"AI response was not valid JSON: {e}. Response text: {source[:100]}...") from e
+
+
+def normalize_quiz(quiz):
+    """
+    Coerce a correct_answer given as the option text or as a digit string
+    into an index. The text wins, so "2" among the options "1", "2", "3"
+    is the second option rather than index 2.
+    """
+    answer = quiz.get('correct_answer')
+    options = quiz.get('options')
+    if isinstance(answer, str) and isinstance(options, list):
+        if answer in options:
+            quiz['correct_answer'] = options.index(answer)
+        elif answer.strip().isdigit():
+            quiz['correct_answer'] = int(answer)
+    return quiz
+
+
+def lesson_errors(lesson, path, is_final_exam=False, schema=COURSE_SCHEMA):
+    """Schema problems of one lesson, as "path: message" strings"""
+    if not isinstance(lesson, dict):
+        return [f"{path}: must be an object"]
+    errors = []
+    if not isinstance(lesson.get('content'), str) or not lesson['content'].strip():
+        errors.append(f"{path}.content: missing")
+    quizzes = lesson.get('quizzes')
+    if quizzes is None and isinstance(lesson.get('quiz'), dict):
+        # Singular 'quiz' from the model
+        quizzes = lesson['quizzes'] = [lesson.pop('quiz')]
+    if not isinstance(quizzes, list):
+        return errors + [f"{path}.quizzes: missing"]
+
+    min_quizzes = schema['final_exam_min_quizzes'] if is_final_exam else schema['min_quizzes']
+    if len(quizzes) < min_quizzes:
+        errors.append(f"{path}.quizzes: expected at least {min_quizzes}, got {len(quizzes)}")
+    if not is_final_exam and len(quizzes) > schema['max_quizzes']:
+        # Extra quizzes are harmless, keep the first ones
+        del quizzes[schema['max_quizzes']:]
+
+    for number, quiz in enumerate(quizzes):
+        quiz_path = f"{path}.quizzes[{number}]"
+        if not isinstance(quiz, dict):
+            errors.append(f"{quiz_path}: must be an object")
+            continue
+        normalize_quiz(quiz)
+        options = quiz.get('options')
+        if not isinstance(quiz.get('question'), str) or not quiz['question'].strip():
+            errors.append(f"{quiz_path}.question: missing")
+        if not isinstance(options, list) or len(options) < schema['min_options']:
+            errors.append(f"{quiz_path}.options: expected at least {schema['min_options']}")
+            continue
+        answer = quiz.get('correct_answer')
+        if isinstance(answer, bool) or not isinstance(answer, int) or not 0 <= answer < len(options):
+            errors.append(f"{quiz_path}.correct_answer: {answer!r} is not an index into options")
+    return errors
+
+
+def validate_outline(data, schema=COURSE_SCHEMA):
+    """Check an outline (titles only); raises AIResponseError listing every problem"""
+    if not isinstance(data, dict):
+        raise AIResponseError("Outline must be an object")
+    errors = []
+    if not isinstance(data.get('title'), str) or not data['title'].strip():
+        errors.append("title: missing")
+    modules = data.get('modules')
+    if not isinstance(modules, list):
+        raise AIResponseError("Invalid outline", errors + ["modules: missing"])
+    if len(modules) != schema['modules']:
+        errors.append(f"modules: expected {schema['modules']}, got {len(modules)}")
+    for number, module in enumerate(modules):
+        path = f"modules[{number}]"
+        lessons = module.get('lessons') if isinstance(module, dict) else None
+        if not isinstance(lessons, list):
+            errors.append(f"{path}.lessons: missing")
+            continue
+        if not isinstance(module.get('title'), str) or not module['title'].strip():
+            errors.append(f"{path}.title: missing")
+        expected = schema['final_exam_lessons'] if number == len(modules) - 1 else schema['lessons_per_module']
+        if len(lessons) != expected:
+            errors.append(f"{path}.lessons: expected {expected}, got {len(lessons)}")
+        if not all(isinstance(title, str) and title.strip() for title in lessons):
+            errors.append(f"{path}.lessons: every lesson needs a title")
+    if errors:
+        raise AIResponseError(f"Invalid outline: {'; '.join(errors)}", errors)
+    if not isinstance(data.get('description'), str):
+        data['description'] = ''
+    return data
+
+
+def module_errors(data, expected_lessons, is_final_exam=False, schema=COURSE_SCHEMA):
+    """
+    Returns (lessons, errors_by_lesson) for a module payload. Structural
+    problems (no lessons list, wrong count) raise AIResponseError since the
+    whole module has to be requested again.
+    """
+    lessons = data.get('lessons') if isinstance(data, dict) else None
+    if not isinstance(lessons, list):
+        raise AIResponseError("Module has no lessons list", ["lessons: missing"])
+    if len(lessons) != expected_lessons:
+        message = f"lessons: expected {expected_lessons}, got {len(lessons)}"
+        raise AIResponseError(f"Invalid module: {message}", [message])
+    errors = {}
+    for number, lesson in enumerate(lessons):
+        problems = lesson_errors(lesson, f"lessons[{number}]", is_final_exam, schema)
+        if problems:
+            errors[number] = problems
+    return lessons, errors
+
+
+def validate_course(data, schema=COURSE_SCHEMA):
+    """
+    Check a whole course payload against the schema. Structural problems
+    raise AIResponseError; lesson-level problems, including lessons missing
+    from a module and lessons without a title, are returned as
+    {(module index, lesson index): errors}. Extra lessons are dropped.
+    Modules missing at the end (a truncated reply) are left to the caller.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('modules'), list) or not data['modules']:
+        raise AIResponseError("Course has no modules", ["modules: missing"])
+    if not isinstance(data.get('title'), str) or not data['title'].strip():
+        raise AIResponseError("Course has no title", ["title: missing"])
+    modules = data['modules']
+    if len(modules) > schema['modules']:
+        message = f"modules: expected {schema['modules']}, got {len(modules)}"
+        raise AIResponseError(f"Invalid course: {message}", [message])
+    data.setdefault('description', '')
+    errors = {}
+    for module_number, module in enumerate(modules):
+        if not isinstance(module, dict):
+            raise AIResponseError(f"Module {module_number} must be an object", [f"modules[{module_number}]: must be an object"])
+        if not isinstance(module.get('lessons'), list):
+            # Cut off before its lessons, they are all missing
+            module['lessons'] = []
+        module.setdefault('order', module_number + 1)
+        module.setdefault('title', f'Module {module_number + 1}')
+        is_final_exam = module_number == schema['modules'] - 1
+        expected = schema['final_exam_lessons'] if is_final_exam else schema['lessons_per_module']
+        lessons = module['lessons']
+        del lessons[expected:]
+        for lesson_number in range(expected):
+            path = f"modules[{module_number}].lessons[{lesson_number}]"
+            if lesson_number >= len(lessons):
+                errors[(module_number, lesson_number)] = [f"{path}: missing"]
+                continue
+            lesson = lessons[lesson_number]
+            problems = lesson_errors(lesson, path, is_final_exam, schema)
+            if isinstance(lesson, dict):
+                lesson.setdefault('order', lesson_number + 1)
+                if not isinstance(lesson.get('title'), str) or not lesson['title'].strip():
+                    problems.append(f"{path}.title: missing")
+            if problems:
+                errors[(module_number, lesson_number)] = problems
+    return errors
@@ -0,0 +1,164 @@
+"""
+Response cache for the lesson chatbot.
+
+Students in a cohort ask the same questions about the same lesson, so
+answers are cached per lesson, course language and normalized question
+("What is a list?" and "what is a LIST" share an entry, "C++" and "C#"
+don't). Entries live in the separate 'lesson_chatbot' cache alias, which
+expires them after LESSON_CHATBOT_CACHE_TIMEOUT seconds and evicts the
+least recently used ones beyond LESSON_CHATBOT_CACHE_MAX_ENTRIES (locmem;
+with Redis set maxmemory-policy allkeys-lru).
+
+Each lesson has a version token in its keys. invalidate_lesson() swaps
+the token when the lesson or its quizzes change, which orphans every
+cached answer for that lesson at once. If the token itself is evicted a
+new one is drawn, which also only ever drops answers.
+
+With LESSON_CHATBOT_SEMANTIC_CACHE enabled, a miss on the exact key
+falls back to comparing the question's embedding with recently answered
+questions for the lesson, and reuses an answer whose cosine similarity is
+at least LESSON_CHATBOT_SIMILARITY and whose question has the same
+numbers, names like "C++" and operators (see topics.significant_tokens).
+
+Hits and misses are counted in the default cache, see get_stats(). The
+lesson_chatbot_cache_stats command can only read them from a cache shared
+between processes (CACHE_BACKEND=redis or file).
+"""
+
+import hashlib
+import math
+import unicodedata
+import uuid
+from django.conf import settings
+from django.core.cache import cache, caches
+from . import ai_client
+from .topics import significant_tokens
+
+STATS_KEYS = {
+    'hits': 'lesson-chatbot:stats:hits',
+    'semantic_hits': 'lesson-chatbot:stats:semantic-hits',
+    'misses': 'lesson-chatbot:stats:misses',
+}
+
+
+def answer_cache():
+    return caches['lesson_chatbot']
+
+
+def normalize_question(question):
+    """
+    Case- and whitespace-insensitive form of a question, without trailing
+    "?", "!" or ".". Other punctuation is kept: "a == b" and "a != b",
+    "C++" and "C#" are different questions.
+    """
+    question = ' '.join(unicodedata.normalize('NFKC', question).casefold().split())
+    return question.rstrip('?!. ')
+
+
+def lesson_version(lesson_id):
+    key = f'lesson-chatbot:version:{lesson_id}'
+    version = answer_cache().get(key)
+    if version is None:
+        answer_cache().add(key, uuid.uuid4().hex[:12], timeout=None)
+        version = answer_cache().get(key)
+    return version
+
+
+def invalidate_lesson(lesson_id):
+    """Forget every cached answer about this lesson"""
+    answer_cache().set(f'lesson-chatbot:version:{lesson_id}', uuid.uuid4().hex[:12], timeout=None)
+
+
+def answer_key(lesson_id, version, language, question):
+    digest = hashlib.sha256(normalize_question(question).encode('utf-8')).hexdigest()
+    return f'lesson-chatbot:answer:{lesson_id}:{version}:{language}:{digest}'
+
+
+def semantic_index_key(lesson_id, version, language):
+    return f'lesson-chatbot:questions:{lesson_id}:{version}:{language}'
+
+
+def cosine_similarity(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def record(stat):
+    key = STATS_KEYS[stat]
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The key was evicted between add() and incr()
+        cache.set(key, 1, timeout=None)
+
+
+def get_stats():
+    """Hit/miss counters and the overall hit rate"""
+    values = cache.get_many(STATS_KEYS.values())
+    stats = {name: values.get(key, 0) for name, key in STATS_KEYS.items()}
+    lookups = sum(stats.values())
+    stats['hit_rate'] = (stats['hits'] + stats['semantic_hits']) / lookups if lookups else 0.0
+    return stats
+
+
+def reset_stats():
+    cache.delete_many(STATS_KEYS.values())
+
+
+def _semantic_lookup(lesson_id, version, language, question):
+    index = answer_cache().get(semantic_index_key(lesson_id, version, language)) or []
+    if not index:
+        return None
+    embedding = ai_client.embed_text(normalize_question(question))
+    required = significant_tokens(normalize_question(question))
+    best_key, best_score = None, settings.LESSON_CHATBOT_SIMILARITY
+    for candidate, key, tokens in index:
+        if tokens != required:
+            continue
+        score = cosine_similarity(embedding, candidate)
+        if score >= best_score:
+            best_key, best_score = key, score
+    return answer_cache().get(best_key) if best_key else None
+
+
+def get_cached_answer(lesson_id, language, question):
+    """The cached answer to `question`, or None on a miss"""
+    version = lesson_version(lesson_id)
+    answer = answer_cache().get(answer_key(lesson_id, version, language, question))
+    if answer is not None:
+        record('hits')
+        return answer
+
+    if settings.LESSON_CHATBOT_SEMANTIC_CACHE:
+        try:
+            answer = _semantic_lookup(lesson_id, version, language, question)
+        except Exception as e:
+            # An embedding failure only costs the cache hit
+            print(f"Lesson chatbot semantic lookup error: {e}")
+            answer = None
+        if answer is not None:
+            record('semantic_hits')
+            return answer
+
+    record('misses')
+    return None
+
+
+def cache_answer(lesson_id, language, question, answer):
+    version = lesson_version(lesson_id)
+    key = answer_key(lesson_id, version, language, question)
+    answer_cache().set(key, answer)
+
+    if settings.LESSON_CHATBOT_SEMANTIC_CACHE:
+        try:
+            embedding = ai_client.embed_text(normalize_question(question))
+        except Exception as e:
+            print(f"Lesson chatbot embedding error: {e}")
+            return
+        index_key = semantic_index_key(lesson_id, version, language)
+        index = answer_cache().get(index_key) or []
+        index = [entry for entry in index if entry[1] != key]
+        index.append((embedding, key, significant_tokens(normalize_question(question))))
+        answer_cache().set(index_key, index[-settings.LESSON_CHATBOT_SEMANTIC_CANDIDATES:])
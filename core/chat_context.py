@@ -0,0 +1,118 @@
+"""
+Conversation context for the chatbot.
+
+The chatbot prompt carries the last CHATBOT_CONTEXT_MESSAGES messages and a
+rolling summary of everything before them, so its size stays bounded
+however long a chat grows. get_chat_context() reads the window in one
+query, newest first, plus the user's ChatSummary.
+
+The window query also returns up to CHATBOT_SUMMARY_BATCH messages just
+older than the window. Those not yet in the summary are the ones to fold
+in: once a whole batch has piled up, schedule_chat_summary() has the
+model merge them into the summary, in Celery when it is enabled. Between
+two summaries at most one batch of older turns is absent from the prompt.
+
+send_message, send_message_stream and chatbot_response_task all build
+their prompt from this context.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from . import ai_client
+from .models import ChatMessage, ChatSummary
+
+SUMMARY_PROMPT = """Summarize this conversation between a user and a course-planning assistant.
+Keep what matters for continuing it: the topic the user wants to learn, their level, goals and preferences, and what was already agreed.
+Write at most 120 words, in the language of the conversation.
+
+Summary so far:
+{summary}
+
+Newer messages:
+{messages}
+
+Updated summary:"""
+
+
+class ChatContext:
+    """Summary of older turns, the recent messages and the older ones not yet summarized"""
+
+    def __init__(self, summary='', messages=(), unsummarized=()):
+        self.summary = summary
+        self.messages = list(messages)
+        self.unsummarized = list(unsummarized)
+
+    @property
+    def needs_summary(self):
+        return len(self.unsummarized) >= settings.CHATBOT_SUMMARY_BATCH
+
+
+def window_query(user, before_id=None):
+    messages = ChatMessage.objects.filter(user=user)
+    if before_id is not None:
+        # Leave out the message being answered and anything after it
+        messages = messages.filter(id__lt=before_id)
+    size = settings.CHATBOT_CONTEXT_MESSAGES + settings.CHATBOT_SUMMARY_BATCH
+    return messages.order_by('-created_at', '-id')[:size]
+
+
+def split_window(newest_first, summary):
+    recent = newest_first[:settings.CHATBOT_CONTEXT_MESSAGES]
+    older = newest_first[settings.CHATBOT_CONTEXT_MESSAGES:]
+    last_summarized = summary.last_message_id if summary else 0
+    unsummarized = [message for message in older if message.id > last_summarized]
+    return ChatContext(summary.summary if summary else '', reversed(recent), reversed(unsummarized))
+
+
+def get_chat_context(user, before_id=None):
+    """Context for answering `user`'s next message (or message `before_id`)"""
+    window = list(window_query(user, before_id))
+    return split_window(window, ChatSummary.objects.filter(user=user).first())
+
+
+async def aget_chat_context(user, before_id=None):
+    window = [message async for message in window_query(user, before_id)]
+    return split_window(window, await ChatSummary.objects.filter(user=user).afirst())
+
+
+def format_messages(messages):
+    return '\n'.join(f"{'User' if message.is_user else 'Assistant'}: {message.message}" for message in messages)
+
+
+def summarize_chat(user_id):
+    """Fold the messages that left the context window into the user's summary"""
+    context = get_chat_context(user_id)
+    if not context.needs_summary:
+        return False
+    prompt = SUMMARY_PROMPT.format(
+        summary=context.summary or '(none)',
+        messages=format_messages(context.unsummarized),
+    )
+    summary = ai_client.generate_text(prompt).strip()
+    ChatSummary.objects.update_or_create(
+        user_id=user_id,
+        defaults={'summary': summary, 'last_message_id': context.unsummarized[-1].id}
+    )
+    return True
+
+
+def schedule_chat_summary(user_id, context):
+    """Update the summary after the current transaction commits if `context` has a full batch to fold in"""
+    if not context.needs_summary:
+        return
+
+    def run():
+        if getattr(settings, 'USE_CELERY', False):
+            try:
+                from .tasks import summarize_chat_task
+                summarize_chat_task.delay(user_id)
+                return
+            except Exception as e:
+                print(f"Could not queue chat summary, running inline: {e}")
+        try:
+            summarize_chat(user_id)
+        except Exception as e:
+            # The chat works without a summary, it is retried with the next message
+            print(f"Error summarizing chat: {e}")
+
+    transaction.on_commit(run)
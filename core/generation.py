@@ -0,0 +1,460 @@
+"""
+Staged course generation.
+
+Instead of one long prompt for the whole course, generation runs in three
+stages:
+
+1. A short prompt returns the outline: course title, description and the
+   module and lesson titles.
+2. The lessons of every module (content and quizzes) are requested
+   concurrently, one prompt per module, from a thread pool of
+   COURSE_GENERATION_WORKERS (asyncio.gather in the async variant).
+3. The pieces are validated and assembled into the same course data that
+   services.save_course_tree() takes.
+
+Latency is roughly the outline plus the slowest module rather than the
+sum of all content, and a malformed piece is retried on its own, up to
+COURSE_GENERATION_PIECE_ATTEMPTS times, instead of failing the course.
+When a module fails for good the modules not yet requested are cancelled,
+since the course fails anyway.
+Replies are parsed and checked by core.ai_json: a module with the wrong
+shape is requested again, while a module with a few broken lessons keeps
+the good ones and only the broken lessons are requested again.
+"""
+
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from . import ai_client
+from .retries import is_transient
+from .ai_json import COURSE_SCHEMA, AIResponseError, parse_json, validate_outline, module_errors, lesson_errors, validate_course
+
+LANGUAGE_NAMES = {
+    'en': 'English',
+    'ru': 'Russian',
+    'kaa': 'Karakalpak (Latin script)',
+    'uz': "Uzbek (Latin script)",
+}
+
+# The final exam names and language rules of the single-prompt
+# COURSE_GENERATION_PROMPTS (core.services), so a staged course is
+# localized the same way
+STAGED_LANGUAGES = {
+    'en': {
+        'final_exam': 'Final Exam',
+        'final_assessment': 'Final Assessment',
+        'rules': 'All content must be in English.',
+    },
+    'ru': {
+        'final_exam': 'Итоговый экзамен',
+        'final_assessment': 'Итоговая оценка',
+        'rules': 'Весь контент должен быть на русском языке.',
+    },
+    'kaa': {
+        'final_exam': 'Juwmaqlawshı imtihan',
+        'final_assessment': 'Juwmaqlawshı sınaq',
+        'rules': """TİL TALABI:
+1. Barlıq kontent (atamalar, sabaq mazmunı, testler) TEK ǴANA Qaraqalpaq tilinde (Latın grafikasında) bolıwı shárt.
+2. Ózbek, Qazaq yamasa basqa tillerdi aralastırmań.
+3. Háriplerdi durıs qollanıń: (ı, ú, ó, ǵ, ń, sh, ch).""",
+    },
+    'uz': {
+        'final_exam': 'Yakuniy imtihon',
+        'final_assessment': 'Yakuniy sinov',
+        'rules': """TIL TALABI:
+1. Barcha kontent (nomlar, dars mazmuni, testlar) FAQAT O'zbek tilida (Lotin grafikasida) bo'lishi shart.
+2. Rus yoki boshqa tillarni aralashtirmang.""",
+    },
+}
+
+
+def staged_language(language):
+    return STAGED_LANGUAGES.get(language, STAGED_LANGUAGES['en'])
+
+OUTLINE_PROMPT = """Plan a comprehensive course on: "{topic}".
+Return only the outline as a valid JSON object with this structure:
+{{
+    "title": "Course Title",
+    "description": "Course Description",
+    "modules": [
+        {{"title": "Module Title", "order": 1, "lessons": ["Lesson Title", "Lesson Title"]}}
+    ]
+}}
+Generate exactly 3 modules.
+Modules 1 and 2 must have 5 lessons each.
+Module 3 must be named "{final_exam}" and contain exactly 1 lesson named "{final_assessment}".
+Do not write lesson content yet.
+The titles and the description must be in {language}.
+{language_rules}"""
+
+MODULE_PROMPT = """You are writing one module of the course "{course_title}".
+Course description: {course_description}
+Course outline: {outline}
+
+Write module {order}, "{module_title}". LESSON TITLES: {lesson_titles}
+Return a valid JSON object with exactly these lessons, in this order:
+{{
+    "lessons": [
+        {{
+            "title": "Lesson Title",
+            "content": "Detailed lesson content in Markdown format...",
+            "quizzes": [
+                {{
+                    "question": "Quiz Question?",
+                    "options": ["Option A", "Option B", "Option C", "Option D"],
+                    "correct_answer": 0
+                }}
+            ]
+        }}
+    ]
+}}
+{quiz_rule}
+{language_rules}"""
+
+LESSON_PROMPT = """You are writing one lesson of the course "{course_title}", module "{module_title}".
+REWRITE LESSON: {lesson_title}
+Return a valid JSON object for this lesson only:
+{{
+    "title": "Lesson Title",
+    "content": "Detailed lesson content in Markdown format...",
+    "quizzes": [
+        {{
+            "question": "Quiz Question?",
+            "options": ["Option A", "Option B", "Option C", "Option D"],
+            "correct_answer": 0
+        }}
+    ]
+}}
+"correct_answer" is the 0-based index of the correct option.
+{quiz_rule}
+{language_rules}"""
+
+LESSON_QUIZ_RULE = "Each lesson must have 1 or 2 quizzes."
+FINAL_EXAM_QUIZ_RULE = "The lesson must have at least 10 quizzes covering the entire course."
+
+
+def outline_prompt(topic, language):
+    names = staged_language(language)
+    return OUTLINE_PROMPT.format(
+        topic=topic,
+        language=LANGUAGE_NAMES.get(language, 'English'),
+        final_exam=names['final_exam'],
+        final_assessment=names['final_assessment'],
+        language_rules=names['rules'],
+    )
+
+
+def module_prompt(outline, module, language):
+    # The outline asks for the final exam as the last module
+    is_final_exam = len(outline['modules']) > 1 and module is outline['modules'][-1]
+    summary = [{'title': m['title'], 'lessons': m['lessons']} for m in outline['modules']]
+    return MODULE_PROMPT.format(
+        course_title=outline['title'],
+        course_description=outline['description'],
+        outline=json.dumps(summary, ensure_ascii=False),
+        order=module.get('order', outline['modules'].index(module) + 1),
+        module_title=module['title'],
+        lesson_titles=json.dumps(module['lessons'], ensure_ascii=False),
+        quiz_rule=FINAL_EXAM_QUIZ_RULE if is_final_exam else LESSON_QUIZ_RULE,
+        language_rules=staged_language(language)['rules'],
+    ), is_final_exam
+
+
+def is_retryable(exc):
+    """A malformed reply or a transient API error; anything else fails the same way again"""
+    return isinstance(exc, AIResponseError) or is_transient(exc)
+
+
+class GenerationCancelled(Exception):
+    """Another piece of the course failed, so this one is no longer needed"""
+
+
+def with_retries(produce, description, cancelled=None):
+    """
+    Call produce() until it succeeds, at most COURSE_GENERATION_PIECE_ATTEMPTS
+    times, unless the `cancelled` event is set in between
+    """
+    attempts = settings.COURSE_GENERATION_PIECE_ATTEMPTS
+    for attempt in range(1, attempts + 1):
+        if cancelled is not None and cancelled.is_set():
+            raise GenerationCancelled(description)
+        try:
+            return produce()
+        except Exception as e:
+            print(f"Generating {description} failed (attempt {attempt}/{attempts}): {e}")
+            if attempt == attempts or not is_retryable(e):
+                raise
+
+
+async def awith_retries(produce, description):
+    attempts = settings.COURSE_GENERATION_PIECE_ATTEMPTS
+    for attempt in range(1, attempts + 1):
+        try:
+            return await produce()
+        except Exception as e:
+            print(f"Generating {description} failed (attempt {attempt}/{attempts}): {e}")
+            if attempt == attempts or not is_retryable(e):
+                raise
+
+
+def lesson_prompt(course_title, module_title, lesson_title, is_final_exam, language):
+    return LESSON_PROMPT.format(
+        course_title=course_title,
+        module_title=module_title,
+        lesson_title=lesson_title,
+        quiz_rule=FINAL_EXAM_QUIZ_RULE if is_final_exam else LESSON_QUIZ_RULE,
+        language_rules=staged_language(language)['rules'],
+    )
+
+
+def parse_lesson(text, is_final_exam):
+    lesson = parse_json(text)
+    errors = lesson_errors(lesson, 'lesson', is_final_exam)
+    if errors:
+        raise AIResponseError(f"Invalid lesson: {'; '.join(errors)}", errors)
+    return lesson
+
+
+def generate_outline(topic, language='en'):
+    prompt = outline_prompt(topic, language)
+    return with_retries(
+        lambda: validate_outline(parse_json(ai_client.generate_text(prompt, json_mode=True))),
+        'outline'
+    )
+
+
+def generate_lesson(course_title, module_title, lesson_title, is_final_exam, language='en', cancelled=None):
+    """One lesson on its own, when the copy in its module's reply was broken"""
+    prompt = lesson_prompt(course_title, module_title, lesson_title, is_final_exam, language)
+    return with_retries(
+        lambda: parse_lesson(ai_client.generate_text(prompt, json_mode=True), is_final_exam),
+        f"lesson {lesson_title!r}",
+        cancelled
+    )
+
+
+def generate_module(outline, module, language='en', cancelled=None):
+    """
+    Lessons (content and quizzes) of one outline module. Modules generated
+    together share the `cancelled` event: a module that fails sets it, and
+    the others stop before their next request, since the course fails anyway.
+    """
+    try:
+        return _generate_module(outline, module, language, cancelled)
+    except GenerationCancelled:
+        raise
+    except Exception:
+        if cancelled is not None:
+            cancelled.set()
+        raise
+
+
+def _generate_module(outline, module, language, cancelled):
+    prompt, is_final_exam = module_prompt(outline, module, language)
+    lessons, errors = with_retries(
+        lambda: module_errors(
+            parse_json(ai_client.generate_text(prompt, json_mode=True)), len(module['lessons']), is_final_exam
+        ),
+        f"module {module['title']!r}",
+        cancelled
+    )
+    for index, problems in errors.items():
+        print(f"Lesson {module['lessons'][index]!r} is invalid, requesting it again: {'; '.join(problems)}")
+        lessons[index] = generate_lesson(
+            outline['title'], module['title'], module['lessons'][index], is_final_exam, language, cancelled
+        )
+    return lessons
+
+
+async def agenerate_outline(topic, language='en'):
+    prompt = outline_prompt(topic, language)
+
+    async def produce():
+        return validate_outline(parse_json(await ai_client.agenerate_text(prompt, json_mode=True)))
+
+    return await awith_retries(produce, 'outline')
+
+
+async def agenerate_lesson(course_title, module_title, lesson_title, is_final_exam, language='en'):
+    prompt = lesson_prompt(course_title, module_title, lesson_title, is_final_exam, language)
+
+    async def produce():
+        return parse_lesson(await ai_client.agenerate_text(prompt, json_mode=True), is_final_exam)
+
+    return await awith_retries(produce, f"lesson {lesson_title!r}")
+
+
+async def agenerate_module(outline, module, language='en'):
+    prompt, is_final_exam = module_prompt(outline, module, language)
+
+    async def produce():
+        text = await ai_client.agenerate_text(prompt, json_mode=True)
+        return module_errors(parse_json(text), len(module['lessons']), is_final_exam)
+
+    lessons, errors = await awith_retries(produce, f"module {module['title']!r}")
+    replacements = await asyncio.gather(*(
+        agenerate_lesson(outline['title'], module['title'], module['lessons'][index], is_final_exam, language)
+        for index in errors
+    ))
+    for index, lesson in zip(errors, replacements):
+        lessons[index] = lesson
+    return lessons
+
+
+def lesson_title(lesson):
+    title = lesson.get('title') if isinstance(lesson, dict) else None
+    return title if isinstance(title, str) and title.strip() else None
+
+
+def needs_outline(course_data, errors):
+    """Whether modules are missing or a lesson to request again has no title of its own"""
+    modules = course_data['modules']
+    if len(modules) < COURSE_SCHEMA['modules']:
+        return True
+    for module_index, lesson_index in errors:
+        lessons = modules[module_index]['lessons']
+        if lesson_index >= len(lessons) or lesson_title(lessons[lesson_index]) is None:
+            return True
+    return False
+
+
+def course_outline(course_data, fresh_outline=None):
+    """
+    Outline of a whole-course reply: the reply's own module and lesson
+    titles, with the titles it lacks (lessons and modules cut off, lessons
+    without a title) taken from `fresh_outline`, an outline requested for
+    the course title.
+    """
+    modules = []
+    for module_index in range(COURSE_SCHEMA['modules']):
+        fresh = fresh_outline['modules'][module_index] if fresh_outline else None
+        if module_index < len(course_data['modules']):
+            module = course_data['modules'][module_index]
+            lessons = module['lessons']
+            titles = [
+                (lesson_title(lessons[index]) if index < len(lessons) else None) or fresh['lessons'][index]
+                for index in range(len(fresh['lessons']) if fresh else len(lessons))
+            ]
+            modules.append({'title': module['title'], 'order': module['order'], 'lessons': titles})
+        else:
+            modules.append({'title': fresh['title'], 'order': module_index + 1, 'lessons': fresh['lessons']})
+    return {'title': course_data['title'], 'description': course_data['description'], 'modules': modules}
+
+
+def place_lesson(module, index, title, lesson):
+    """Put a requested lesson into its slot, under the outline's title"""
+    lesson['title'] = title
+    lesson['order'] = index + 1
+    lessons = module['lessons']
+    if index < len(lessons):
+        lessons[index] = lesson
+    else:
+        # Validation reports missing lessons in order
+        lessons.append(lesson)
+
+
+def repair_course(course_data, language='en'):
+    """
+    Validate a course generated with a single prompt and request again
+    only what is broken or missing: invalid lessons one by one, the lessons
+    a truncated reply lost, and whole modules it lost, so the course ends
+    up with the schema's module and lesson counts. The titles of lost
+    lessons and modules come from an outline, requested only when needed.
+    Raises AIResponseError if the course itself has no usable structure.
+    """
+    errors = validate_course(course_data)
+    fresh_outline = None
+    if needs_outline(course_data, errors):
+        fresh_outline = generate_outline(course_data['title'], language)
+    outline = course_outline(course_data, fresh_outline)
+    modules = course_data['modules']
+    for module_index, lesson_index in errors:
+        module = outline['modules'][module_index]
+        title = module['lessons'][lesson_index]
+        lesson = generate_lesson(
+            course_data['title'], module['title'], title, is_final_exam_module(module_index), language
+        )
+        place_lesson(modules[module_index], lesson_index, title, lesson)
+    for module in outline['modules'][len(modules):]:
+        lessons = generate_module(outline, module, language)
+        modules.append(assemble_module(module, lessons))
+    return course_data
+
+
+async def arepair_course(course_data, language='en'):
+    errors = validate_course(course_data)
+    fresh_outline = None
+    if needs_outline(course_data, errors):
+        fresh_outline = await agenerate_outline(course_data['title'], language)
+    outline = course_outline(course_data, fresh_outline)
+    modules = course_data['modules']
+    missing_modules = outline['modules'][len(modules):]
+    lessons, module_lessons = await asyncio.gather(
+        asyncio.gather(*(
+            agenerate_lesson(
+                course_data['title'], outline['modules'][module_index]['title'],
+                outline['modules'][module_index]['lessons'][lesson_index],
+                is_final_exam_module(module_index), language
+            )
+            for module_index, lesson_index in errors
+        )),
+        asyncio.gather(*(agenerate_module(outline, module, language) for module in missing_modules))
+    )
+    for (module_index, lesson_index), lesson in zip(errors, lessons):
+        title = outline['modules'][module_index]['lessons'][lesson_index]
+        place_lesson(modules[module_index], lesson_index, title, lesson)
+    for module, generated in zip(missing_modules, module_lessons):
+        modules.append(assemble_module(module, generated))
+    return course_data
+
+
+def is_final_exam_module(index):
+    return index == COURSE_SCHEMA['modules'] - 1
+
+
+def assemble_module(module, lessons):
+    for order, (title, lesson) in enumerate(zip(module['lessons'], lessons), start=1):
+        # The outline's titles win, the model sometimes rewords them
+        lesson['title'] = title
+        lesson['order'] = order
+    return {'title': module['title'], 'order': module['order'], 'lessons': lessons}
+
+
+def assemble_course(outline, module_lessons):
+    """Course data in the shape services.save_course_tree() expects"""
+    modules = [
+        assemble_module({**module, 'order': module.get('order', index)}, lessons)
+        for index, (module, lessons) in enumerate(zip(outline['modules'], module_lessons), start=1)
+    ]
+    return {'title': outline['title'], 'description': outline['description'], 'modules': modules}
+
+
+def generate_course_staged(topic, language='en'):
+    """Outline first, then every module's lessons in parallel, then assemble"""
+    outline = generate_outline(topic, language)
+    workers = max(1, min(settings.COURSE_GENERATION_WORKERS, len(outline['modules'])))
+    cancelled = threading.Event()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(generate_module, outline, module, language, cancelled) for module in outline['modules']]
+    # Report the module that failed, not the ones it cancelled
+    for future in futures:
+        error = future.exception()
+        if error is not None and not isinstance(error, GenerationCancelled):
+            raise error
+    return assemble_course(outline, [future.result() for future in futures])
+
+
+async def agenerate_course_staged(topic, language='en'):
+    """Async generate_course_staged, modules are requested concurrently on the event loop"""
+    outline = await agenerate_outline(topic, language)
+    tasks = [asyncio.ensure_future(agenerate_module(outline, module, language)) for module in outline['modules']]
+    try:
+        module_lessons = await asyncio.gather(*tasks)
+    except BaseException:
+        # gather() leaves the other modules running
+        for task in tasks:
+            task.cancel()
+        raise
+    return assemble_course(outline, module_lessons)
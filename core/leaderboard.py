@@ -0,0 +1,175 @@
+"""
+Leaderboard queries.
+
+Ranks are computed in the database with a RANK() window over
+CustomUser.total_xp, so a page of the leaderboard is a single query no
+matter how many users there are. Pages after the first are fetched with
+a keyset cursor of the form "<rank>:<user id>".
+
+The top of the board, a user's rank and the users around them are read
+from the ranking backend (core.ranking) instead of the database. The first
+page is additionally kept as a snapshot in Django's cache and
+shared by the leaderboard and gamification pages. It is rebuilt after
+LEADERBOARD_SNAPSHOT_TTL seconds or LEADERBOARD_SNAPSHOT_MAX_EVENTS XP
+changes, whichever comes first, and only one worker rebuilds it at a time.
+"""
+
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Q, Window
+from django.db.models.functions import Rank
+from .models import CustomUser
+from .ranking import get_ranking, member_key
+
+PAGE_SIZE = 100
+
+SNAPSHOT_KEY = 'leaderboard:snapshot'
+EVENTS_KEY = 'leaderboard:xp-events'
+REBUILD_LOCK_KEY = 'leaderboard:rebuild-lock'
+REBUILD_LOCK_TIMEOUT = 30  # seconds, in case a rebuilding worker dies
+
+
+def ranked_users():
+    """All users with XP, annotated with their competition rank"""
+    return (
+        CustomUser.objects.filter(total_xp__gt=0)
+        .only('id', 'username', 'total_xp')
+        .annotate(rank=Window(Rank(), order_by=F('total_xp').desc()))
+        .order_by('-total_xp', '-id')
+    )
+
+
+def parse_cursor(cursor):
+    """Parse a "<rank>:<user id>" cursor, returns None if it is malformed"""
+    try:
+        rank, user_id = cursor.split(':')
+        return int(rank), int(user_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def get_leaderboard_page(after=None, limit=PAGE_SIZE):
+    """
+    Return (users, next_cursor) for one page of the leaderboard.
+
+    Filters on the rank annotation are applied outside the window, so
+    ranks stay global on every page.
+    """
+    queryset = ranked_users()
+    position = parse_cursor(after)
+    if position:
+        rank, user_id = position
+        queryset = queryset.filter(Q(rank__gt=rank) | Q(rank=rank, id__lt=user_id))
+
+    users = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = f'{users[-1].rank}:{users[-1].id}'
+    return users, next_cursor
+
+
+def _ranked_entries(entries, start):
+    """
+    Attach usernames and competition ranks to (member, score) pairs that
+    start at position `start` of the ranking.
+    """
+    ranking = get_ranking()
+    entries = [(int(member), int(score)) for member, score in entries if score > 0]
+    if not entries:
+        return []
+    usernames = dict(
+        CustomUser.objects.filter(id__in=[user_id for user_id, _ in entries]).values_list('id', 'username')
+    )
+
+    users = []
+    rank = ranking.zcount(f'({entries[0][1]}', '+inf') + 1
+    for offset, (user_id, xp) in enumerate(entries):
+        if offset and xp != users[-1]['total_xp']:
+            rank = start + offset + 1
+        users.append({'id': user_id, 'username': usernames.get(user_id, ''), 'total_xp': xp, 'rank': rank})
+    return users
+
+
+def get_top_users(limit):
+    """Top `limit` users from the ranking backend"""
+    return _ranked_entries(get_ranking().zrevrange(0, limit - 1, withscores=True), 0)
+
+
+def get_users_around(user, radius=2):
+    """The user with up to `radius` neighbours above and below them"""
+    ranking = get_ranking()
+    position = ranking.zrevrank(member_key(user.id))
+    if position is None:
+        return []
+    start = max(0, position - radius)
+    return _ranked_entries(ranking.zrevrange(start, position + radius, withscores=True), start)
+
+
+def get_user_rank(user):
+    """Competition rank of a user (None if they have no XP yet)"""
+    ranking = get_ranking()
+    score = ranking.zscore(member_key(user.id))
+    if not score or score <= 0:
+        return None
+    return ranking.zcount(f'({score}', '+inf') + 1
+
+
+def build_snapshot():
+    """Compute the first leaderboard page as plain, cacheable data"""
+    users = get_top_users(PAGE_SIZE + 1)
+    next_cursor = None
+    if len(users) > PAGE_SIZE:
+        users = users[:PAGE_SIZE]
+        next_cursor = f"{users[-1]['rank']}:{users[-1]['id']}"
+    return {
+        'built_at': time.time(),
+        'next_cursor': next_cursor,
+        'users': users,
+    }
+
+
+def rebuild_snapshot():
+    snapshot = build_snapshot()
+    cache.set(SNAPSHOT_KEY, snapshot, timeout=None)
+    cache.set(EVENTS_KEY, 0, timeout=None)
+    return snapshot
+
+
+def get_snapshot():
+    """
+    Return the cached leaderboard snapshot, rebuilding it when it is stale.
+
+    When the snapshot is stale, the worker that wins the cache.add() lock
+    rebuilds it while the others keep serving the stale copy.
+    """
+    cached = cache.get_many([SNAPSHOT_KEY, EVENTS_KEY])
+    snapshot = cached.get(SNAPSHOT_KEY)
+    events = cached.get(EVENTS_KEY, 0)
+
+    if snapshot is not None:
+        age = time.time() - snapshot['built_at']
+        if age < settings.LEADERBOARD_SNAPSHOT_TTL and events < settings.LEADERBOARD_SNAPSHOT_MAX_EVENTS:
+            return snapshot
+
+    if cache.add(REBUILD_LOCK_KEY, 1, timeout=REBUILD_LOCK_TIMEOUT):
+        try:
+            return rebuild_snapshot()
+        finally:
+            cache.delete(REBUILD_LOCK_KEY)
+
+    if snapshot is None:
+        # Cold cache and another worker is rebuilding: compute without storing
+        snapshot = build_snapshot()
+    return snapshot
+
+
+def note_xp_event():
+    """Count an XP change towards the next snapshot rebuild"""
+    cache.add(EVENTS_KEY, 0, timeout=None)
+    try:
+        cache.incr(EVENTS_KEY)
+    except ValueError:
+        # The key was evicted between add() and incr()
+        cache.set(EVENTS_KEY, 1, timeout=None)
@@ -0,0 +1,106 @@
+import time
+from statistics import median
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from core.models import Course, Module, Lesson, Quiz
+from core.services import save_course_tree
+
+
+def build_course_data(module_count, lessons_per_module, quizzes_per_lesson):
+    """A synthetic parsed course shaped like the AI output"""
+    return {
+        'title': 'Benchmark course',
+        'description': 'Synthetic course for insert benchmarks',
+        'modules': [
+            {
+                'title': f'Module {m}',
+                'order': m,
+                'lessons': [
+                    {
+                        'title': f'Lesson {m}.{l}',
+                        'content': '## Heading\n\n' + 'Lesson body text. ' * 200,
+                        'quizzes': [
+                            {
+                                'question': f'Question {q}?',
+                                'options': ['Option A', 'Option B', 'Option C', 'Option D'],
+                                'correct_answer': q % 4,
+                            }
+                            for q in range(quizzes_per_lesson)
+                        ],
+                    }
+                    for l in range(1, lessons_per_module + 1)
+                ],
+            }
+            for m in range(1, module_count + 1)
+        ],
+    }
+
+
+def save_course_per_row(course_data, language='en'):
+    """The previous implementation: one INSERT per course, module, lesson and quiz"""
+    with transaction.atomic():
+        course = Course.objects.create(
+            title=course_data['title'], description=course_data['description'], language=language
+        )
+        for mod_data in course_data['modules']:
+            module = Module.objects.create(course=course, title=mod_data['title'], order=mod_data['order'])
+            for lesson_data in mod_data['lessons']:
+                lesson = Lesson.objects.create(
+                    module=module, title=lesson_data['title'], content=lesson_data['content'],
+                    order=lesson_data.get('order', 1)
+                )
+                for quiz_data in lesson_data.get('quizzes', []):
+                    Quiz.objects.create(
+                        lesson=lesson, question=quiz_data['question'], options=quiz_data['options'],
+                        correct_answer=quiz_data['options'][quiz_data['correct_answer']]
+                    )
+    return course
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks per-row vs bulk inserts of a generated course. '
+        'Lock-hold time runs from the first write statement to commit. '
+        'Benchmark courses are deleted afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+
+    def measure(self, save, course_data, iterations):
+        totals, lock_holds, course_ids = [], [], []
+        for _ in range(iterations):
+            first_write = []
+
+            def record_first_write(execute, sql, params, many, context):
+                if not first_write and sql.lstrip().upper().startswith('INSERT'):
+                    first_write.append(time.perf_counter())
+                return execute(sql, params, many, context)
+
+            with connection.execute_wrapper(record_first_write):
+                started = time.perf_counter()
+                course = save(course_data)
+                finished = time.perf_counter()
+            totals.append(finished - started)
+            lock_holds.append(finished - first_write[0])
+            course_ids.append(course.id)
+
+        Course.objects.filter(id__in=course_ids).delete()
+        return median(totals) * 1000, median(lock_holds) * 1000
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        shapes = [
+            ('typical (3 modules)', build_course_data(3, 4, 2)),
+            ('large (10 modules)', build_course_data(10, 5, 2)),
+        ]
+        implementations = [
+            ('per-row create()', save_course_per_row),
+            ('bulk_create()', lambda data: save_course_tree(data, prepare=False)),
+        ]
+
+        self.stdout.write(f'{"course":<22}{"implementation":<20}{"total ms":>10}{"lock ms":>10}')
+        for shape_name, course_data in shapes:
+            for impl_name, save in implementations:
+                total_ms, lock_ms = self.measure(save, course_data, iterations)
+                self.stdout.write(f'{shape_name:<22}{impl_name:<20}{total_ms:>10.2f}{lock_ms:>10.2f}')
@@ -0,0 +1,96 @@
+import asyncio
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median, quantiles
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from core import ai_client, ratelimit
+from core.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-tests send_message with the fake AI backend: a pool of sync (WSGI) '
+        'workers versus a single async (ASGI) worker. The benchmark user and '
+        'its chat messages are deleted afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Concurrent requests per run')
+        parser.add_argument('--workers', type=int, default=4, help='Sync workers, like gunicorn --workers')
+        parser.add_argument('--latency', type=float, default=2.0, help='Fake model latency in seconds')
+
+    # Latencies are measured from the start of the burst, so they include
+    # the time a request waited for a free worker
+
+    def run_sync(self, url, cookie, requests, workers):
+        started = time.perf_counter()
+
+        def send(index):
+            client = Client()
+            client.cookies[settings.SESSION_COOKIE_NAME] = cookie
+            response = client.post(url, {'message': f'Sync request {index}'})
+            assert response.status_code == 200, response.status_code
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(send, range(requests)))
+
+    async def run_async(self, url, cookie, requests):
+        client = AsyncClient()
+        client.cookies[settings.SESSION_COOKIE_NAME] = cookie
+        started = time.perf_counter()
+
+        async def send(index):
+            response = await client.post(url, {'message': f'Async request {index}'})
+            assert response.status_code == 200, response.status_code
+            return time.perf_counter() - started
+
+        return await asyncio.gather(*(send(index) for index in range(requests)))
+
+    def report(self, name, latencies, elapsed):
+        p95 = quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+        self.stdout.write(
+            f'{name:<26}{len(latencies) / elapsed:>10.1f}{median(latencies):>10.2f}{p95:>10.2f}{elapsed:>10.2f}'
+        )
+
+    def handle(self, *args, **options):
+        requests, workers = options['requests'], options['workers']
+        user = CustomUser.objects.create_user(username=f'bench-{uuid.uuid4().hex[:12]}')
+        session = SessionStore()
+        session['_auth_user_id'] = str(user.pk)
+        session['_auth_user_backend'] = 'django.contrib.auth.backends.ModelBackend'
+        session['_auth_user_hash'] = user.get_session_auth_hash()
+        session.create()
+        url = reverse('send_message')
+
+        try:
+            with override_settings(
+                AI_BACKEND='fake',
+                AI_FAKE_LATENCY=options['latency'],
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                # All requests come from one user, the chat rate limit would refuse most of them
+                AI_RATE_LIMIT_BACKEND='local',
+                AI_RATE_LIMITS={},
+            ):
+                ai_client._backend = None
+                ratelimit.reset_buckets()
+                self.stdout.write(f'{"mode":<26}{"req/s":>10}{"p50 s":>10}{"p95 s":>10}{"wall s":>10}')
+
+                started = time.perf_counter()
+                latencies = self.run_sync(url, session.session_key, requests, workers)
+                self.report(f'sync, {workers} workers', latencies, time.perf_counter() - started)
+
+                started = time.perf_counter()
+                latencies = asyncio.run(self.run_async(url, session.session_key, requests))
+                self.report('async, 1 worker', latencies, time.perf_counter() - started)
+        finally:
+            ai_client._backend = None
+            ratelimit.reset_buckets()
+            session.delete()
+            user.delete()
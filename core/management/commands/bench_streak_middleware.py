@@ -0,0 +1,79 @@
+import time
+from datetime import timedelta
+from statistics import median
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from core.middleware import StreakMiddleware
+from core.models import UserStreak
+
+
+class LegacyStreakMiddleware(StreakMiddleware):
+    """The previous implementation: get_or_create() and update_streak() on every request"""
+
+    def process(self, request, user):
+        streak, created = UserStreak.objects.get_or_create(user=user)
+        streak.update_streak()
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the per-request overhead of StreakMiddleware before and after '
+        'caching the streak date in the session. The benchmark user is deleted afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+
+    def make_request(self, user, session, path='/dashboard/', **headers):
+        request = RequestFactory().get(path, **headers)
+        request.user = user
+        request.session = session
+        return request
+
+    def measure(self, middleware, user, count, new_day=False, **request_options):
+        session = SessionStore()
+        timings = []
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(count):
+                if new_day:
+                    # Every request is the first of its day
+                    UserStreak.objects.filter(user=user).update(
+                        last_activity=timezone.now().date() - timedelta(days=1)
+                    )
+                    session.pop(StreakMiddleware.SESSION_KEY, None)
+                request = self.make_request(user, session, **request_options)
+                started = time.perf_counter()
+                middleware(request)
+                timings.append(time.perf_counter() - started)
+        # The reset UPDATE is not part of the middleware
+        query_count = len(queries) - (count if new_day else 0)
+        return median(timings) * 1_000_000, query_count / count
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        user = get_user_model().objects.create_user(username='streak-benchmark', password='benchmark')
+        try:
+            UserStreak.objects.create(user=user)
+            get_response = lambda request: HttpResponse()
+            legacy, current = LegacyStreakMiddleware(get_response), StreakMiddleware(get_response)
+            cases = [
+                ('before: any request', legacy, {}),
+                ('before: first of the day', legacy, {'new_day': True}),
+                ('after: repeat request', current, {}),
+                ('after: first of the day', current, {'new_day': True}),
+                ('after: HTMX partial', current, {'HTTP_HX_REQUEST': 'true'}),
+                ('after: task-status poll', current, {'path': '/task-status/abc/'}),
+            ]
+
+            self.stdout.write(f'{"case":<28}{"median us":>12}{"queries/request":>18}')
+            for name, middleware, request_options in cases:
+                micros, queries = self.measure(middleware, user, count, **request_options)
+                self.stdout.write(f'{name:<28}{micros:>12.1f}{queries:>18.2f}')
+        finally:
+            user.delete()
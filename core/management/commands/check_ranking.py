@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from core.ranking import get_ranking, rebuild_from_db, check_consistency
+
+class Command(BaseCommand):
+    help = (
+        'Checks the leaderboard ranking backend against CustomUser.total_xp. '
+        'The database backend is always in sync and the in-process one resyncs on '
+        'its own, so this is mainly useful with LEADERBOARD_BACKEND=redis'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Reload the ranking from the database after checking'
+        )
+
+    def handle(self, *args, **options):
+        ranking = get_ranking()
+        mismatches = check_consistency(ranking)
+
+        for user_id, ranked_xp, db_xp in mismatches:
+            self.stdout.write(self.style.WARNING(
+                f'User {user_id}: ranking has {ranked_xp}, database has {db_xp}'
+            ))
+        self.stdout.write(f'{len(mismatches)} users out of sync')
+
+        if options['rebuild']:
+            rebuild_from_db(ranking)
+            self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt ranking with {ranking.zcard()} users'))
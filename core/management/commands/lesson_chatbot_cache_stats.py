@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.chat_cache import get_stats, reset_stats
+from core.ratelimit import cache_is_per_process
+
+
+class Command(BaseCommand):
+    help = 'Shows hit/miss counters of the lesson chatbot response cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after showing them')
+
+    def handle(self, *args, **options):
+        if cache_is_per_process():
+            # This command would only see its own, empty copy of the counters
+            raise CommandError(
+                'The counters are kept in the default cache, which is local memory and not shared '
+                'with the web processes. Set CACHE_BACKEND=redis or file to collect them.'
+            )
+        stats = get_stats()
+        self.stdout.write(f"Exact hits:    {stats['hits']}")
+        self.stdout.write(f"Semantic hits: {stats['semantic_hits']}")
+        self.stdout.write(f"Misses:        {stats['misses']}")
+        self.stdout.write(self.style.SUCCESS(f"Hit rate:      {stats['hit_rate']:.1%}"))
+        if options['reset']:
+            reset_stats()
+            self.stdout.write('Counters reset')
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from core.models import Course
+from core.services import prepare_course
+
+class Command(BaseCommand):
+    help = 'Pre-renders lessons, indexes navigation and warms caches for existing courses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('course_ids', nargs='*', type=int, help='Only prepare these courses')
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Prepare courses again even if they were already prepared'
+        )
+
+    def handle(self, *args, **options):
+        courses = Course.objects.order_by('id')
+        if options['course_ids']:
+            courses = courses.filter(id__in=options['course_ids'])
+        elif not options['force']:
+            courses = courses.filter(prepared_at__isnull=True)
+
+        prepared_count = 0
+        for course in courses.iterator():
+            try:
+                if prepare_course(course, force=options['force']):
+                    prepared_count += 1
+                    self.stdout.write(self.style.SUCCESS(f'Prepared course {course.id}'))
+            except Exception as e:
+                # Leave it unprepared so the next run picks it up again
+                self.stdout.write(self.style.WARNING(f'Skipping course {course.id}: {e}'))
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully prepared {prepared_count} courses'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.ratelimit import cache_is_per_process, get_stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = 'Shows allowed/throttled counters of the AI endpoint rate limits'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after showing them')
+
+    def handle(self, *args, **options):
+        if cache_is_per_process():
+            # This command would only see its own, empty copy of the counters
+            raise CommandError(
+                'The counters are kept in the default cache, which is local memory and not shared '
+                'with the web processes. Set CACHE_BACKEND=redis or file to collect them.'
+            )
+        stats = get_stats()
+        self.stdout.write(f"{'Scope':<20}{'Allowed':>10}{'User':>10}{'Global':>10}{'Backlog':>10}")
+        for scope, counts in stats.items():
+            self.stdout.write(
+                f"{scope:<20}{counts['allowed']:>10}{counts['user']:>10}{counts['global']:>10}{counts['backlog']:>10}"
+            )
+        throttled = sum(counts[outcome] for counts in stats.values() for outcome in ('user', 'global', 'backlog'))
+        self.stdout.write(self.style.SUCCESS(f"Throttled requests: {throttled}"))
+        if options['reset']:
+            reset_stats()
+            self.stdout.write('Counters reset')
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+from core.models import CustomUser, UserProgress
+
+class Command(BaseCommand):
+    help = 'Rebuilds the denormalized CustomUser.total_xp from UserProgress scores'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report users whose total_xp is out of sync, do not write'
+        )
+
+    def handle(self, *args, **options):
+        # One grouped query for the real totals
+        totals = dict(
+            UserProgress.objects.values('user_id')
+            .annotate(xp=Sum('score'))
+            .values_list('user_id', 'xp')
+        )
+
+        mismatched = []
+        for user in CustomUser.objects.only('id', 'username', 'total_xp').iterator():
+            expected = totals.get(user.id) or 0
+            if user.total_xp != expected:
+                mismatched.append((user, expected))
+
+        for user, expected in mismatched:
+            self.stdout.write(self.style.WARNING(
+                f'User {user.id} ({user.username}): stored {user.total_xp}, expected {expected}'
+            ))
+
+        if options['check']:
+            self.stdout.write(f'{len(mismatched)} users out of sync')
+            return
+
+        for user, expected in mismatched:
+            user.total_xp = expected
+        CustomUser.objects.bulk_update([user for user, _ in mismatched], ['total_xp'], batch_size=500)
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully reconciled {len(mismatched)} users'))
@@ -1,34 +1,95 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django.utils import translation
 
-class UserLanguageMiddleware:
-    """Automatically activate the user's preferred language"""
+
+class AsyncCapableMiddleware:
+    """
+    Base for middleware that runs natively in both modes, so async views
+    served over ASGI are not pushed back into a thread by this middleware.
+    Subclasses implement process(request, user) and aprocess(request, user).
+    """
+    sync_capable = True
+    async_capable = True
 
     def __init__(self, get_response):
         self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
         if request.user.is_authenticated:
-            user_language = request.user.preferred_language
-            translation.activate(user_language)
-            request.LANGUAGE_CODE = user_language
+            self.process(request, request.user)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        user = await request.auser()
+        if user.is_authenticated:
+            await self.aprocess(request, user)
+        return await self.get_response(request)
+
+    def process(self, request, user):
+        pass
+
+    async def aprocess(self, request, user):
+        await sync_to_async(self.process)(request, user)
+
+
+class UserLanguageMiddleware(AsyncCapableMiddleware):
+    """Automatically activate the user's preferred language"""
 
-        response = self.get_response(request)
-        return response
+    def process(self, request, user):
+        user_language = user.preferred_language
+        translation.activate(user_language)
+        request.LANGUAGE_CODE = user_language
 
+    async def aprocess(self, request, user):
+        # No database access, and translation.activate() must run in this context
+        self.process(request, user)
+
+from django.conf import settings
+from django.utils import timezone
 from .models import UserStreak
 
-class StreakMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
+class StreakMiddleware(AsyncCapableMiddleware):
+    """
+    Counts the user's daily streak. The date it was last counted is kept in
+    the session, so the database is touched on the first request of the
+    day only (one conditional UPDATE, see UserStreak.record_activity).
+    HTMX partials and polling endpoints (STREAK_SKIP_PATHS) are skipped.
+    """
+    SESSION_KEY = 'streak_date'
 
-    def __call__(self, request):
-        if request.user.is_authenticated:
-            # Xatolik bo'lmasligi uchun try-except qo'shamiz
-            try:
-                streak, created = UserStreak.objects.get_or_create(user=request.user)
-                streak.update_streak()
-            except Exception as e:
-                print(f"Streak update error: {e}")
-
-        response = self.get_response(request)
-        return response
\ No newline at end of file
+    def should_skip(self, request):
+        if request.headers.get('HX-Request'):
+            return True
+        return request.path.startswith(tuple(settings.STREAK_SKIP_PATHS))
+
+    def process(self, request, user):
+        if self.should_skip(request):
+            return
+        today = timezone.now().date().isoformat()
+        if request.session.get(self.SESSION_KEY) == today:
+            return
+        # Xatolik bo'lmasligi uchun try-except qo'shamiz
+        try:
+            UserStreak.record_activity(user)
+        except Exception as e:
+            print(f"Streak update error: {e}")
+            return
+        request.session[self.SESSION_KEY] = today
+
+    async def aprocess(self, request, user):
+        if self.should_skip(request):
+            return
+        today = timezone.now().date().isoformat()
+        if await request.session.aget(self.SESSION_KEY) == today:
+            return
+        try:
+            await sync_to_async(UserStreak.record_activity)(user)
+        except Exception as e:
+            print(f"Streak update error: {e}")
+            return
+        await request.session.aset(self.SESSION_KEY, today)
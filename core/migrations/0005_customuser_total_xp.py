@@ -0,0 +1,49 @@
+# Generated by Django 5.2.8 on 2026-10-18 05:25
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_total_xp(apps, schema_editor):
+    CustomUser = apps.get_model("core", "CustomUser")
+    UserProgress = apps.get_model("core", "UserProgress")
+    totals = (
+        UserProgress.objects.values("user_id")
+        .annotate(xp=Sum("score"))
+        .values_list("user_id", "xp")
+    )
+    for user_id, xp in totals:
+        CustomUser.objects.filter(pk=user_id).update(total_xp=xp or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0004_userstreak"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customuser",
+            name="total_xp",
+            field=models.IntegerField(
+                db_index=True, default=0, verbose_name="Total XP"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="customuser",
+            name="preferred_language",
+            field=models.CharField(
+                choices=[
+                    ("kaa", "Qaraqalpaqsha"),
+                    ("en", "English"),
+                    ("ru", "Russian"),
+                    ("uz", "Uzbek"),
+                ],
+                default="en",
+                max_length=3,
+                verbose_name="Preferred Language",
+            ),
+        ),
+        migrations.RunPython(backfill_total_xp, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.8 on 2026-10-18 05:30
+
+from django.db import migrations, models
+
+
+def backfill_positions(apps, schema_editor):
+    Lesson = apps.get_model("core", "Lesson")
+    lessons = Lesson.objects.order_by(
+        "module__course_id", "module__order", "module_id", "order", "id"
+    ).only("id", "position", "module__course_id")
+    course_id, position, changed = None, 0, []
+    for lesson in lessons.select_related("module"):
+        if lesson.module.course_id != course_id:
+            course_id, position = lesson.module.course_id, 0
+        position += 1
+        lesson.position = position
+        changed.append(lesson)
+    Lesson.objects.bulk_update(changed, ["position"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0005_customuser_total_xp"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="lesson",
+            options={"ordering": ["order", "id"]},
+        ),
+        migrations.AddField(
+            model_name="lesson",
+            name="position",
+            field=models.PositiveIntegerField(
+                db_index=True, default=0, editable=False, verbose_name="Position"
+            ),
+        ),
+        migrations.RunPython(backfill_positions, migrations.RunPython.noop),
+    ]
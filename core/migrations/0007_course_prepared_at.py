@@ -0,0 +1,20 @@
+# Generated by Django 5.2.8 on 2026-10-18 05:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0006_lesson_position"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="course",
+            name="prepared_at",
+            field=models.DateTimeField(
+                blank=True, editable=False, null=True, verbose_name="Prepared At"
+            ),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-18 05:44
+
+from django.db import migrations, models
+from core.topics import normalize_topic
+
+
+def backfill_topic_keys(apps, schema_editor):
+    # Courses generated so far only have their title to go on
+    Course = apps.get_model("core", "Course")
+    courses = list(Course.objects.only("id", "title"))
+    for course in courses:
+        course.topic_key = normalize_topic(course.title)
+    Course.objects.bulk_update(courses, ["topic_key"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0007_course_prepared_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="course",
+            name="topic_key",
+            field=models.CharField(
+                blank=True, editable=False, max_length=200, verbose_name="Topic Key"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="course",
+            index=models.Index(
+                fields=["language", "topic_key"], name="core_course_languag_49265f_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_topic_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-18 05:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0008_course_topic_key"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="course",
+            name="is_generating",
+            field=models.BooleanField(
+                default=False, editable=False, verbose_name="Is Generating"
+            ),
+        ),
+        migrations.AddField(
+            model_name="lesson",
+            name="is_pending",
+            field=models.BooleanField(default=False, verbose_name="Is Pending"),
+        ),
+    ]
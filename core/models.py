@@ -14,6 +14,9 @@ class CustomUser(AbstractUser):
     phone_number = models.CharField(max_length=20, blank=True, verbose_name=_("Phone Number"))
     age = models.PositiveIntegerField(null=True, blank=True, verbose_name=_("Age"))
     preferred_language = models.CharField(max_length=3, choices=LANGUAGE_CHOICES, default='en', verbose_name=_("Preferred Language"))
+    # Denormalized SUM(UserProgress.score); kept in sync by submit_quiz and
+    # rebuilt with `manage.py rebuild_user_xp`
+    total_xp = models.IntegerField(default=0, db_index=True, verbose_name=_("Total XP"))
 
     def __str__(self):
         return self.username
@@ -23,6 +26,15 @@ class Course(models.Model):
     description = models.TextField(verbose_name=_("Description"))
     language = models.CharField(max_length=3, default='en', verbose_name=_("Language"))
     created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("Created At"))
+    # Set once services.prepare_course has rendered, indexed and cached the course
+    prepared_at = models.DateTimeField(null=True, blank=True, editable=False, verbose_name=_("Prepared At"))
+    # Canonical form of the topic the course was generated for, see core.topics
+    topic_key = models.CharField(max_length=200, blank=True, editable=False, verbose_name=_("Topic Key"))
+    # True while lessons are still being generated, see services.generate_course_progressively
+    is_generating = models.BooleanField(default=False, editable=False, verbose_name=_("Is Generating"))
+
+    class Meta:
+        indexes = [models.Index(fields=['language', 'topic_key'])]
 
     def __str__(self):
         return self.title
@@ -43,9 +55,13 @@ class Lesson(models.Model):
     title = models.CharField(max_length=200, verbose_name=_("Title"))
     content = models.TextField(help_text=_("Markdown content"), verbose_name=_("Content"))
     order = models.PositiveIntegerField(verbose_name=_("Order"))
+    # 1-based index in the course-wide lesson sequence, see services.index_course_lessons
+    position = models.PositiveIntegerField(default=0, db_index=True, editable=False, verbose_name=_("Position"))
+    # Outline only: content and quizzes have not been generated yet
+    is_pending = models.BooleanField(default=False, verbose_name=_("Is Pending"))
 
     class Meta:
-        ordering = ['order']
+        ordering = ['order', 'id']
 
     def __str__(self):
         return self.title
@@ -98,9 +114,22 @@ class ChatMessage(models.Model):
         return f"{self.user.username} - {'User' if self.is_user else 'Bot'}: {self.message[:50]}"
 
 
+class ChatSummary(models.Model):
+    """Rolling summary of a user's older chat messages (see core/chat_context.py)"""
+    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, related_name='chat_summary')
+    summary = models.TextField(blank=True)
+    # Newest ChatMessage folded into the summary
+    last_message_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username} - summary up to message {self.last_message_id}"
+
+
 from django.db import models
 from django.conf import settings
 from django.utils import timezone
+from django.db.models.functions import Greatest
 from datetime import timedelta
 
 # ... boshqa modellaringiz (Course, Lesson va h.k.) ...
@@ -137,5 +166,28 @@ class UserStreak(models.Model):
         self.last_activity = today
         self.save()
 
+    @classmethod
+    def record_activity(cls, user, today=None):
+        """
+        update_streak() for `user` in one conditional UPDATE, without reading
+        the row first. Returns False if the streak was already counted today.
+        """
+        today = today or timezone.now().date()
+        # Yesterday continues the streak, an older day starts it over
+        new_streak = models.Case(
+            models.When(last_activity=today - timedelta(days=1), then=models.F('current_streak') + 1),
+            default=models.Value(1),
+        )
+        updated = cls.objects.filter(user=user).exclude(last_activity=today).update(
+            current_streak=new_streak,
+            max_streak=Greatest(models.F('max_streak'), new_streak),
+            last_activity=today,
+        )
+        if updated:
+            return True
+        # Either already counted today or no row yet (created as today's, like update_streak)
+        cls.objects.get_or_create(user=user)
+        return False
+
     def __str__(self):
         return f"{self.user} - {self.current_streak} kun"
\ No newline at end of file
@@ -0,0 +1,289 @@
+"""
+Pluggable XP ranking backends.
+
+The backends expose the subset of the Redis sorted-set (ZSET) commands the
+leaderboard needs, with redis-py argument order minus the key name:
+
+- DatabaseRanking: answers every command with a query on
+  CustomUser.total_xp (default). Always consistent, as every process
+  reads the same rows.
+- SortedSetRanking: in-process, bisect-backed sorted array.
+  Lookups are O(log n); updates are O(log n) search plus a memmove.
+- RedisRanking: a real ZSET, for deployments that already run Redis for
+  Celery. All web and worker processes then share one ranking.
+
+Members are zero-padded user IDs (see member_key) so that ties come back
+in descending ID order from every backend, matching the database ordering
+in core.leaderboard. Scores are CustomUser.total_xp. The in-process
+backend only sees XP changes made by its own process and reloads itself
+from the database every LEADERBOARD_RANKING_RESYNC seconds, so with
+several workers their ranks can differ by up to that long. Use it with a
+single process only; use Redis or the database otherwise.
+"""
+
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from django.conf import settings
+from django.db.models import Q
+from .models import CustomUser
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+    redis = None
+
+
+def member_key(user_id):
+    return f'{int(user_id):012d}'
+
+
+class SortedSetRanking:
+    """In-process sorted set kept as an ascending list of (score, member)"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._scores = {}
+        self._entries = []
+        self.loaded_at = None
+
+    def _remove(self, member):
+        score = self._scores.pop(member, None)
+        if score is not None:
+            index = bisect_left(self._entries, (score, member))
+            del self._entries[index]
+
+    def zadd(self, mapping):
+        with self._lock:
+            for member, score in mapping.items():
+                member = str(member)
+                self._remove(member)
+                self._scores[member] = score
+                insort(self._entries, (score, member))
+
+    def zincrby(self, amount, member):
+        with self._lock:
+            member = str(member)
+            score = self._scores.get(member, 0) + amount
+            self.zadd({member: score})
+            return score
+
+    def zrem(self, *members):
+        with self._lock:
+            for member in members:
+                self._remove(str(member))
+
+    def zscore(self, member):
+        return self._scores.get(str(member))
+
+    def zcard(self):
+        return len(self._entries)
+
+    def zcount(self, min_score, max_score):
+        """Number of members with min_score < score <= max_score ('(' exclusive min, like Redis)"""
+        with self._lock:
+            if isinstance(min_score, str) and min_score.startswith('('):
+                low = bisect_right(self._entries, (float(min_score[1:]), chr(0x10FFFF)))
+            else:
+                low = bisect_left(self._entries, (float(min_score), ''))
+            high = bisect_right(self._entries, (float(max_score), chr(0x10FFFF)))
+            return max(0, high - low)
+
+    def zrevrank(self, member):
+        with self._lock:
+            member = str(member)
+            score = self._scores.get(member)
+            if score is None:
+                return None
+            return len(self._entries) - 1 - bisect_left(self._entries, (score, member))
+
+    def zrevrange(self, start, end, withscores=False):
+        with self._lock:
+            size = len(self._entries)
+            if start < 0:
+                start = max(0, size + start)
+            end = size + end if end < 0 else min(end, size - 1)
+            if start > end:
+                return []
+            # Highest score first, ties in reverse member order like Redis
+            entries = self._entries[size - 1 - end:size - start][::-1]
+        if withscores:
+            return [(member, score) for score, member in entries]
+        return [member for score, member in entries]
+
+    def replace(self, mapping):
+        """Atomically swap the whole set for `mapping`"""
+        entries = sorted((score, str(member)) for member, score in mapping.items())
+        with self._lock:
+            self._entries = entries
+            self._scores = {member: score for score, member in entries}
+            self.loaded_at = time.time()
+
+    def is_stale(self):
+        return self.loaded_at is None or time.time() - self.loaded_at > settings.LEADERBOARD_RANKING_RESYNC
+
+
+class DatabaseRanking:
+    """The same interface as queries on CustomUser.total_xp; writes are no-ops"""
+
+    def ranked(self):
+        return CustomUser.objects.filter(total_xp__gt=0)
+
+    def zadd(self, mapping):
+        pass
+
+    def zincrby(self, amount, member):
+        # record_quiz_attempt has already updated total_xp
+        return self.zscore(member)
+
+    def zrem(self, *members):
+        pass
+
+    def zscore(self, member):
+        return self.ranked().filter(id=int(member)).values_list('total_xp', flat=True).first()
+
+    def zcard(self):
+        return self.ranked().count()
+
+    def zcount(self, min_score, max_score):
+        """Number of members with min_score < score <= max_score ('(' exclusive min, like Redis)"""
+        queryset = self.ranked()
+        if isinstance(min_score, str) and min_score.startswith('('):
+            queryset = queryset.filter(total_xp__gt=float(min_score[1:]))
+        elif min_score != '-inf':
+            queryset = queryset.filter(total_xp__gte=float(min_score))
+        if max_score != '+inf':
+            queryset = queryset.filter(total_xp__lte=float(max_score))
+        return queryset.count()
+
+    def zrevrank(self, member):
+        score = self.zscore(member)
+        if score is None:
+            return None
+        return self.ranked().filter(Q(total_xp__gt=score) | Q(total_xp=score, id__gt=int(member))).count()
+
+    def zrevrange(self, start, end, withscores=False):
+        if start < 0 or end < 0:
+            size = self.zcard()
+            start = max(0, size + start) if start < 0 else start
+            end = size + end if end < 0 else end
+        if start > end:
+            return []
+        rows = self.ranked().order_by('-total_xp', '-id').values_list('id', 'total_xp')[start:end + 1]
+        if withscores:
+            return [(member_key(user_id), xp) for user_id, xp in rows]
+        return [member_key(user_id) for user_id, _ in rows]
+
+    def replace(self, mapping):
+        pass
+
+    def is_stale(self):
+        return False
+
+
+class RedisRanking:
+    """The same interface backed by a Redis ZSET"""
+
+    def __init__(self, url, key='leaderboard:xp'):
+        if not REDIS_AVAILABLE:
+            raise ImportError(
+                "redis package is not installed. "
+                "Install it with: pip install redis"
+            )
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.key = key
+
+    def zadd(self, mapping):
+        if mapping:
+            self.client.zadd(self.key, mapping)
+
+    def zincrby(self, amount, member):
+        return self.client.zincrby(self.key, amount, member)
+
+    def zrem(self, *members):
+        if members:
+            self.client.zrem(self.key, *members)
+
+    def zscore(self, member):
+        return self.client.zscore(self.key, member)
+
+    def zcard(self):
+        return self.client.zcard(self.key)
+
+    def zcount(self, min_score, max_score):
+        return self.client.zcount(self.key, min_score, max_score)
+
+    def zrevrank(self, member):
+        return self.client.zrevrank(self.key, member)
+
+    def zrevrange(self, start, end, withscores=False):
+        return self.client.zrevrange(self.key, start, end, withscores=withscores)
+
+    def replace(self, mapping):
+        """Build the new set under a temporary key and RENAME it into place"""
+        tmp_key = f'{self.key}:rebuild'
+        pipe = self.client.pipeline()
+        pipe.delete(tmp_key)
+        items = list(mapping.items())
+        for i in range(0, len(items), 1000):
+            pipe.zadd(tmp_key, dict(items[i:i + 1000]))
+        if items:
+            pipe.rename(tmp_key, self.key)
+        else:
+            pipe.delete(self.key)
+        pipe.execute()
+
+    def is_stale(self):
+        # Shared by every process and updated on each quiz, never needs a resync
+        return not self.client.exists(self.key)
+
+
+_ranking = None
+_ranking_lock = threading.Lock()
+
+
+def get_ranking():
+    """Process-wide ranking backend selected by LEADERBOARD_BACKEND"""
+    global _ranking
+    if _ranking is None:
+        with _ranking_lock:
+            if _ranking is None:
+                if settings.LEADERBOARD_BACKEND == 'redis':
+                    _ranking = RedisRanking(settings.LEADERBOARD_REDIS_URL)
+                elif settings.LEADERBOARD_BACKEND == 'memory':
+                    _ranking = SortedSetRanking()
+                else:
+                    _ranking = DatabaseRanking()
+    if _ranking.is_stale():
+        rebuild_from_db(_ranking)
+    return _ranking
+
+
+def rebuild_from_db(ranking):
+    """Reload every user with XP from CustomUser.total_xp"""
+    ranking.replace({
+        member_key(user_id): xp
+        for user_id, xp in CustomUser.objects.filter(total_xp__gt=0).values_list('id', 'total_xp').iterator()
+    })
+
+
+def check_consistency(ranking):
+    """
+    Compare the ranking with the database.
+
+    Returns a list of (user_id, ranked_xp, db_xp) for every user whose score
+    differs; users at or below 0 XP count as unranked on both sides.
+    """
+    expected = dict(CustomUser.objects.filter(total_xp__gt=0).values_list('id', 'total_xp'))
+    actual = {
+        int(member): int(score)
+        for member, score in ranking.zrevrange(0, -1, withscores=True)
+        if score > 0
+    }
+    return [
+        (user_id, actual.get(user_id), expected.get(user_id))
+        for user_id in sorted(expected.keys() | actual.keys())
+        if actual.get(user_id) != expected.get(user_id)
+    ]
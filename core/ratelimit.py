@@ -0,0 +1,299 @@
+"""
+Rate limiting and admission control for the AI endpoints.
+
+Every scope ('chat', 'lesson_chat', 'course_generation') has a token
+bucket per user and one shared by all users, configured in AI_RATE_LIMITS
+as "<requests>/<period>": "20/min" allows bursts of up to 20 requests and
+refills at 20 a minute. A request takes a token from the user's bucket,
+then from the global one; if the global bucket is empty the user's token
+is given back, so a busy site doesn't eat into everyone's own allowance.
+
+With AI_RATE_LIMIT_BACKEND='cache' the buckets live in the default cache;
+each update is guarded by a short cache.add() lock, so they need a cache
+that is shared and whose add() is atomic: CACHE_BACKEND=redis. The local
+memory cache is per process, and the file cache's add() checks and writes
+in two steps, so two workers can both take the lock; with either, 'cache'
+falls back to 'local' with a warning.
+'local' keeps the buckets in the process, which is cheaper but limits
+each worker separately: with N workers a user can make up to N times
+their allowance, and the global limit is multiplied the same way.
+
+Course generation is also refused while more than
+COURSE_GENERATION_MAX_BACKLOG tasks wait in the heavy_tasks queue, so one
+burst of generations can't delay everyone else's for minutes. The queue
+length is read from the broker at most every
+COURSE_GENERATION_BACKLOG_CHECK_INTERVAL seconds.
+
+Allowed and throttled requests are counted in the default cache, see
+get_stats().
+"""
+
+import math
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+SCOPES = ('chat', 'lesson_chat', 'course_generation')
+OUTCOMES = ('allowed', 'user', 'global', 'backlog')
+PERIODS = {'s': 1, 'sec': 1, 'second': 1, 'm': 60, 'min': 60, 'minute': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+BACKLOG_KEY = 'ratelimit:backlog'
+# Suggested wait when generation is refused because of the queue backlog
+BACKLOG_RETRY_AFTER = 60
+
+
+def parse_rate(rate):
+    """(capacity, tokens per second) for a rate like "20/min", or None if unlimited"""
+    if not rate:
+        return None
+    count, _, period = rate.partition('/')
+    seconds = PERIODS[period.strip().lower()] if period else 1
+    return float(count), float(count) / seconds
+
+
+def refill(state, capacity, rate, now):
+    """Tokens in a bucket at `now`, given its (tokens, updated) state"""
+    if state is None:
+        return capacity
+    tokens, updated = state
+    return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+
+class Throttled:
+    """Why a request was refused and when to try again"""
+
+    def __init__(self, scope, reason, retry_after, queue_depth=None):
+        self.scope = scope
+        self.reason = reason
+        self.retry_after = retry_after
+        self.queue_depth = queue_depth
+
+    @property
+    def status(self):
+        return 'busy' if self.reason == 'backlog' else 'throttled'
+
+    @property
+    def message(self):
+        if self.reason == 'backlog':
+            return 'Many courses are being generated right now. Please try again in a minute.'
+        if self.reason == 'global':
+            return 'The assistant is very busy right now. Please try again shortly.'
+        return f'Too many requests. Please wait {math.ceil(self.retry_after)} seconds and try again.'
+
+    def to_dict(self):
+        data = {
+            'error': self.message,
+            'status': self.status,
+            'retry_after': math.ceil(self.retry_after),
+        }
+        if self.queue_depth is not None:
+            data['queue_depth'] = self.queue_depth
+        return data
+
+
+class LocalBuckets:
+    """Buckets in this process's memory"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        """0 if a token was taken, otherwise the seconds until one is available"""
+        with self.lock:
+            now = time.time()
+            tokens = refill(self.buckets.get(key), capacity, rate, now)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                return 0
+            self.buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+
+    def give_back(self, key, capacity, rate):
+        with self.lock:
+            now = time.time()
+            self.buckets[key] = (min(capacity, refill(self.buckets.get(key), capacity, rate, now) + 1), now)
+
+
+class CacheBuckets:
+    """Buckets in the default cache, shared by the workers only if the cache is"""
+
+    LOCK_TIMEOUT = 2  # seconds, in case a worker dies holding the lock
+    LOCK_ATTEMPTS = 50
+
+    def _update(self, key, capacity, rate, change):
+        bucket_key = f'ratelimit:bucket:{key}'
+        lock_key = f'{bucket_key}:lock'
+        for _ in range(self.LOCK_ATTEMPTS):
+            if cache.add(lock_key, 1, timeout=self.LOCK_TIMEOUT):
+                break
+            time.sleep(0.005)
+        else:
+            # Don't turn a stuck lock into an outage: let the request through
+            print(f"Rate limit bucket {key} is locked, not limiting")
+            return 0
+        try:
+            now = time.time()
+            tokens = refill(cache.get(bucket_key), capacity, rate, now)
+            tokens, wait = change(tokens)
+            # An untouched bucket refills completely, no need to keep it longer
+            cache.set(bucket_key, (tokens, now), timeout=math.ceil(capacity / rate) + 1)
+            return wait
+        finally:
+            cache.delete(lock_key)
+
+    def take(self, key, capacity, rate):
+        """0 if a token was taken, otherwise the seconds until one is available"""
+        def change(tokens):
+            if tokens >= 1:
+                return tokens - 1, 0
+            return tokens, (1 - tokens) / rate
+        return self._update(key, capacity, rate, change)
+
+    def give_back(self, key, capacity, rate):
+        self._update(key, capacity, rate, lambda tokens: (min(capacity, tokens + 1), 0))
+
+
+_buckets = None
+_buckets_lock = threading.Lock()
+
+
+def cache_is_per_process():
+    """True if the default cache is local memory, of which every process has its own"""
+    return settings.CACHES['default']['BACKEND'] == 'django.core.cache.backends.locmem.LocMemCache'
+
+
+def cache_has_atomic_add():
+    """True if cache.add() on the default cache can serve as a lock between processes"""
+    return settings.CACHES['default']['BACKEND'] == 'django.core.cache.backends.redis.RedisCache'
+
+
+def make_buckets():
+    if settings.AI_RATE_LIMIT_BACKEND == 'local':
+        return LocalBuckets()
+    if cache_is_per_process():
+        # Locking a cache no other process sees buys nothing
+        print(
+            "AI rate limits are per process: the default cache is local memory. "
+            "Set CACHE_BACKEND=redis to share them between workers."
+        )
+        return LocalBuckets()
+    if not cache_has_atomic_add():
+        # Two workers could both take a bucket's lock and overwrite each other's update
+        print(
+            "AI rate limits are per process: the default cache has no atomic add() to lock the "
+            "buckets with. Set CACHE_BACKEND=redis to share them between workers."
+        )
+        return LocalBuckets()
+    return CacheBuckets()
+
+
+def get_buckets():
+    """The bucket store selected by AI_RATE_LIMIT_BACKEND"""
+    global _buckets
+    if _buckets is None:
+        with _buckets_lock:
+            if _buckets is None:
+                _buckets = make_buckets()
+    return _buckets
+
+
+def reset_buckets():
+    global _buckets
+    _buckets = None
+
+
+def stats_key(scope, outcome):
+    return f'ratelimit:stats:{scope}:{outcome}'
+
+
+def record(scope, outcome):
+    key = stats_key(scope, outcome)
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The key was evicted between add() and incr()
+        cache.set(key, 1, timeout=None)
+
+
+def get_stats():
+    """{scope: {outcome: count}} for every scope"""
+    keys = {(scope, outcome): stats_key(scope, outcome) for scope in SCOPES for outcome in OUTCOMES}
+    values = cache.get_many(keys.values())
+    return {
+        scope: {outcome: values.get(keys[scope, outcome], 0) for outcome in OUTCOMES}
+        for scope in SCOPES
+    }
+
+
+def reset_stats():
+    cache.delete_many([stats_key(scope, outcome) for scope in SCOPES for outcome in OUTCOMES])
+
+
+def check_rate_limit(scope, user_id):
+    """None if the user may make a `scope` request now, otherwise a Throttled"""
+    limits = settings.AI_RATE_LIMITS.get(scope, {})
+    buckets = get_buckets()
+
+    user_rate = parse_rate(limits.get('user'))
+    user_key = f'{scope}:user:{user_id}'
+    if user_rate:
+        wait = buckets.take(user_key, *user_rate)
+        if wait:
+            record(scope, 'user')
+            return Throttled(scope, 'user', wait)
+
+    global_rate = parse_rate(limits.get('global'))
+    if global_rate:
+        wait = buckets.take(f'{scope}:global', *global_rate)
+        if wait:
+            if user_rate:
+                buckets.give_back(user_key, *user_rate)
+            record(scope, 'global')
+            return Throttled(scope, 'global', wait)
+
+    record(scope, 'allowed')
+    return None
+
+
+async def acheck_rate_limit(scope, user_id):
+    return await sync_to_async(check_rate_limit, thread_sensitive=False)(scope, user_id)
+
+
+def generation_backlog():
+    """Number of tasks waiting in the heavy_tasks queue, or None if it can't be read"""
+    depth = cache.get(BACKLOG_KEY)
+    if depth is not None:
+        return depth
+    route = getattr(settings, 'CELERY_TASK_ROUTES', {}).get('core.tasks.generate_course_task', {})
+    try:
+        from config.celery import app
+        with app.connection_or_acquire() as connection:
+            depth = connection.default_channel.queue_declare(
+                queue=route.get('queue', 'heavy_tasks'), passive=True
+            ).message_count
+    except Exception as e:
+        # Without the number the request is admitted, as before
+        print(f"Could not read the generation queue length: {e}")
+        return None
+    cache.set(BACKLOG_KEY, depth, timeout=settings.COURSE_GENERATION_BACKLOG_CHECK_INTERVAL)
+    return depth
+
+
+def check_generation_backlog(get_backlog=generation_backlog):
+    """None if a course generation task may be queued now, otherwise a Throttled"""
+    limit = settings.COURSE_GENERATION_MAX_BACKLOG
+    if not getattr(settings, 'USE_CELERY', False) or not limit:
+        return None
+    depth = get_backlog()
+    if depth is None or depth < limit:
+        return None
+    record('course_generation', 'backlog')
+    return Throttled('course_generation', 'backlog', BACKLOG_RETRY_AFTER, queue_depth=depth)
+
+
+async def acheck_generation_backlog():
+    return await sync_to_async(check_generation_backlog, thread_sensitive=False)()
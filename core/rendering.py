@@ -0,0 +1,105 @@
+"""
+Server-side Markdown rendering for lesson content.
+
+Lessons are rendered once with Python-Markdown and the sanitized HTML is
+cached under a hash of the Markdown source, so repeat views only read the
+cache and an edited lesson naturally gets a new entry. Raw HTML in the
+source is escaped rather than passed through, and links or images with
+scripting URL schemes are dropped.
+"""
+
+import hashlib
+import html
+import threading
+import markdown
+from markdown.extensions import Extension
+from markdown.treeprocessors import Treeprocessor
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.safestring import mark_safe
+
+SAFE_URL_SCHEMES = ('http', 'https', 'mailto')
+
+
+def url_scheme(url):
+    """The scheme of `url` as a browser reads it, or '' for a relative URL"""
+    # Entities are decoded in attributes ("javascript&#58;"), and ASCII
+    # whitespace and control characters in the scheme are ignored
+    url = ''.join(char for char in html.unescape(url) if char > ' ' and char != '\x7f')
+    scheme, separator, _ = url.partition(':')
+    # Relative URLs, queries and fragments have no scheme, or a '/', '?' or '#' before the ':'
+    if not separator or any(char in scheme for char in '/?#'):
+        return ''
+    return scheme.lower()
+
+
+class SafeLinksTreeprocessor(Treeprocessor):
+    """Remove href/src attributes that use a non-whitelisted URL scheme"""
+
+    def run(self, root):
+        for element in root.iter():
+            for attribute in ('href', 'src'):
+                url = element.get(attribute)
+                if url is None:
+                    continue
+                scheme = url_scheme(url)
+                if scheme and scheme not in SAFE_URL_SCHEMES:
+                    del element.attrib[attribute]
+
+
+class SanitizeExtension(Extension):
+    """Treat raw HTML as text and strip unsafe URLs"""
+
+    def extendMarkdown(self, md):
+        md.preprocessors.deregister('html_block')
+        md.inlinePatterns.deregister('html')
+        md.treeprocessors.register(SafeLinksTreeprocessor(md), 'safe_links', 0)
+
+
+_local = threading.local()
+
+
+def _get_markdown():
+    # Markdown instances keep state between calls, so one per thread
+    md = getattr(_local, 'md', None)
+    if md is None:
+        md = markdown.Markdown(extensions=['fenced_code', 'tables', 'sane_lists', 'nl2br', SanitizeExtension()])
+        _local.md = md
+    return md
+
+
+def render_markdown(text):
+    """Render Markdown to sanitized HTML (uncached)"""
+    md = _get_markdown()
+    try:
+        return md.convert(text or '')
+    finally:
+        md.reset()
+
+
+def content_cache_key(text):
+    digest = hashlib.sha256((text or '').encode('utf-8')).hexdigest()
+    return f'markdown-html:{digest}'
+
+
+def get_rendered_html(text):
+    """Rendered HTML for `text`, served from the cache when possible"""
+    key = content_cache_key(text)
+    html = cache.get(key)
+    if html is None:
+        html = render_markdown(text)
+        cache.set(key, html, timeout=settings.RENDERED_MARKDOWN_CACHE_TIMEOUT)
+    return mark_safe(html)
+
+
+def get_lesson_html(lesson):
+    return get_rendered_html(lesson.content)
+
+
+def get_message_html(text):
+    """Rendered HTML for a chatbot answer, not cached since most are seen once"""
+    return mark_safe(render_markdown(text))
+
+
+def invalidate_rendered_html(text):
+    cache.delete(content_cache_key(text))
@@ -0,0 +1,147 @@
+"""
+Retry policy for AI-backed tasks.
+
+Only transient failures are worth retrying: rate limits (429), timeouts,
+connection errors and server errors (5xx). Anything else (a missing
+GEMINI_API_KEY, an uninstalled SDK, a rejected prompt, a reply that still
+fails validation after the per-piece retries in core.generation) fails
+the same way every time, and retrying it only burns quota.
+
+Transient errors are retried after the delay the provider asks for
+(a Retry-After header, a google.rpc.RetryInfo detail or "retry in 30s"
+in the message), otherwise after an exponential backoff with jitter,
+capped at COURSE_TASK_RETRY_BACKOFF_MAX seconds.
+
+Each attempt's outcome is kept in the task's own state in the result
+backend, which the web process reads too, so that check_task_status can
+show what happened before the current state: in the PROGRESS meta and the
+result of generate_course_task, and in the meta of the RETRYING state it
+waits in before a retry (Celery's RETRY state only keeps the exception).
+A failed task reports its error.
+"""
+
+import random
+import re
+from email.utils import parsedate_to_datetime
+from django.conf import settings
+from django.utils import timezone
+
+try:
+    from google.api_core import exceptions as api_exceptions
+    TRANSIENT_API_ERRORS = (
+        api_exceptions.ResourceExhausted,
+        api_exceptions.TooManyRequests,
+        api_exceptions.DeadlineExceeded,
+        api_exceptions.ServiceUnavailable,
+        api_exceptions.InternalServerError,
+        api_exceptions.BadGateway,
+        api_exceptions.GatewayTimeout,
+        api_exceptions.Aborted,
+        api_exceptions.RetryError,
+    )
+except ImportError:
+    TRANSIENT_API_ERRORS = ()
+
+try:
+    import requests
+    TRANSIENT_HTTP_ERRORS = (requests.Timeout, requests.ConnectionError)
+except ImportError:
+    TRANSIENT_HTTP_ERRORS = ()
+
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# State of a task waiting to be retried, see retry_later()
+RETRYING = 'RETRYING'
+MAX_ERROR_LENGTH = 200
+
+
+def status_code(exc):
+    """HTTP status of an API error, if it carries one"""
+    code = getattr(exc, 'code', None)
+    if isinstance(code, int):
+        return code
+    return getattr(getattr(exc, 'response', None), 'status_code', None)
+
+
+def is_transient(exc):
+    """True if `exc` may well not happen again on a later attempt"""
+    if isinstance(exc, (TimeoutError, ConnectionError) + TRANSIENT_API_ERRORS + TRANSIENT_HTTP_ERRORS):
+        return True
+    return status_code(exc) in TRANSIENT_STATUS_CODES
+
+
+def retry_after(exc):
+    """Seconds the provider asked to wait before retrying, or None"""
+    headers = getattr(getattr(exc, 'response', None), 'headers', None) or {}
+    value = headers.get('Retry-After') if hasattr(headers, 'get') else None
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, (parsedate_to_datetime(value) - timezone.now()).total_seconds())
+            except (TypeError, ValueError):
+                pass
+
+    for detail in getattr(exc, 'details', None) or []:
+        # google.rpc.RetryInfo
+        delay = getattr(detail, 'retry_delay', None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9
+
+    match = re.search(r'retry in (\d+(?:\.\d+)?)\s*s', str(exc), re.IGNORECASE)
+    return float(match.group(1)) if match else None
+
+
+def retry_delay(exc, retries):
+    """Seconds to wait before retry number `retries` + 1"""
+    maximum = settings.COURSE_TASK_RETRY_BACKOFF_MAX
+    hint = retry_after(exc)
+    if hint is not None:
+        return min(maximum, max(1, round(hint)))
+    # Exponential backoff with full jitter, like Celery's retry_backoff
+    return random.randint(1, min(maximum, 2 ** (retries + 1)))
+
+
+def attempt_entry(attempt, outcome, exc=None, retry_in=None):
+    """
+    One attempt for a task's history. outcome is 'succeeded', 'retrying'
+    (transient error, retry_in seconds from now) or 'failed'.
+    """
+    entry = {'attempt': attempt, 'outcome': outcome, 'at': timezone.now().isoformat()}
+    if exc is not None:
+        entry['error'] = f'{type(exc).__name__}: {exc}'[:MAX_ERROR_LENGTH]
+        entry['transient'] = is_transient(exc)
+    if retry_in is not None:
+        entry['retry_in'] = retry_in
+    return entry
+
+
+def get_attempts(info):
+    """The history in a task's meta or result, [] if there is none"""
+    if isinstance(info, dict):
+        return list(info.get('attempts') or [])
+    return []
+
+
+def previous_attempts(task):
+    """History of the earlier runs of the bound `task`, from the meta its last retry stored"""
+    if not task.request.retries:
+        return []
+    return get_attempts(task.AsyncResult(task.request.id).info)
+
+
+def retry_later(task, exc, attempts, countdown):
+    """
+    Run the bound `task` again in `countdown` seconds, keeping `attempts`
+    in its meta until then.
+
+    task.retry() would store the RETRY state, whose meta is only the
+    exception, so the task is re-queued without raising Retry and Ignore
+    keeps Celery from replacing the RETRYING state stored here.
+    """
+    from celery.exceptions import Ignore
+
+    task.update_state(state=RETRYING, meta={'attempts': attempts, 'retry_in': countdown})
+    task.retry(exc=exc, countdown=countdown, throw=False)
+    raise Ignore()
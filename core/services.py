@@ -1,15 +1,25 @@
-import json
-import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.core.cache import cache
 from django.db import transaction
-from .models import Course, Module, Lesson, Quiz, UserCourse
-
-try:
-    import google.generativeai as genai
-    GENAI_AVAILABLE = True
-except ImportError:
-    GENAI_AVAILABLE = False
-    genai = None
+from django.db.models import F, Prefetch
+from django.utils import timezone
+from .models import Course, Module, Lesson, Quiz, UserCourse, UserProgress, CustomUser, ChatMessage
+from .rendering import get_rendered_html
+from .topics import find_course_for_topic, normalize_topic
+from .chat_context import schedule_chat_summary
+from .ai_json import parse_json
+from .generation import (
+    generate_course_staged, agenerate_course_staged, generate_outline, generate_module,
+    repair_course, arepair_course
+)
+from .leaderboard import note_xp_event
+from .retries import is_transient
+from .ratelimit import cache_is_per_process
+from .ranking import get_ranking, member_key
+from . import ai_client
 
 # Language-specific prompts
 CHATBOT_SYSTEM_PROMPTS = {
@@ -207,146 +217,622 @@ Natija faqat quyidagi sxemaga mos keladigan valid JSON bo'lishi kerak (boshqa so
 """
 }
 
-def chatbot_response(user_message, chat_history, language='en'):
+def index_course_lessons(course):
     """
-    Generate chatbot response using Gemini API
+    Store each lesson's position in the course-wide sequence.
+
+    Lessons are ordered by module order, then lesson order, then ID. This
+    is the single ordering used for previous/next navigation, resuming a
+    course and the next lesson after a quiz. `course` may be a Course or its ID.
     """
-    if not GENAI_AVAILABLE:
-        return "Sorry, the AI service is not available. Please install google-generativeai package."
-    
-    genai.configure(api_key=settings.GEMINI_API_KEY)
-    model = genai.GenerativeModel('gemini-2.5-flash')
-    
+    lessons = list(
+        Lesson.objects.filter(module__course=course)
+        .order_by('module__order', 'module_id', 'order', 'id')
+        .only('id', 'position')
+    )
+    changed = []
+    for position, lesson in enumerate(lessons, start=1):
+        if lesson.position != position:
+            lesson.position = position
+            changed.append(lesson)
+    if changed:
+        Lesson.objects.bulk_update(changed, ['position'])
+        invalidate_course_tree(getattr(course, 'pk', course))
+
+def get_adjacent_lessons(lesson):
+    """Return (previous, next) lessons in the course sequence with one query"""
+    if not lesson.position:
+        # Lesson added outside course generation and not indexed yet
+        index_course_lessons(lesson.module.course_id)
+        lesson.refresh_from_db(fields=['position'])
+    neighbours = {
+        neighbour.position: neighbour
+        for neighbour in Lesson.objects.filter(
+            module__course_id=lesson.module.course_id,
+            position__in=[lesson.position - 1, lesson.position + 1]
+        ).only('id', 'title', 'position', 'module_id').exclude(position=0)
+    }
+    return neighbours.get(lesson.position - 1), neighbours.get(lesson.position + 1)
+
+def course_tree_cache_key(course_id):
+    return f'course-tree:{course_id}'
+
+def build_course_tree(course_id):
+    """
+    Module -> lesson outline of a course as plain data (no lesson content),
+    loaded with two prefetch queries.
+    """
+    lessons = Lesson.objects.only('id', 'module_id', 'title', 'order', 'position', 'is_pending')
+    modules = (
+        Module.objects.filter(course_id=course_id)
+        .only('id', 'course_id', 'title', 'order')
+        .prefetch_related(Prefetch('lessons', queryset=lessons))
+    )
+    return [
+        {
+            'id': module.id,
+            'title': module.title,
+            'order': module.order,
+            'lessons': [
+                {
+                    'id': lesson.id, 'title': lesson.title, 'order': lesson.order,
+                    'position': lesson.position, 'is_pending': lesson.is_pending,
+                }
+                for lesson in module.lessons.all()
+            ],
+        }
+        for module in modules
+    ]
+
+def get_course_tree(course_id, is_generating=None):
+    """
+    Cached course outline, see build_course_tree.
+
+    A course that is still generating is not cached: its lessons change
+    with every module, and the generating Celery worker invalidates only
+    its own cache unless CACHE_BACKEND is shared. Pass `is_generating`
+    when the course is already loaded to save a query.
+    """
+    key = course_tree_cache_key(course_id)
+    tree = cache.get(key)
+    if tree is None:
+        # Checked before building, so a tree built after generation ended is complete
+        if is_generating is None:
+            is_generating = Course.objects.filter(pk=course_id, is_generating=True).exists()
+        tree = build_course_tree(course_id)
+        if not is_generating:
+            cache.set(key, tree, timeout=settings.COURSE_TREE_CACHE_TIMEOUT)
+    return tree
+
+def invalidate_course_tree(course_id):
+    cache.delete(course_tree_cache_key(course_id))
+
+def prepare_course(course, force=False):
+    """
+    Post-generation stage: compute the lesson sequence, pre-render lesson and
+    quiz Markdown and warm the course tree cache.
+
+    Every step is idempotent and rendering skips content that is already
+    cached, so a stage that failed half-way simply resumes when run again.
+    Returns False if the course was already prepared and `force` is not set.
+
+    The rendered HTML and the tree only help if the web processes read the
+    cache they are written to. In a Celery worker with the default local
+    memory cache they don't, so only the lesson sequence is stored there
+    and lessons are rendered on their first view (see warms_web_cache).
+    """
+    if course.prepared_at and not force:
+        return False
+
+    index_course_lessons(course)
+
+    if warms_web_cache():
+        lessons = Lesson.objects.filter(module__course=course).prefetch_related('quizzes')
+        for lesson in lessons.iterator(chunk_size=50):
+            get_rendered_html(lesson.content)
+            for quiz in lesson.quizzes.all():
+                get_rendered_html(quiz.question)
+                for option in quiz.options:
+                    get_rendered_html(str(option))
+
+        invalidate_course_tree(course.id)
+        get_course_tree(course.id)
+
+    course.prepared_at = timezone.now()
+    Course.objects.filter(pk=course.pk).update(prepared_at=course.prepared_at)
+    return True
+
+_warned_cache = False
+
+def warms_web_cache():
+    """
+    False with Celery and a local memory cache: prepare_course runs in the
+    worker, whose cache the web processes never read. Set CACHE_BACKEND=redis
+    to share it.
+    """
+    global _warned_cache
+    if not getattr(settings, 'USE_CELERY', False) or not cache_is_per_process():
+        return True
+    if not _warned_cache:
+        _warned_cache = True
+        print(
+            "Generated courses are not pre-rendered: the default cache is local memory, "
+            "which the Celery workers don't share with the web processes. Set CACHE_BACKEND=redis."
+        )
+    return False
+
+def schedule_course_preparation(course):
+    """Run prepare_course after the current transaction commits, via Celery when enabled"""
+    def run():
+        if getattr(settings, 'USE_CELERY', False):
+            try:
+                from .tasks import prepare_course_task
+                prepare_course_task.delay(course.id)
+                return
+            except Exception as e:
+                print(f"Could not queue course preparation, running inline: {e}")
+        prepare_course(course)
+
+    transaction.on_commit(run)
+
+def record_quiz_attempt(user, lesson, xp_delta):
+    """
+    Mark the lesson completed for the user and apply the XP delta.
+
+    The lesson score and the user's denormalized total_xp are updated with
+    F() expressions in one transaction, so concurrent submissions can't
+    lose increments. The delta is also pushed into the ranking backend.
+    """
+    # Fetch (and possibly reload) the ranking before the write so a reload
+    # can't include this delta twice
+    ranking = get_ranking()
+    with transaction.atomic():
+        progress, created = UserProgress.objects.get_or_create(user=user, lesson=lesson)
+        UserProgress.objects.filter(pk=progress.pk).update(
+            is_completed=True,
+            score=F('score') + xp_delta,
+            completed_at=timezone.now()
+        )
+        CustomUser.objects.filter(pk=user.pk).update(total_xp=F('total_xp') + xp_delta)
+
+    user.total_xp += xp_delta
+    ranking.zincrby(xp_delta, member_key(user.id))
+    note_xp_event()
+    return progress
+
+CHATBOT_UNAVAILABLE_REPLY = "Sorry, the AI service is not available. Please install google-generativeai package."
+CHATBOT_ERROR_REPLY = "Sorry, I encountered an error. Please try again."
+
+def format_chatbot_prompt(user_message, recent_messages, language='en', summary=''):
+    """System prompt, the summary of older turns, the given recent messages and the new message"""
     system_prompt = CHATBOT_SYSTEM_PROMPTS.get(language, CHATBOT_SYSTEM_PROMPTS['en'])
     
     # Build conversation history
     conversation = f"{system_prompt}\n\n"
-    
-    # Get last 5 messages safely
-    count = chat_history.count()
-    start_index = max(0, count - 5)
-    recent_messages = chat_history[start_index:]
-    
-    for msg in recent_messages:  # Last 5 messages for context
+    if summary:
+        conversation += f"Summary of the earlier conversation: {summary}\n\n"
+    for msg in recent_messages:
         role = "User" if msg.is_user else "Assistant"
         conversation += f"{role}: {msg.message}\n"
     conversation += f"User: {user_message}\nAssistant:"
-    
+    return conversation
+
+def build_chatbot_prompt(user_message, context, language='en'):
+    """Prompt for `user_message` with a ChatContext (see core.chat_context)"""
+    return format_chatbot_prompt(user_message, context.messages, language, context.summary)
+
+def chatbot_response(user_message, context, language='en', raise_transient=False):
+    """
+    Generate chatbot response using Gemini API. With raise_transient, a
+    transient API error (see core.retries) is raised for the caller to
+    retry instead of becoming the error reply.
+    """
+    if not ai_client.is_available():
+        return CHATBOT_UNAVAILABLE_REPLY
+
+    conversation = build_chatbot_prompt(user_message, context, language)
+    try:
+        return ai_client.generate_text(conversation)
+    except Exception as e:
+        if raise_transient and is_transient(e):
+            raise
+        print(f"Error in chatbot: {e}")
+        return CHATBOT_ERROR_REPLY
+
+async def achatbot_response(user_message, context, language='en'):
+    """Async chatbot_response, for async views"""
+    if not ai_client.is_available():
+        return CHATBOT_UNAVAILABLE_REPLY
+
+    conversation = build_chatbot_prompt(user_message, context, language)
     try:
-        response = model.generate_content(conversation)
-        return response.text.strip()
+        return await ai_client.agenerate_text(conversation)
     except Exception as e:
         print(f"Error in chatbot: {e}")
-        return "Sorry, I encountered an error. Please try again."
+        return CHATBOT_ERROR_REPLY
+
+async def achatbot_response_stream(user_message, context, language='en'):
+    """
+    Like achatbot_response, but yields the reply in chunks as the model
+    produces them. Errors are reported as a final chunk of apology text.
+    """
+    if not ai_client.is_available():
+        yield CHATBOT_UNAVAILABLE_REPLY
+        return
+
+    conversation = build_chatbot_prompt(user_message, context, language)
+    try:
+        async for chunk in ai_client.astream_text(conversation):
+            yield chunk
+    except Exception as e:
+        print(f"Error in chatbot stream: {e}")
+        yield CHATBOT_ERROR_REPLY
+
+class TopicMarkerFilter:
+    """
+    Strip the TOPIC_CLEAR marker line from a reply that arrives in chunks.
+
+    feed() returns the text that can be shown right away. Text that might
+    be the start of the marker (e.g. a chunk ending in "TOPIC_CL") is held
+    back until the next chunk decides it; everything from the marker to
+    the end of its line is captured as the topic instead of being shown.
+    """
+
+    MARKER = 'TOPIC_CLEAR:'
+
+    def __init__(self):
+        self.pending = ''
+        self.topics = []
+        self.in_topic = False
+
+    def _held_back(self):
+        # Length of the longest suffix of pending that starts the marker
+        for size in range(min(len(self.pending), len(self.MARKER) - 1), 0, -1):
+            if self.MARKER.startswith(self.pending[-size:]):
+                return size
+        return 0
+
+    def feed(self, chunk):
+        self.pending += chunk
+        visible = ''
+        while self.pending:
+            if self.in_topic:
+                end = self.pending.find('\n')
+                if end == -1:
+                    self.topics[-1] += self.pending
+                    self.pending = ''
+                    break
+                self.topics[-1] += self.pending[:end]
+                self.pending = self.pending[end:]
+                self.in_topic = False
+                continue
+            start = self.pending.find(self.MARKER)
+            if start != -1:
+                visible += self.pending[:start]
+                self.pending = self.pending[start + len(self.MARKER):]
+                self.topics.append('')
+                self.in_topic = True
+                continue
+            keep = self._held_back()
+            visible += self.pending[:len(self.pending) - keep]
+            self.pending = self.pending[len(self.pending) - keep:]
+            break
+        return visible
+
+    def finish(self):
+        """Flush what is still held back at the end of the stream"""
+        if self.in_topic:
+            self.topics[-1] += self.pending
+            visible = ''
+        else:
+            visible = self.pending
+        self.pending = ''
+        self.in_topic = False
+        return visible
+
+    @property
+    def topic_clear(self):
+        return bool(self.topics)
+
+    @property
+    def topic(self):
+        # Like the non-streaming parser, the first marker names the topic
+        if not self.topics:
+            return None
+        return self.topics[0].strip() or None
+
+def split_topic_marker(reply):
+    """Return (reply without the marker, topic_clear, topic) for a complete reply"""
+    marker_filter = TopicMarkerFilter()
+    text = marker_filter.feed(reply) + marker_filter.finish()
+    return text.strip(), marker_filter.topic_clear, marker_filter.topic
+
+def save_chatbot_reply(user_id, bot_reply, context):
+    """
+    Save a reply as the bot's message, without the TOPIC_CLEAR marker, and
+    update the chat summary if `context` is due for it. Returns the fields
+    send_message responds with.
+    """
+    bot_reply, topic_clear, topic = split_topic_marker(bot_reply)
+    ChatMessage.objects.create(user_id=user_id, message=bot_reply, is_user=False)
+    schedule_chat_summary(user_id, context)
+    return {
+        'bot_message': bot_reply,
+        'topic_clear': topic_clear,
+        'topic': topic
+    }
+
+def build_quizzes(lesson_data):
+    """Unsaved Quiz objects for a lesson of generated course data"""
+    # Handle multiple quizzes
+    quizzes_data = lesson_data.get('quizzes', [])
+    # Fallback for singular 'quiz' if AI messes up
+    if 'quiz' in lesson_data:
+        quizzes_data.append(lesson_data['quiz'])
+
+    quizzes = []
+    for quiz_data in quizzes_data:
+        # Convert correct_answer index to actual answer text
+        correct_answer_index = quiz_data['correct_answer']
+        correct_answer_text = quiz_data['options'][correct_answer_index]
+
+        quizzes.append(Quiz(
+            question=quiz_data['question'],
+            options=quiz_data['options'],
+            correct_answer=correct_answer_text
+        ))
+    return quizzes
+
+def save_course_tree(course_data, language='en', user=None, prepare=True, topic=None):
+    """
+    Persist a parsed course (title, description, modules -> lessons -> quizzes).
+
+    All rows are built in memory first, then written with one bulk_create per
+    level, so the transaction (and SQLite's write lock) is held for four or
+    five INSERTs instead of one per module, lesson and quiz. With
+    `prepare=False` the post-generation stage is not scheduled. The course
+    is indexed under `topic` (or its title) for reuse, see core.topics.
+    """
+    modules = []
+    lessons = []
+    quizzes = []
+    for mod_data in course_data['modules']:
+        module = Module(title=mod_data['title'], order=mod_data['order'])
+        modules.append(module)
+
+        for lesson_data in mod_data['lessons']:
+            lesson = Lesson(
+                title=lesson_data['title'],
+                content=lesson_data['content'],
+                order=lesson_data.get('order', 1)
+            )
+            lessons.append((module, lesson))
+
+            quizzes.extend((lesson, quiz) for quiz in build_quizzes(lesson_data))
+
+    with transaction.atomic():
+        course = Course.objects.create(
+            title=course_data['title'],
+            description=course_data['description'],
+            language=language,
+            topic_key=normalize_topic(topic or course_data['title'])
+        )
+
+        # Foreign keys are assigned once the parent level has primary keys
+        for module in modules:
+            module.course = course
+        Module.objects.bulk_create(modules)
+
+        for module, lesson in lessons:
+            lesson.module = module
+        Lesson.objects.bulk_create([lesson for _, lesson in lessons])
+
+        for lesson, quiz in quizzes:
+            quiz.lesson = lesson
+        Quiz.objects.bulk_create([quiz for _, quiz in quizzes])
+
+        # Enroll user in the course if user is provided
+        if user:
+            UserCourse.objects.create(user=user, course=course)
+
+        if prepare:
+            schedule_course_preparation(course)
+
+    return course
+
+def course_generation_prompt(topic, language='en'):
+    prompt_template = COURSE_GENERATION_PROMPTS.get(language, COURSE_GENERATION_PROMPTS['en'])
+    return prompt_template.format(topic=topic)
+
+def reuse_existing_course(topic, language='en', user=None):
+    """
+    Return an existing course on `topic` in `language`, enrolling `user` in
+    it, or None when the course has to be generated.
+    """
+    course = find_course_for_topic(topic, language)
+    if course is None:
+        return None
+    if user:
+        UserCourse.objects.get_or_create(user=user, course=course)
+    # Lets callers tell the user the course already existed
+    course.reused = True
+    return course
 
 def generate_course_from_ai(topic, language='en', user=None):
     """
     Generates a course structure using Google Gemini API.
+
+    If a course on the same topic already exists in `language`, the user is
+    enrolled in it instead and nothing is generated.
     """
-    if not GENAI_AVAILABLE:
+    course = reuse_existing_course(topic, language, user)
+    if course:
+        return course
+
+    if not ai_client.is_available():
         raise ImportError(
             "google-generativeai package is not installed. "
             "Install it with: pip install google-generativeai"
         )
-    
-    genai.configure(api_key=settings.GEMINI_API_KEY)
-    model = genai.GenerativeModel('gemini-2.5-flash')
-
-    prompt_template = COURSE_GENERATION_PROMPTS.get(language, COURSE_GENERATION_PROMPTS['en'])
-    prompt = prompt_template.format(topic=topic)
 
     try:
-        # Try to use JSON mode if available (works with newer models/SDKs)
-        generation_config = {'response_mime_type': 'application/json'}
-        try:
-            response = model.generate_content(prompt, generation_config=generation_config)
-        except:
-            # Fallback for older SDK versions
-            response = model.generate_content(prompt)
-
-        # Clean up the response to ensure it's valid JSON
-        text = response.text.strip()
-        
-        # Remove markdown code blocks if present
-        if text.startswith('```json'):
-            text = text[7:]
-        if text.startswith('```'):
-            text = text[3:]
-        if text.endswith('```'):
-            text = text[:-3]
-        
-        text = text.strip()
-        
-        # Extract JSON object using regex
-        match = re.search(r'\{.*\}', text, re.DOTALL)
-        if match:
-            text = match.group(0)
-        
-        # Fix common JSON escape sequence issues
-        # Replace invalid escape sequences that Gemini sometimes generates
-        text = text.replace('\\n', '\\n')  # Ensure newlines are properly escaped
-        text = text.replace('\\"', '"')   # Fix double-escaped quotes
-        
-        try:
-            course_data = json.loads(text)
-        except json.JSONDecodeError as e:
-            # Attempt to fix common JSON errors by removing problematic backslashes
-            print(f"JSON Decode Error: {e}. Attempting to repair...")
-            try:
-                # Try to fix by replacing single backslashes with double backslashes
-                text_fixed = re.sub(r'\\(?!["\\/bfnrtu])', r'\\\\', text)
-                course_data = json.loads(text_fixed)
-                print("JSON repair successful!")
-            except:
-                raise ValueError(f"AI response was not valid JSON: {e}. Response text: {text[:100]}...")
+        if settings.COURSE_GENERATION_STAGED:
+            # Outline, then modules in parallel (see core.generation)
+            course_data = generate_course_staged(topic, language)
+        else:
+            text = ai_client.generate_text(course_generation_prompt(topic, language), json_mode=True)
+            # Only invalid or missing lessons and modules are requested again
+            course_data = repair_course(parse_json(text), language)
 
         # Parsing and Saving to DB
-        with transaction.atomic():
-            course = Course.objects.create(
-                title=course_data['title'],
-                description=course_data['description'],
-                language=language
-            )
+        course = save_course_tree(course_data, language, user, topic=topic)
+
+        return course
+
+    except Exception as e:
+        print(f"Error generating course: {e}")
+        raise e
 
-            for mod_data in course_data['modules']:
-                module = Module.objects.create(
-                    course=course,
-                    title=mod_data['title'],
-                    order=mod_data['order']
-                )
-
-                for lesson_data in mod_data['lessons']:
-                    lesson = Lesson.objects.create(
-                        module=module,
-                        title=lesson_data['title'],
-                        content=lesson_data['content'],
-                        order=lesson_data.get('order', 1)
-                    )
-
-                    # Handle multiple quizzes
-                    quizzes_data = lesson_data.get('quizzes', [])
-                    # Fallback for singular 'quiz' if AI messes up
-                    if 'quiz' in lesson_data:
-                        quizzes_data.append(lesson_data['quiz'])
-
-                    for quiz_data in quizzes_data:
-                        # Convert correct_answer index to actual answer text
-                        correct_answer_index = quiz_data['correct_answer']
-                        correct_answer_text = quiz_data['options'][correct_answer_index]
-                        
-                        Quiz.objects.create(
-                            lesson=lesson,
-                            question=quiz_data['question'],
-                            options=quiz_data['options'],
-                            correct_answer=correct_answer_text
-                        )
-            
-            # Enroll user in the course if user is provided
-            if user:
-                UserCourse.objects.create(user=user, course=course)
-                
+async def agenerate_course_from_ai(topic, language='en', user=None):
+    """
+    Async generate_course_from_ai. The model call does not block the event
+    loop; the database writes run in a worker thread since they are one
+    transaction.
+    """
+    course = await sync_to_async(reuse_existing_course)(topic, language, user)
+    if course:
         return course
 
+    if not ai_client.is_available():
+        raise ImportError(
+            "google-generativeai package is not installed. "
+            "Install it with: pip install google-generativeai"
+        )
+
+    try:
+        if settings.COURSE_GENERATION_STAGED:
+            course_data = await agenerate_course_staged(topic, language)
+        else:
+            text = await ai_client.agenerate_text(course_generation_prompt(topic, language), json_mode=True)
+            course_data = await arepair_course(parse_json(text), language)
+        return await sync_to_async(save_course_tree)(course_data, language, user, topic=topic)
+
     except Exception as e:
         print(f"Error generating course: {e}")
         raise e
+
+def save_course_outline(outline, language='en', user=None, topic=None):
+    """
+    Persist a course from its outline alone: modules and pending lessons
+    without content or quizzes. Returns the course and, per outline module,
+    the list of its Lesson objects.
+    """
+    modules = []
+    lessons = []
+    for index, mod_data in enumerate(outline['modules'], start=1):
+        module = Module(title=mod_data['title'], order=mod_data.get('order', index))
+        module_lessons = [
+            Lesson(title=title, content='', order=order, is_pending=True)
+            for order, title in enumerate(mod_data['lessons'], start=1)
+        ]
+        modules.append(module)
+        lessons.append(module_lessons)
+
+    with transaction.atomic():
+        course = Course.objects.create(
+            title=outline['title'],
+            description=outline['description'],
+            language=language,
+            topic_key=normalize_topic(topic or outline['title']),
+            is_generating=True
+        )
+        for module in modules:
+            module.course = course
+        Module.objects.bulk_create(modules)
+        for module, module_lessons in zip(modules, lessons):
+            for lesson in module_lessons:
+                lesson.module = module
+        Lesson.objects.bulk_create([lesson for module_lessons in lessons for lesson in module_lessons])
+        index_course_lessons(course)
+
+        if user:
+            UserCourse.objects.create(user=user, course=course)
+
+    return course, lessons
+
+def fill_module_lessons(course, lessons, lessons_data):
+    """Store the generated content and quizzes of one module's pending lessons"""
+    quizzes = []
+    for lesson, lesson_data in zip(lessons, lessons_data):
+        lesson.content = lesson_data['content']
+        lesson.is_pending = False
+        for quiz in build_quizzes(lesson_data):
+            quiz.lesson = lesson
+            quizzes.append(quiz)
+
+    with transaction.atomic():
+        Lesson.objects.bulk_update(lessons, ['content', 'is_pending'])
+        Quiz.objects.bulk_create(quizzes)
+    invalidate_course_tree(course.id)
+
+def generate_course_progressively(topic, language='en', user=None, on_progress=None):
+    """
+    Like generate_course_from_ai, but the course becomes usable lesson by
+    lesson: the outline is saved first (lessons marked is_pending), then
+    each module is stored as soon as its content arrives.
+
+    on_progress(course, ready_lessons, total_lessons, first_lesson_id) is
+    called after the outline and after every module; first_lesson_id is set
+    once the course's first lesson is ready. If a module still fails after
+    its retries, the half-generated course is deleted and the error raised.
+    """
+    course = reuse_existing_course(topic, language, user)
+    if course:
+        return course
+
+    if not ai_client.is_available():
+        raise ImportError(
+            "google-generativeai package is not installed. "
+            "Install it with: pip install google-generativeai"
+        )
+
+    outline = generate_outline(topic, language)
+    course, lessons = save_course_outline(outline, language, user, topic)
+    total = sum(len(module_lessons) for module_lessons in lessons)
+    first_lesson = lessons[0][0]
+    ready = 0
+
+    def report():
+        if on_progress:
+            on_progress(course, ready, total, None if first_lesson.is_pending else first_lesson.id)
+
+    report()
+    try:
+        workers = max(1, min(settings.COURSE_GENERATION_WORKERS, len(lessons)))
+        cancelled = threading.Event()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # Module 1 is submitted first so the first lesson is ready as early as possible
+            futures = {
+                pool.submit(generate_module, outline, module, language, cancelled): module_lessons
+                for module, module_lessons in zip(outline['modules'], lessons)
+            }
+            try:
+                for future in as_completed(futures):
+                    module_lessons = futures[future]
+                    fill_module_lessons(course, module_lessons, future.result())
+                    ready += len(module_lessons)
+                    report()
+            except Exception:
+                # generate_module() has set `cancelled`, drop the modules still queued too
+                for future in futures:
+                    future.cancel()
+                raise
+    except Exception:
+        course.delete()
+        raise
+
+    course.is_generating = False
+    Course.objects.filter(pk=course.pk).update(is_generating=False)
+    invalidate_course_tree(course.id)
+    schedule_course_preparation(course)
+    return course
@@ -0,0 +1,142 @@
+"""
+Single-flight course generation.
+
+A double click on "Generate", or two users asking for the same topic at
+the same moment, would each queue a generate_course_task for the same
+course. While a generation is in flight its task id is kept in the cache
+under a key made of the normalized topic (see core.topics), the language
+and the generation settings. claim_generation() lets the first request
+start the task and makes every later identical request join it.
+
+Users who join are recorded as waiters of the task. The task enrolls them
+as soon as the course exists and again when it is done, for those who
+joined in between; check_task_status also enrolls a waiter who asks about
+the task after that. When the task ends the key is released, so later
+requests find the finished course through reuse_existing_course, or
+start over after a failure.
+
+The key and the waiters are written by the web process and read by the
+Celery worker, so they need a cache both see (CACHE_BACKEND=redis, or
+file on one machine). With Celery and the default local memory cache the
+worker could never release a key, and after a failed task identical
+requests would keep joining it until COURSE_GENERATION_INFLIGHT_TIMEOUT;
+there every request starts its own task instead, with a warning.
+"""
+
+import hashlib
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from .ratelimit import cache_is_per_process
+from .topics import normalize_topic
+
+_warned = False
+
+
+def is_enabled():
+    """False when the Celery workers can't see the flights of the web process"""
+    global _warned
+    if not getattr(settings, 'USE_CELERY', False) or not cache_is_per_process():
+        return True
+    if not _warned:
+        _warned = True
+        print(
+            "Identical course generations are not coalesced: the default cache is local memory, "
+            "which the Celery workers don't share. Set CACHE_BACKEND=redis."
+        )
+    return False
+
+
+def flight_key(topic, language):
+    params = '|'.join([
+        normalize_topic(topic),
+        language,
+        f'staged={settings.COURSE_GENERATION_STAGED}',
+        f'progressive={settings.COURSE_GENERATION_PROGRESSIVE}',
+    ])
+    return f"generation:inflight:{hashlib.sha256(params.encode('utf-8')).hexdigest()[:32]}"
+
+
+def waiter_count_key(task_id):
+    return f'generation:waiters:{task_id}'
+
+
+def waiter_key(task_id, slot):
+    return f'generation:waiters:{task_id}:{slot}'
+
+
+def add_waiter(task_id, user_id):
+    """Record that `user_id` waits for the course task `task_id` generates"""
+    timeout = settings.COURSE_GENERATION_INFLIGHT_TIMEOUT
+    count_key = waiter_count_key(task_id)
+    cache.add(count_key, 0, timeout=timeout)
+    try:
+        slot = cache.incr(count_key)
+    except ValueError:
+        # The counter was evicted between add() and incr()
+        cache.set(count_key, 1, timeout=timeout)
+        slot = 1
+    cache.set(waiter_key(task_id, slot), user_id, timeout=timeout)
+
+
+def get_waiters(task_id):
+    """IDs of the users who joined the task, in order"""
+    count = cache.get(waiter_count_key(task_id)) or 0
+    if not count:
+        return []
+    slots = cache.get_many([waiter_key(task_id, slot) for slot in range(1, count + 1)])
+    return list(dict.fromkeys(slots.values()))
+
+
+def claim_generation(topic, language, user_id=None):
+    """
+    (task_id, started) for a generation of `topic` in `language`: a new task
+    id to start the task with if none is in flight, otherwise the id of the
+    task in flight, which `user_id` has joined as a waiter.
+    """
+    task_id = str(uuid.uuid4())
+    if not is_enabled():
+        return task_id, True
+    key = flight_key(topic, language)
+    for _ in range(2):
+        if cache.add(key, task_id, timeout=settings.COURSE_GENERATION_INFLIGHT_TIMEOUT):
+            return task_id, True
+        existing = cache.get(key)
+        if existing:
+            if user_id:
+                add_waiter(existing, user_id)
+            return existing, False
+        # Released between add() and get(): claim it again
+    return task_id, True
+
+
+def release_generation(topic, language, task_id):
+    """Let the next identical request start a new task, unless another task already took over"""
+    if not is_enabled():
+        return
+    key = flight_key(topic, language)
+    if cache.get(key) == task_id:
+        cache.delete(key)
+
+
+def enroll_waiters(task_id, course):
+    """Enroll every user waiting for `task_id` in the course it generated"""
+    from .models import UserCourse
+
+    user_ids = get_waiters(task_id)
+    if user_ids:
+        UserCourse.objects.bulk_create(
+            [UserCourse(user_id=user_id, course_id=course.id) for user_id in user_ids],
+            ignore_conflicts=True,
+        )
+    return user_ids
+
+
+def enroll_waiter(task_id, user_id, course_id):
+    """Enroll `user_id` in `course_id` if they joined task `task_id`"""
+    from .models import UserCourse
+
+    if user_id not in get_waiters(task_id):
+        return False
+    UserCourse.objects.get_or_create(user_id=user_id, course_id=course_id)
+    return True
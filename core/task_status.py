@@ -0,0 +1,107 @@
+"""
+Status of Celery tasks, for check_task_status.
+
+get_task_status() turns the state of a course generation task (including
+the PROGRESS meta that generate_course_task reports with update_state) or
+of a chat reply into the JSON the chat page shows. Every status gets an
+ETag derived from its content.
+
+Instead of the page asking every couple of seconds, it sends the ETag of
+the status it already has and wait_for_status_change() holds the request
+open, re-reading the task state on the server until the status is
+different or the long-poll timeout is up. The reads start
+TASK_STATUS_POLL_INTERVAL seconds apart and back off to
+TASK_STATUS_POLL_MAX_INTERVAL while nothing changes, so a waiting page
+reads the result backend less often than the old client polling every 2
+seconds did. An unchanged status costs one 304 per timeout instead of a
+full response every poll.
+"""
+
+import asyncio
+import hashlib
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.urls import reverse
+from .retries import RETRYING, get_attempts
+
+
+def get_task_status(task_id):
+    """JSON-ready status of a Celery task"""
+    from celery.result import AsyncResult
+
+    task = AsyncResult(task_id)
+
+    # Outcome of every attempt so far, kept in the task's meta or result (see core.retries)
+    attempts = get_attempts(task.info)
+    response_data = {
+        'task_id': task_id,
+        # The page knows a task waiting for its retry as RETRY
+        'status': 'RETRY' if task.state == RETRYING else task.state,
+        'attempts': attempts,
+    }
+
+    if task.state == 'PENDING':
+        response_data['message'] = 'Task is waiting to start...'
+    elif task.state == 'STARTED':
+        response_data['message'] = 'Generating course... This may take 10-30 seconds.'
+    elif task.state == 'PROGRESS':
+        # Progressive generation (see services.generate_course_progressively)
+        progress = task.info or {}
+        response_data['message'] = f"Generated {progress.get('ready_lessons', 0)} of {progress.get('total_lessons', 0)} lessons..."
+        response_data['course_id'] = progress.get('course_id')
+        response_data['title'] = progress.get('title')
+        response_data['ready_lessons'] = progress.get('ready_lessons', 0)
+        response_data['total_lessons'] = progress.get('total_lessons', 0)
+        if progress.get('first_lesson_id'):
+            # The first lesson is ready: the course can be opened already
+            response_data['redirect_url'] = reverse('course_detail', args=[progress['course_id']])
+    elif task.state == 'SUCCESS' and isinstance(task.result, dict) and 'bot_message' in task.result:
+        # A chat reply (see chatbot_response_task)
+        result = task.result
+        response_data['user_id'] = result.get('user_id')
+        response_data['bot_message'] = result['bot_message']
+        response_data['topic_clear'] = result.get('topic_clear', False)
+        response_data['topic'] = result.get('topic')
+    elif task.state == 'SUCCESS':
+        result = task.result if isinstance(task.result, dict) else {}
+        response_data['message'] = result.get('message', 'Course generated successfully!')
+        response_data['course_id'] = result.get('course_id')
+        response_data['title'] = result.get('title')
+        response_data['redirect_url'] = '/dashboard/'
+    elif task.state == 'FAILURE':
+        response_data['message'] = f'Error: {str(task.info)}'
+        response_data['error'] = True
+    elif task.state in ('RETRY', RETRYING):
+        response_data['message'] = 'Retrying... Please wait.'
+        if attempts and attempts[-1].get('retry_in') is not None:
+            response_data['message'] = f"The AI service is busy, retrying in {attempts[-1]['retry_in']} seconds..."
+    else:
+        response_data['message'] = f'Task status: {task.state}'
+
+    return response_data
+
+
+def status_etag(data):
+    digest = hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+async def wait_for_status_change(task_id, etag=None, timeout=0, get_status=get_task_status):
+    """
+    The task's status and its ETag, as soon as the ETag differs from `etag`
+    or after `timeout` seconds, whichever comes first. The status is re-read
+    less often the longer it stays the same.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    interval = settings.TASK_STATUS_POLL_INTERVAL
+    read_status = sync_to_async(get_status, thread_sensitive=False)
+    while True:
+        data = await read_status(task_id)
+        new_etag = status_etag(data)
+        remaining = deadline - loop.time()
+        if new_etag != etag or remaining <= 0:
+            return data, new_etag
+        await asyncio.sleep(min(interval, remaining))
+        interval = min(interval * 1.5, settings.TASK_STATUS_POLL_MAX_INTERVAL)
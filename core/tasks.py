@@ -3,23 +3,28 @@ Celery tasks for the Study application.
 
 This module contains asynchronous tasks for:
 - Course generation (heavy, long-running tasks)
+- Course preparation after generation (quick tasks)
 - Chat responses (quick tasks)
 """
 
 from celery import shared_task
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .services import generate_course_from_ai, chatbot_response
-from .models import ChatMessage
+from .services import (
+    generate_course_from_ai, generate_course_progressively, chatbot_response, save_chatbot_reply, prepare_course
+)
+from .models import Course
+from .chat_context import get_chat_context, summarize_chat
+from .retries import is_transient, retry_delay, attempt_entry, previous_attempts, retry_later
+from .singleflight import enroll_waiters, release_generation
 
 User = get_user_model()
 
 
 @shared_task(
     bind=True,
-    autoretry_for=(Exception,),
-    retry_backoff=True,
-    retry_backoff_max=600,  # Max 10 minutes
-    max_retries=5,
+    # Retried by hand, only for transient errors (see core.retries)
+    max_retries=settings.COURSE_TASK_MAX_RETRIES,
     name='core.tasks.generate_course_task'
 )
 def generate_course_task(self, topic, language='en', user_id=None):
@@ -38,27 +43,62 @@ def generate_course_task(self, topic, language='en', user_id=None):
         dict: Course information including id, title, and description
     
     Raises:
-        Exception: Any error during course generation (will auto-retry)
+        Exception: Any error during course generation. Transient ones (rate
+            limits, timeouts, 5xx) are retried after the provider's
+            retry-after hint or an exponential backoff; permanent ones fail
+            the task at once. Every attempt is kept in the task's state
+            for check_task_status (see core.retries).
+
+    Identical requests made meanwhile join this task instead of starting
+    another (see core.singleflight); their users are enrolled too.
     """
+    attempts = previous_attempts(self)
+    attempt = self.request.retries + 1
     try:
         user = None
         if user_id:
             user = User.objects.get(id=user_id)
         
         # Generate the course
-        course = generate_course_from_ai(topic, language, user)
-        
+        if settings.COURSE_GENERATION_PROGRESSIVE:
+            def report_progress(course, ready_lessons, total_lessons, first_lesson_id):
+                # Users who joined so far can open the course as well
+                enroll_waiters(self.request.id, course)
+                # Polled by check_task_status, which sends the user to the
+                # course as soon as its first lesson is ready
+                self.update_state(state='PROGRESS', meta={
+                    'course_id': course.id,
+                    'title': course.title,
+                    'ready_lessons': ready_lessons,
+                    'total_lessons': total_lessons,
+                    'first_lesson_id': first_lesson_id,
+                    'attempts': attempts,
+                })
+
+            course = generate_course_progressively(topic, language, user, on_progress=report_progress)
+        else:
+            course = generate_course_from_ai(topic, language, user)
+
+        enroll_waiters(self.request.id, course)
+        # Later requests find the course through reuse_existing_course
+        release_generation(topic, language, self.request.id)
         return {
             'success': True,
             'course_id': course.id,
             'title': course.title,
             'description': course.description,
-            'message': f'Course "{course.title}" generated successfully!'
+            'reused': getattr(course, 'reused', False),
+            'message': f'Course "{course.title}" generated successfully!',
+            'attempts': attempts + [attempt_entry(attempt, 'succeeded')],
         }
     except Exception as e:
-        # Log the error
-        print(f"Error in generate_course_task (attempt {self.request.retries + 1}/{self.max_retries}): {e}")
-        # Re-raise to trigger retry
+        if is_transient(e) and self.request.retries < self.max_retries:
+            countdown = retry_delay(e, self.request.retries)
+            print(f"Transient error in generate_course_task (attempt {attempt}/{self.max_retries + 1}), retrying in {countdown}s: {e}")
+            retry_later(self, e, attempts + [attempt_entry(attempt, 'retrying', e, retry_in=countdown)], countdown)
+        print(f"Error in generate_course_task (attempt {attempt}/{self.max_retries + 1}), not retrying: {e}")
+        # The next identical request starts over
+        release_generation(topic, language, self.request.id)
         raise
 
 
@@ -67,35 +107,94 @@ def generate_course_task(self, topic, language='en', user_id=None):
     autoretry_for=(Exception,),
     retry_backoff=True,
     max_retries=3,
+    name='core.tasks.prepare_course_task'
+)
+def prepare_course_task(self, course_id, force=False):
+    """
+    Post-generation stage: pre-render lessons, index navigation and warm
+    the course tree cache (see services.prepare_course). The caches are
+    only warmed if the web processes share the worker's cache.
+
+    Idempotent, so retries and duplicate deliveries are safe.
+
+    Args:
+        course_id (int): The course to prepare
+        force (bool): Prepare again even if the course is already prepared
+
+    Returns:
+        bool: False if the course was already prepared
+    """
+    try:
+        course = Course.objects.get(id=course_id)
+    except Course.DoesNotExist:
+        return False
+    return prepare_course(course, force=force)
+
+
+@shared_task(
+    bind=True,
+    # Retried by hand, only for transient errors before the reply is saved
+    max_retries=3,
     name='core.tasks.chatbot_response_task'
 )
-def chatbot_response_task(self, user_message, chat_history_ids, language='en'):
+def chatbot_response_task(self, user_id, user_message, language='en', message_id=None):
     """
     Asynchronous task to generate chatbot responses.
     
     This is a quick task routed to the 'default' queue with high concurrency.
     
     Args:
+        user_id (int): The user who sent the message
         user_message (str): The user's message
-        chat_history_ids (list): List of ChatMessage IDs for context
         language (str): Language code ('en', 'ru', 'kaa')
+        message_id (int, optional): ID of the saved ChatMessage being
+            answered; it and later messages are left out of the context
     
     Returns:
-        str: The chatbot's response
+        dict: bot_message, topic_clear and topic, like send_message, and
+        the user_id the reply belongs to. The reply is already saved.
     
     Raises:
-        Exception: Any error during response generation (will auto-retry)
+        Exception: Any error before the reply is saved. Transient API
+            errors are retried like in generate_course_task; on the last
+            attempt they become the error reply, as in send_message.
+            Nothing is retried once the reply is saved, so a failure after
+            that can't save it twice.
     """
+    attempt = self.request.retries + 1
     try:
-        # Reconstruct chat history from IDs
-        chat_history = ChatMessage.objects.filter(id__in=chat_history_ids).order_by('timestamp')
+        # Recent messages and the summary of older ones, like send_message
+        context = get_chat_context(user_id, before_id=message_id)
         
         # Generate response
-        response = chatbot_response(user_message, chat_history, language)
-        
-        return response
+        response = chatbot_response(
+            user_message, context, language, raise_transient=self.request.retries < self.max_retries
+        )
     except Exception as e:
-        # Log the error
-        print(f"Error in chatbot_response_task (attempt {self.request.retries + 1}/{self.max_retries}): {e}")
-        # Re-raise to trigger retry
+        if is_transient(e) and self.request.retries < self.max_retries:
+            countdown = retry_delay(e, self.request.retries)
+            print(f"Transient error in chatbot_response_task (attempt {attempt}/{self.max_retries + 1}), retrying in {countdown}s: {e}")
+            raise self.retry(exc=e, countdown=countdown)
+        print(f"Error in chatbot_response_task (attempt {attempt}/{self.max_retries + 1}), not retrying: {e}")
         raise
+
+    # Delivered by check_task_status, which only shows it to its user
+    return {**save_chatbot_reply(user_id, response, context), 'user_id': user_id}
+
+
+@shared_task(
+    bind=True,
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    max_retries=3,
+    name='core.tasks.summarize_chat_task'
+)
+def summarize_chat_task(self, user_id):
+    """
+    Fold the chat messages that left the chatbot's context window into the
+    user's rolling summary (see core.chat_context).
+
+    Returns:
+        bool: False if there was not a full batch of messages to summarize
+    """
+    return summarize_chat(user_id)
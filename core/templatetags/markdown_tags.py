@@ -0,0 +1,10 @@
+from django import template
+from ..rendering import get_rendered_html
+
+register = template.Library()
+
+
+@register.filter
+def markdown(value):
+    """Render a Markdown string (e.g. a quiz question) to sanitized, cached HTML"""
+    return get_rendered_html(str(value))
@@ -1,3 +1,1201 @@
-from django.test import TestCase
+import asyncio
+import json
+import shutil
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+from google.api_core import exceptions as api_exceptions
+from django.db import connection
+from django.core.cache import cache, caches
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.contrib.sessions.backends.cache import SessionStore
+from datetime import timedelta
+from django.utils import timezone
+from .middleware import StreakMiddleware
+from .models import CustomUser, Course, Module, Lesson, UserProgress, UserCourse, ChatMessage, ChatSummary, UserStreak, Quiz
+from . import ai_client, chat_cache
+from .services import TopicMarkerFilter, split_topic_marker, generate_course_from_ai, generate_course_progressively
+from .topics import normalize_topic, trigram_similarity
+from .generation import generate_course_staged
+from .ai_json import AIResponseError, JSONScanner, parse_json, validate_course
+from . import retries
+from .task_status import status_etag, wait_for_status_change
+from .chat_context import ChatContext, get_chat_context, summarize_chat
+from .services import build_chatbot_prompt, chatbot_response, CHATBOT_ERROR_REPLY
+from . import ratelimit, singleflight
+from .services import prepare_course
+from .services import get_course_tree, course_tree_cache_key
+from .management.commands.bench_course_insert import build_course_data, save_course_per_row
+from .services import save_course_tree
+from .rendering import render_markdown, get_lesson_html, content_cache_key
+from django.contrib import admin
+from . import ranking
+from .leaderboard import get_leaderboard_page, get_user_rank, get_users_around
+from .services import record_quiz_attempt
+from django.core.management import call_command, CommandError
+from io import StringIO
 
-# Create your tests here.
+
+class DashboardQueryCountTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='learner', password='secret')
+        self.client.force_login(self.user)
+        # First request of the day creates the user's streak
+        self.client.get(reverse('dashboard'))
+
+    def enroll_in_course(self, index):
+        course = Course.objects.create(title=f'Course {index}', description='Description')
+        for module_order in range(1, 3):
+            module = Module.objects.create(course=course, title=f'Module {module_order}', order=module_order)
+            for lesson_order in range(1, 4):
+                lesson = Lesson.objects.create(
+                    module=module, title=f'Lesson {lesson_order}', content='Content', order=lesson_order
+                )
+                if lesson_order == 1:
+                    UserProgress.objects.create(user=self.user, lesson=lesson, is_completed=True, score=10)
+        UserCourse.objects.create(user=self.user, course=course)
+        return course
+
+    def count_dashboard_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def test_query_count_does_not_grow_with_enrolled_courses(self):
+        self.enroll_in_course(0)
+        queries_for_one, _ = self.count_dashboard_queries()
+
+        for index in range(1, 30):
+            self.enroll_in_course(index)
+        queries_for_thirty, response = self.count_dashboard_queries()
+
+        self.assertEqual(queries_for_one, queries_for_thirty)
+        self.assertEqual(len(response.context['courses']), 30)
+
+    def test_progress_and_module_counts(self):
+        self.enroll_in_course(0)
+        _, response = self.count_dashboard_queries()
+
+        course = response.context['courses'][0]
+        self.assertEqual(course.module_count, 2)
+        self.assertEqual(course.total_lessons, 6)
+        self.assertEqual(course.completed_lessons, 2)
+        self.assertEqual(course.progress, 33)
+
+
+class TopicMarkerFilterTests(TestCase):
+    def stream(self, chunks):
+        marker_filter = TopicMarkerFilter()
+        visible = [marker_filter.feed(chunk) for chunk in chunks]
+        visible.append(marker_filter.finish())
+        return visible, marker_filter
+
+    def test_marker_split_across_chunks_is_never_shown(self):
+        visible, marker_filter = self.stream(['Great choice! TOP', 'IC_CL', 'EAR: Python ', 'basics\nEnjoy.'])
+
+        self.assertEqual(''.join(visible), 'Great choice! \nEnjoy.')
+        self.assertNotIn('TOP', visible[0])
+        self.assertTrue(marker_filter.topic_clear)
+        self.assertEqual(marker_filter.topic, 'Python basics')
+
+    def test_text_resembling_the_marker_is_released(self):
+        visible, marker_filter = self.stream(['What about TOPIC', 'S like this?'])
+
+        self.assertEqual(''.join(visible), 'What about TOPICS like this?')
+        self.assertFalse(marker_filter.topic_clear)
+        self.assertIsNone(marker_filter.topic)
+
+    def test_matches_complete_reply_parsing(self):
+        self.assertEqual(
+            split_topic_marker('Sounds good.\nTOPIC_CLEAR: Django ORM'),
+            ('Sounds good.', True, 'Django ORM')
+        )
+
+
+@override_settings(AI_BACKEND='fake', AI_FAKE_LATENCY=0)
+class ChatViewTests(TestCase):
+    def setUp(self):
+        ai_client._backend = None
+        self.addCleanup(setattr, ai_client, '_backend', None)
+        self.user = CustomUser.objects.create_user(username='chatter', password='secret')
+
+    async def test_async_send_message_saves_both_messages(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(reverse('send_message'), {'message': 'Hello'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['bot_message'], ai_client.FAKE_REPLY)
+        self.assertEqual(await ChatMessage.objects.filter(user=self.user).acount(), 2)
+
+    @override_settings(USE_CELERY=True)
+    async def test_send_message_answers_inline_when_celery_is_unavailable(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(reverse('send_message'), {'message': 'Hello'})
+
+        self.assertEqual(response.json()['bot_message'], ai_client.FAKE_REPLY)
+        self.assertNotIn('task_id', response.json())
+        self.assertEqual(await ChatMessage.objects.filter(user=self.user).acount(), 2)
+
+    async def test_stream_ends_with_done_event_and_saves_reply(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(reverse('send_message_stream'), {'message': 'Hello'})
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertIn('event: done', body)
+        reply = await ChatMessage.objects.filter(user=self.user, is_user=False).aget()
+        self.assertEqual(reply.message, ai_client.FAKE_REPLY)
+
+    @override_settings(AI_FAKE_LATENCY=1)
+    async def test_stream_saves_partial_reply_when_client_disconnects(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(reverse('send_message_stream'), {'message': 'Hello'})
+        first_delta = asyncio.Event()
+
+        async def read_stream():
+            async for chunk in response.streaming_content:
+                if b'delta' in chunk:
+                    first_delta.set()
+
+        # A disconnect cancels the task that relays the stream
+        reader = asyncio.ensure_future(read_stream())
+        await first_delta.wait()
+        reader.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await reader
+
+        reply = await ChatMessage.objects.filter(user=self.user, is_user=False).aget()
+        self.assertTrue(ai_client.FAKE_REPLY.startswith(reply.message))
+        self.assertNotEqual(reply.message, ai_client.FAKE_REPLY)
+
+
+@override_settings(AI_BACKEND='fake', AI_FAKE_LATENCY=0)
+class LessonChatbotCacheTests(TestCase):
+    def setUp(self):
+        ai_client._backend = None
+        self.addCleanup(setattr, ai_client, '_backend', None)
+        cache.clear()
+        caches['lesson_chatbot'].clear()
+        self.user = CustomUser.objects.create_user(username='student', password='secret')
+        course = Course.objects.create(title='Python', description='Description')
+        module = Module.objects.create(course=course, title='Basics', order=1)
+        self.lesson = Lesson.objects.create(module=module, title='Lists', content='Lists hold items.', order=1)
+
+    def test_normalized_question_is_served_from_cache(self):
+        self.client.force_login(self.user)
+        url = reverse('lesson_chatbot', args=[self.lesson.id])
+        self.client.post(url, {'message': 'What is a list?'})
+        with override_settings(AI_BACKEND='core.tests.FailingBackend'):
+            ai_client._backend = None
+            response = self.client.post(url, {'message': '  what is a LIST '})
+
+        self.assertContains(response, ai_client.FAKE_REPLY)
+        self.assertEqual(chat_cache.get_stats()['hits'], 1)
+        self.assertEqual(chat_cache.get_stats()['misses'], 1)
+
+    def test_punctuation_that_changes_the_question_is_kept(self):
+        for first, second in (('a == b', 'a != b'), ('C++', 'C#'), ('2+2', '2-2')):
+            with self.subTest(first):
+                self.assertNotEqual(
+                    chat_cache.answer_key(1, 'v', 'en', first), chat_cache.answer_key(1, 'v', 'en', second)
+                )
+        self.assertEqual(chat_cache.normalize_question(' What  is C++? '), 'what is c++')
+
+    def test_stats_command_needs_a_shared_cache(self):
+        # The test settings use the per-process local memory cache
+        with self.assertRaises(CommandError):
+            call_command('lesson_chatbot_cache_stats', stdout=StringIO())
+
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, True)
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}}
+        with override_settings(CACHES=shared):
+            out = StringIO()
+            call_command('lesson_chatbot_cache_stats', stdout=out)
+        self.assertIn('Misses:        0', out.getvalue())
+
+    def test_invalidate_lesson_drops_its_answers(self):
+        chat_cache.cache_answer(self.lesson.id, 'en', 'What is a list?', 'An ordered collection.')
+        chat_cache.invalidate_lesson(self.lesson.id)
+
+        self.assertIsNone(chat_cache.get_cached_answer(self.lesson.id, 'en', 'What is a list?'))
+
+    @override_settings(LESSON_CHATBOT_SEMANTIC_CACHE=True, LESSON_CHATBOT_SIMILARITY=0.8)
+    def test_similar_question_hits_semantic_tier(self):
+        chat_cache.cache_answer(self.lesson.id, 'en', 'how do python lists store items', 'In order.')
+
+        answer = chat_cache.get_cached_answer(self.lesson.id, 'en', 'how do python lists store their items')
+
+        self.assertEqual(answer, 'In order.')
+        self.assertEqual(chat_cache.get_stats()['semantic_hits'], 1)
+
+
+    @override_settings(LESSON_CHATBOT_SEMANTIC_CACHE=True, LESSON_CHATBOT_SIMILARITY=0.5)
+    def test_similar_question_with_another_version_misses(self):
+        chat_cache.cache_answer(self.lesson.id, 'en', 'What is new in Python 3.11?', 'Faster CPython.')
+
+        self.assertIsNone(chat_cache.get_cached_answer(self.lesson.id, 'en', 'What is new in Python 3.10?'))
+        self.assertEqual(chat_cache.get_cached_answer(self.lesson.id, 'en', 'what is new in python 3.11 now'), 'Faster CPython.')
+
+
+class FailingBackend:
+    def agenerate(self, prompt, json_mode=False, timeout=None):
+        raise AssertionError('The model should not be called on a cache hit')
+
+
+@override_settings(AI_BACKEND='fake', AI_FAKE_LATENCY=0, COURSE_REUSE_SIMILARITY=0.7)
+class CourseReuseTests(TestCase):
+    def setUp(self):
+        ai_client._backend = None
+        self.addCleanup(setattr, ai_client, '_backend', None)
+        self.first = CustomUser.objects.create_user(username='first', password='secret')
+        self.second = CustomUser.objects.create_user(username='second', password='secret')
+
+    def test_topic_key_ignores_case_punctuation_fillers_and_order(self):
+        self.assertEqual(normalize_topic('The basics of Python!'), normalize_topic('python   BASICS'))
+
+    def test_same_topic_enrolls_in_existing_course(self):
+        course = generate_course_from_ai('Python basics', 'en', self.first)
+        reused = generate_course_from_ai('the basics of python', 'en', self.second)
+
+        self.assertEqual(reused.id, course.id)
+        self.assertTrue(reused.reused)
+        self.assertEqual(Course.objects.count(), 1)
+        self.assertTrue(UserCourse.objects.filter(user=self.second, course=course).exists())
+
+    def test_similar_topic_is_reused_but_other_language_is_not(self):
+        course = generate_course_from_ai('React hooks', 'en', self.first)
+
+        self.assertEqual(generate_course_from_ai('React.js hooks', 'en', self.second).id, course.id)
+        self.assertNotEqual(generate_course_from_ai('React hooks', 'ru', self.second).id, course.id)
+        self.assertNotEqual(generate_course_from_ai('Vue hooks', 'en', self.second).id, course.id)
+
+    def test_similar_topic_with_another_version_is_not_reused(self):
+        course = generate_course_from_ai('Python 3.11', 'en', self.first)
+
+        self.assertGreaterEqual(trigram_similarity(normalize_topic('Python 3.10'), course.topic_key), 0.7)
+        self.assertNotEqual(generate_course_from_ai('Python 3.10', 'en', self.second).id, course.id)
+        self.assertEqual(generate_course_from_ai('Python 3.11 course', 'en', self.second).id, course.id)
+
+
+class FlakyModuleBackend(ai_client.FakeBackend):
+    """Returns broken JSON the first time the second module is requested"""
+
+    def __init__(self):
+        self.prompts = []
+
+    def generate(self, prompt, json_mode=False, timeout=None):
+        self.prompts.append(prompt)
+        if 'Write module 2' in prompt and sum('Write module 2' in p for p in self.prompts) == 1:
+            return '{"lessons": [{"title": "Cut off'
+        return super().generate(prompt, json_mode, timeout)
+
+
+@override_settings(AI_BACKEND='core.tests.FlakyModuleBackend', AI_FAKE_LATENCY=0, COURSE_GENERATION_PIECE_ATTEMPTS=2)
+class StagedGenerationTests(TestCase):
+    def setUp(self):
+        ai_client._backend = None
+        self.addCleanup(setattr, ai_client, '_backend', None)
+
+    def test_outline_then_modules_with_only_the_broken_module_retried(self):
+        course_data = generate_course_staged('Python basics')
+        prompts = ai_client.get_backend().prompts
+
+        self.assertEqual(len(prompts), 5)  # outline, 3 modules, 1 retry
+        self.assertEqual(sum('Write module 2' in prompt for prompt in prompts), 2)
+        self.assertEqual([len(module['lessons']) for module in course_data['modules']], [5, 5, 1])
+        self.assertEqual(len(course_data['modules'][2]['lessons'][0]['quizzes']), 10)
+        self.assertEqual(course_data['modules'][0]['lessons'][1]['order'], 2)
+
+
+@override_settings(AI_BACKEND='fake', AI_FAKE_LATENCY=0)
+class ProgressiveGenerationTests(TestCase):
+    def setUp(self):
+        ai_client._backend = None
+        self.addCleanup(setattr, ai_client, '_backend', None)
+        self.user = CustomUser.objects.create_user(username='learner', password='secret')
+
+    def test_outline_is_saved_first_and_lessons_fill_in(self):
+        progress = []
+
+        def on_progress(course, ready, total, first_lesson_id):
+            pending = Lesson.objects.filter(module__course=course, is_pending=True).count()
+            progress.append((ready, total, first_lesson_id, pending))
+
+        course = generate_course_progressively('Python basics', 'en', self.user, on_progress=on_progress)
+
+        self.assertEqual(progress[0], (0, 11, None, 11))
+        self.assertEqual(progress[-1][:2], (11, 11))
+        self.assertIsNotNone(progress[-1][2])
+        self.assertEqual(len(progress), 4)  # outline and one report per module
+        self.assertFalse(Course.objects.get(id=course.id).is_generating)
+        self.assertFalse(Lesson.objects.filter(module__course=course, is_pending=True).exists())
+        self.assertTrue(UserCourse.objects.filter(user=self.user, course=course).exists())
+
+    def test_pending_lesson_shows_placeholder(self):
+        self.client.force_login(self.user)
+        course = Course.objects.create(title='Python', description='Description', is_generating=True)
+        module = Module.objects.create(course=course, title='Basics', order=1)
+        lesson = Lesson.objects.create(module=module, title='Lists', content='', order=1, is_pending=True)
+
+        self.assertContains(self.client.get(reverse('course_detail', args=[course.id])), 'Being generated')
+        self.assertContains(self.client.get(reverse('lesson_detail', args=[lesson.id])), 'still being generated')
+
+    def test_tree_is_not_cached_while_generating(self):
+        cache.clear()
+        course = Course.objects.create(title='Python', description='Description', is_generating=True)
+        module = Module.objects.create(course=course, title='Basics', order=1)
+        Lesson.objects.create(module=module, title='Lists', content='', order=1, is_pending=True)
+
+        get_course_tree(course.id)
+        self.assertIsNone(cache.get(course_tree_cache_key(course.id)))
+
+        course.is_generating = False
+        course.save()
+        get_course_tree(course.id)
+        self.assertIsNotNone(cache.get(course_tree_cache_key(course.id)))
+
+    @override_settings(AI_BACKEND='core.tests.FlakyModuleBackend', COURSE_GENERATION_PIECE_ATTEMPTS=1)
+    def test_failed_module_removes_the_partial_course(self):
+        ai_client._backend = None
+        with self.assertRaises(ValueError):
+            generate_course_progressively('Python basics', 'en', self.user)
+
+        self.assertFalse(Course.objects.exists())
+
+
+AI_RESPONSES = Path(__file__).parent / 'test_data' / 'ai_responses'
+
+
+class AIResponseParsingTests(TestCase):
+    """Malformed model replies collected in test_data/ai_responses"""
+
+    def load(self, name):
+        return (AI_RESPONSES / name).read_text(encoding='utf-8')
+
+    def lesson(self, name, index=0):
+        return parse_json(self.load(name))['modules'][0]['lessons'][index]
+
+    def test_every_reply_in_the_corpus_parses(self):
+        for path in sorted(AI_RESPONSES.glob('*.txt')):
+            with self.subTest(path.name):
+                self.assertEqual(parse_json(path.read_text(encoding='utf-8'))['title'], 'Python Basics')
+
+    def test_valid_escapes_are_kept(self):
+        lesson = self.lesson('escaped_quotes.txt')
+        self.assertEqual(lesson['content'], 'Call print("hi") to say "hi".\nA backslash is written \\\\.')
+        self.assertEqual(lesson['quizzes'][0]['options'], ['a', '"a"'])
+
+    def test_repairs_keep_the_text(self):
+        self.assertIn('C:\\Users\\dev', self.lesson('invalid_escapes.txt')['content'])
+        self.assertIn('with\ttabs:\n\n    print(1)', self.lesson('raw_newlines.txt')['content'])
+        self.assertIn('close it with } before', self.lesson('braces_in_strings.txt')['content'])
+
+    def test_scanner_finds_the_object_when_fed_in_chunks(self):
+        text = self.load('prose_around.txt')
+        scanner = JSONScanner()
+        completed = [scanner.feed(text[i:i + 7]) for i in range(0, len(text), 7)]
+        self.assertTrue(completed[-1])
+        self.assertEqual(json.loads(scanner.text)['title'], 'Python Basics')
+
+    def test_validation_reports_the_broken_lessons(self):
+        course_data = parse_json(self.load('correct_answer_forms.txt'))
+        errors = validate_course(course_data)
+
+        # The reply has one module of two lessons, the module's other three are missing
+        self.assertEqual(list(errors), [(0, 1), (0, 2), (0, 3), (0, 4)])
+        self.assertIn('modules[0].lessons[1].quizzes[0].correct_answer', errors[(0, 1)][0])
+        self.assertEqual(errors[(0, 2)], ['modules[0].lessons[2]: missing'])
+        # An answer given as the option's text or as a digit string is converted
+        quizzes = course_data['modules'][0]['lessons'][0]['quizzes']
+        self.assertEqual([quiz['correct_answer'] for quiz in quizzes], [1, 0])
+
+    def test_numeric_option_text_wins_over_an_index(self):
+        course_data = parse_json(self.load('numeric_options.txt'))
+
+        # Only the lessons missing from the one-lesson reply
+        self.assertEqual(list(validate_course(course_data)), [(0, 1), (0, 2), (0, 3), (0, 4)])
+        quizzes = course_data['modules'][0]['lessons'][0]['quizzes']
+        # "2" is the text of the second option, then an index when no option matches
+        self.assertEqual([quiz['correct_answer'] for quiz in quizzes], [1, 2])
+
+    def test_truncated_reply_keeps_the_complete_lessons(self):
+        course_data = parse_json(self.load('truncated.txt'))
+        errors = validate_course(course_data)
+        self.assertEqual(list(errors), [(0, 1), (0, 2), (0, 3), (0, 4)])
+        self.assertEqual(errors[(0, 1)], ['modules[0].lessons[1].quizzes: missing'])
+
+    def test_lessons_need_a_title(self):
+        course_data = parse_json(self.load('numeric_options.txt'))
+        del course_data['modules'][0]['lessons'][0]['title']
+        self.assertEqual(validate_course(course_data)[(0, 0)], ['modules[0].lessons[0].title: missing'])
+
+    def test_extra_modules_are_rejected_and_extra_lessons_dropped(self):
+        course_data = parse_json(self.load('numeric_options.txt'))
+        lessons = course_data['modules'][0]['lessons']
+        lessons.extend(dict(lessons[0]) for _ in range(5))
+        self.assertEqual(validate_course(course_data), {})
+        self.assertEqual(len(lessons), 5)
+
+        course_data['modules'] *= 4
+        with self.assertRaises(AIResponseError):
+            validate_course(course_data)
+
+    def test_truncation_drops_a_dangling_comma_or_key(self):
+        lessons = parse_json(self.load('truncated_after_comma.txt'))['modules'][0]['lessons']
+        self.assertEqual([lesson['title'] for lesson in lessons], ['Hello'])
+        self.assertNotIn('key', self.lesson('truncated_after_key.txt'))
+        quiz = self.lesson('truncated_in_list.txt')['quizzes'][0]
+        self.assertEqual(quiz['options'], ['print', 'echo'])
+
+    def test_reply_without_json_raises(self):
+        with self.assertRaises(AIResponseError):
+            parse_json('I cannot help with that.')
+
+
+class BrokenLessonBackend(ai_client.FakeBackend):
+    """Breaks the third lesson of module 1, or cuts a whole-course reply off mid-lesson"""
+
+    def __init__(self):
+        self.prompts = []
+
+    def generate(self, prompt, json_mode=False, timeout=None):
+        self.prompts.append(prompt)
+        reply = super().generate(prompt, json_mode, timeout)
+        if 'Write module 1' in prompt:
+            data = json.loads(reply)
+            data['lessons'][2]['quizzes'][0]['correct_answer'] = 9
+            return json.dumps(data)
+        if 'Return only the outline' not in prompt and 'REWRITE LESSON' not in prompt and 'LESSON TITLES' not in prompt:
+            # Cut off in the middle of lesson 6's content
+            return reply[:reply.index('Placeholder', reply.index('Python basics lesson 6'))]
+        return reply
+
+
+@override_settings(AI_BACKEND='core.tests.BrokenLessonBackend', AI_FAKE_LATENCY=0)
+class LessonRepairTests(TestCase):
+    def setUp(self):
+        ai_client._backend = None
+        self.addCleanup(setattr, ai_client, '_backend', None)
+
+    def test_staged_generation_requests_only_the_broken_lesson(self):
+        course_data = generate_course_staged('Python basics')
+        prompts = ai_client.get_backend().prompts
+
+        self.assertEqual(len(prompts), 5)  # outline, 3 modules, 1 lesson
+        # Modules run in parallel, so the lesson is not necessarily the last prompt
+        rewrites = [prompt for prompt in prompts if 'REWRITE LESSON' in prompt]
+        self.assertEqual(len(rewrites), 1)
+        self.assertIn('REWRITE LESSON: Python basics lesson 3', rewrites[0])
+        self.assertEqual(course_data['modules'][0]['lessons'][2]['quizzes'][0]['correct_answer'], 0)
+
+    @override_settings(COURSE_GENERATION_STAGED=False)
+    def test_single_prompt_course_requests_only_the_lost_lessons(self):
+        course = generate_course_from_ai('Python basics', 'en')
+        prompts = ai_client.get_backend().prompts
+
+        # The reply is cut off in lesson 6: it is requested again, lessons 7
+        # to 10 are requested under titles from an outline, and the final
+        # exam module as a whole
+        self.assertEqual(sum('Return only the outline' in prompt for prompt in prompts), 1)
+        self.assertEqual(sum('REWRITE LESSON' in prompt for prompt in prompts), 5)
+        self.assertEqual(sum('LESSON TITLES' in prompt for prompt in prompts), 1)
+        lessons = Lesson.objects.filter(module__course=course).order_by('module__order', 'order')
+        self.assertEqual(
+            [(lesson.module.order, lesson.order, lesson.title) for lesson in lessons],
+            [(1, n, f'Python basics lesson {n}') for n in range(1, 6)]
+            + [(2, n - 5, f'Python basics lesson {n}') for n in range(6, 11)]
+            + [(3, 1, 'Python basics lesson 11')]
+        )
+        self.assertEqual(Quiz.objects.filter(lesson__module__order=3, lesson__module__course=course).count(), 10)
+
+
+class PermissionDeniedBackend(ai_client.FakeBackend):
+    def __init__(self):
+        self.prompts = []
+
+    def generate(self, prompt, json_mode=False, timeout=None):
+        self.prompts.append(prompt)
+        raise api_exceptions.PermissionDenied('API key not valid')
+
+
+class UnavailableBackend(ai_client.FakeBackend):
+    def generate(self, prompt, json_mode=False, timeout=None):
+        raise api_exceptions.ServiceUnavailable('Unavailable')
+
+
+@override_settings(COURSE_TASK_RETRY_BACKOFF_MAX=600)
+class RetryPolicyTests(TestCase):
+    def test_transient_and_permanent_errors(self):
+        for exc in (
+            api_exceptions.ResourceExhausted('Quota exceeded'),
+            api_exceptions.ServiceUnavailable('Unavailable'),
+            api_exceptions.DeadlineExceeded('Deadline'),
+            TimeoutError(),
+            ConnectionResetError(),
+        ):
+            self.assertTrue(retries.is_transient(exc), exc)
+        for exc in (
+            ImportError('google-generativeai package is not installed'),
+            KeyError('modules'),
+            AIResponseError('Invalid module'),
+            api_exceptions.PermissionDenied('API key not valid'),
+            api_exceptions.InvalidArgument('Bad request'),
+        ):
+            self.assertFalse(retries.is_transient(exc), exc)
+
+    def test_retry_delay_follows_the_provider_hint(self):
+        self.assertEqual(retries.retry_delay(api_exceptions.ResourceExhausted('Please retry in 37.5s.'), 0), 38)
+        info = SimpleNamespace(retry_delay=SimpleNamespace(seconds=12, nanos=0))
+        self.assertEqual(retries.retry_delay(api_exceptions.ResourceExhausted('Quota', details=[info]), 0), 12)
+        response = SimpleNamespace(headers={'Retry-After': '5000'}, status_code=429)
+        self.assertEqual(retries.retry_delay(api_exceptions.TooManyRequests('Slow down', response=response), 0), 600)
+        # Without a hint: exponential backoff with jitter
+        self.assertLessEqual(retries.retry_delay(TimeoutError(), 2), 8)
+
+    def test_attempts_are_carried_in_the_task_meta(self):
+        retrying = retries.attempt_entry(1, 'retrying', api_exceptions.ServiceUnavailable('Down'), retry_in=4)
+        self.assertTrue(retrying['transient'])
+        self.assertEqual(retrying['retry_in'], 4)
+
+        # The second run reads the history its retry stored in the result backend
+        stored = {'attempts': [retrying], 'retry_in': 4}
+        task = SimpleNamespace(
+            request=SimpleNamespace(id='task-1', retries=1),
+            AsyncResult=lambda task_id: SimpleNamespace(info=stored if task_id == 'task-1' else None),
+        )
+        attempts = retries.previous_attempts(task) + [retries.attempt_entry(2, 'succeeded')]
+        self.assertEqual([attempt['outcome'] for attempt in attempts], ['retrying', 'succeeded'])
+
+        task.request.retries = 0
+        self.assertEqual(retries.previous_attempts(task), [])
+        # A failed task's info is the exception
+        self.assertEqual(retries.get_attempts(ValueError('Broken')), [])
+
+    @override_settings(AI_BACKEND='core.tests.PermissionDeniedBackend', COURSE_GENERATION_PIECE_ATTEMPTS=3)
+    def test_pieces_are_not_retried_on_permanent_errors(self):
+        ai_client._backend = None
+        self.addCleanup(setattr, ai_client, '_backend', None)
+        with self.assertRaises(api_exceptions.PermissionDenied):
+            generate_course_staged('Python basics')
+        self.assertEqual(len(ai_client.get_backend().prompts), 1)
+
+    def test_chat_reply_raises_only_transient_errors_for_a_retry(self):
+        ai_client._backend = None
+        self.addCleanup(setattr, ai_client, '_backend', None)
+        context = ChatContext('', [], [])
+        with override_settings(AI_BACKEND='core.tests.UnavailableBackend'):
+            with self.assertRaises(api_exceptions.ServiceUnavailable):
+                chatbot_response('Hi', context, raise_transient=True)
+            # The last attempt answers with the error reply instead
+            self.assertEqual(chatbot_response('Hi', context), CHATBOT_ERROR_REPLY)
+        ai_client._backend = None
+        with override_settings(AI_BACKEND='core.tests.PermissionDeniedBackend'):
+            self.assertEqual(chatbot_response('Hi', context, raise_transient=True), CHATBOT_ERROR_REPLY)
+
+
+@override_settings(TASK_STATUS_POLL_INTERVAL=0.01, TASK_STATUS_POLL_MAX_INTERVAL=0.01)
+class TaskStatusLongPollTests(TestCase):
+    def status_sequence(self, *statuses):
+        reads = []
+
+        def get_status(task_id):
+            reads.append(task_id)
+            return {'task_id': task_id, 'status': statuses[min(len(reads), len(statuses)) - 1]}
+
+        return get_status, reads
+
+    async def test_answers_at_once_without_an_etag(self):
+        get_status, reads = self.status_sequence('PENDING')
+        data, etag = await wait_for_status_change('task-1', None, 5, get_status)
+
+        self.assertEqual(data['status'], 'PENDING')
+        self.assertEqual(etag, status_etag(data))
+        self.assertEqual(len(reads), 1)
+
+    async def test_waits_until_the_status_changes(self):
+        get_status, reads = self.status_sequence('PENDING', 'PENDING', 'PENDING', 'PROGRESS')
+        pending = status_etag({'task_id': 'task-1', 'status': 'PENDING'})
+        data, etag = await wait_for_status_change('task-1', pending, 5, get_status)
+
+        self.assertEqual(data['status'], 'PROGRESS')
+        self.assertNotEqual(etag, pending)
+        self.assertEqual(len(reads), 4)
+
+    async def test_unchanged_status_keeps_its_etag_after_the_timeout(self):
+        get_status, reads = self.status_sequence('STARTED')
+        started = status_etag({'task_id': 'task-1', 'status': 'STARTED'})
+        data, etag = await wait_for_status_change('task-1', started, 0.05, get_status)
+
+        self.assertEqual(etag, started)
+        self.assertGreater(len(reads), 1)
+
+    @override_settings(TASK_STATUS_POLL_MAX_INTERVAL=0.04)
+    async def test_reads_back_off_while_nothing_changes(self):
+        get_status, reads = self.status_sequence('STARTED')
+        started = status_etag({'task_id': 'task-1', 'status': 'STARTED'})
+        await wait_for_status_change('task-1', started, 0.3, get_status)
+
+        # Every 0.01s would be 30 reads, backing off to 0.04s is about 10
+        self.assertGreater(len(reads), 3)
+        self.assertLess(len(reads), 15)
+
+
+class RecordingBackend(ai_client.FakeBackend):
+    def __init__(self):
+        self.prompts = []
+
+    def generate(self, prompt, json_mode=False, timeout=None):
+        self.prompts.append(prompt)
+        return super().generate(prompt, json_mode, timeout)
+
+    async def agenerate(self, prompt, json_mode=False, timeout=None):
+        self.prompts.append(prompt)
+        return await super().agenerate(prompt, json_mode, timeout)
+
+
+@override_settings(
+    AI_BACKEND='core.tests.RecordingBackend', AI_FAKE_LATENCY=0, CHATBOT_CONTEXT_MESSAGES=4, CHATBOT_SUMMARY_BATCH=3
+)
+class ChatContextTests(TestCase):
+    def setUp(self):
+        ai_client._backend = None
+        self.addCleanup(setattr, ai_client, '_backend', None)
+        self.user = CustomUser.objects.create_user(username='chatter', password='secret')
+
+    def add_messages(self, count):
+        return [
+            ChatMessage.objects.create(user=self.user, message=f'Message {n}', is_user=n % 2 == 0)
+            for n in range(count)
+        ]
+
+    def test_window_is_read_in_one_query(self):
+        messages = self.add_messages(20)
+        with self.assertNumQueries(2):  # messages and summary
+            context = get_chat_context(self.user, before_id=messages[-1].id)
+
+        self.assertEqual([m.message for m in context.messages], [f'Message {n}' for n in range(15, 19)])
+        self.assertEqual(len(context.unsummarized), 3)
+        self.assertTrue(context.needs_summary)
+
+    def test_older_messages_are_folded_into_the_summary(self):
+        messages = self.add_messages(7)
+        self.assertTrue(summarize_chat(self.user.id))
+
+        summary = ChatSummary.objects.get(user=self.user)
+        self.assertEqual(summary.last_message_id, messages[2].id)
+        self.assertIn('Message 0', ai_client.get_backend().prompts[-1])
+
+        context = get_chat_context(self.user)
+        self.assertEqual(context.unsummarized, [])
+        self.assertFalse(summarize_chat(self.user.id))
+        prompt = build_chatbot_prompt('Next question', context)
+        self.assertIn(f'Summary of the earlier conversation: {summary.summary}', prompt)
+        self.assertNotIn('Message 2', prompt)
+
+    async def test_send_message_prompt_has_the_new_message_once(self):
+        await self.async_client.aforce_login(self.user)
+        await self.async_client.post(reverse('send_message'), {'message': 'Hello there'})
+
+        prompt = ai_client.get_backend().prompts[-1]
+        self.assertEqual(prompt.count('Hello there'), 1)
+
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        ratelimit.reset_buckets()
+        self.addCleanup(ratelimit.reset_buckets)
+        self.user = CustomUser.objects.create_user(username='chatter', password='secret')
+
+    def test_parse_rate(self):
+        self.assertEqual(ratelimit.parse_rate('20/min'), (20.0, 20 / 60))
+        self.assertEqual(ratelimit.parse_rate('5/hour'), (5.0, 5 / 3600))
+        self.assertIsNone(ratelimit.parse_rate(''))
+
+    def test_buckets_allow_a_burst_then_refill(self):
+        for buckets in (ratelimit.LocalBuckets(), ratelimit.CacheBuckets()):
+            with self.subTest(buckets=type(buckets).__name__):
+                self.assertEqual([buckets.take('test', 3, 1) for _ in range(3)], [0, 0, 0])
+                self.assertAlmostEqual(buckets.take('test', 3, 1), 1, places=1)
+                buckets.give_back('test', 3, 1)
+                self.assertEqual(buckets.take('test', 3, 1), 0)
+
+    def test_cache_buckets_need_a_shared_cache(self):
+        self.addCleanup(ratelimit.reset_buckets)
+        ratelimit.reset_buckets()
+        # The test settings use the per-process local memory cache
+        self.assertIsInstance(ratelimit.get_buckets(), ratelimit.LocalBuckets)
+
+        # The file cache is shared, but its add() is no lock
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/tmp'}}
+        with override_settings(CACHES=shared):
+            ratelimit.reset_buckets()
+            self.assertIsInstance(ratelimit.get_buckets(), ratelimit.LocalBuckets)
+
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://redis:6379/1'}}
+        with override_settings(CACHES=redis):
+            ratelimit.reset_buckets()
+            self.assertIsInstance(ratelimit.get_buckets(), ratelimit.CacheBuckets)
+
+    def test_stats_command_needs_a_shared_cache(self):
+        # The test settings use the per-process local memory cache
+        with self.assertRaises(CommandError):
+            call_command('rate_limit_stats', stdout=StringIO())
+
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, True)
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}}
+        with override_settings(CACHES=shared):
+            out = StringIO()
+            call_command('rate_limit_stats', stdout=out)
+        self.assertIn('Throttled requests: 0', out.getvalue())
+
+    @override_settings(AI_RATE_LIMIT_BACKEND='local', AI_RATE_LIMITS={'chat': {'user': '2/min', 'global': '3/min'}})
+    def test_global_limit_refunds_the_user_token(self):
+        other = CustomUser.objects.create_user(username='other', password='secret')
+        self.assertIsNone(ratelimit.check_rate_limit('chat', self.user.id))
+        self.assertIsNone(ratelimit.check_rate_limit('chat', self.user.id))
+        self.assertEqual(ratelimit.check_rate_limit('chat', self.user.id).reason, 'user')
+        self.assertIsNone(ratelimit.check_rate_limit('chat', other.id))
+        self.assertEqual(ratelimit.check_rate_limit('chat', other.id).reason, 'global')
+
+        stats = ratelimit.get_stats()['chat']
+        self.assertEqual((stats['allowed'], stats['user'], stats['global']), (3, 1, 1))
+
+    @override_settings(AI_BACKEND='fake', AI_FAKE_LATENCY=0, AI_RATE_LIMITS={'chat': {'user': '1/min'}})
+    async def test_send_message_is_throttled_before_saving(self):
+        await self.async_client.aforce_login(self.user)
+        await self.async_client.post(reverse('send_message'), {'message': 'Hello'})
+        response = await self.async_client.post(reverse('send_message'), {'message': 'Hello again'})
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['status'], 'throttled')
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(await ChatMessage.objects.filter(user=self.user).acount(), 2)
+
+    @override_settings(USE_CELERY=True, COURSE_GENERATION_MAX_BACKLOG=10)
+    def test_generation_is_refused_while_the_queue_is_backed_up(self):
+        self.assertIsNone(ratelimit.check_generation_backlog(lambda: 9))
+        throttle = ratelimit.check_generation_backlog(lambda: 10)
+
+        self.assertEqual(throttle.to_dict()['status'], 'busy')
+        self.assertEqual(throttle.to_dict()['queue_depth'], 10)
+        # An unreadable queue admits the request
+        self.assertIsNone(ratelimit.check_generation_backlog(lambda: None))
+        self.assertEqual(ratelimit.get_stats()['course_generation']['backlog'], 1)
+
+
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [CustomUser.objects.create_user(username=f'user{n}', password='secret') for n in range(3)]
+        self.course = Course.objects.create(title='Python', description='Basics', language='en')
+
+    @override_settings(USE_CELERY=True)
+    def test_not_coalesced_when_the_workers_cannot_see_the_cache(self):
+        # The test settings use the per-process local memory cache
+        first, started = singleflight.claim_generation('Python basics', 'en', self.users[0].id)
+        second, joined = singleflight.claim_generation('Python basics', 'en', self.users[1].id)
+
+        self.assertTrue(started and joined)
+        self.assertNotEqual(first, second)
+        self.assertEqual(singleflight.get_waiters(first), [])
+
+    def test_identical_requests_join_the_task_in_flight(self):
+        task_id, started = singleflight.claim_generation('Python basics', 'en', self.users[0].id)
+        self.assertTrue(started)
+
+        # Same normalized topic: joins; other language: a separate generation
+        self.assertEqual(singleflight.claim_generation('the basics of PYTHON!', 'en', self.users[1].id), (task_id, False))
+        self.assertEqual(singleflight.claim_generation('Python basics', 'en', self.users[1].id), (task_id, False))
+        self.assertTrue(singleflight.claim_generation('Python basics', 'ru', self.users[2].id)[1])
+        self.assertEqual(singleflight.get_waiters(task_id), [self.users[1].id])
+
+        singleflight.release_generation('Python basics', 'en', task_id)
+        self.assertTrue(singleflight.claim_generation('Python basics', 'en', self.users[2].id)[1])
+
+    def test_release_keeps_a_newer_claim(self):
+        task_id, _ = singleflight.claim_generation('Python basics', 'en')
+        singleflight.release_generation('Python basics', 'en', 'older-task')
+        self.assertEqual(singleflight.claim_generation('Python basics', 'en')[0], task_id)
+
+    def test_waiters_are_enrolled(self):
+        task_id, _ = singleflight.claim_generation('Python basics', 'en', self.users[0].id)
+        singleflight.claim_generation('Python basics', 'en', self.users[1].id)
+        self.assertEqual(singleflight.enroll_waiters(task_id, self.course), [self.users[1].id])
+
+        # A user who joins after the task enrolled everyone is enrolled on their next status check
+        singleflight.claim_generation('Python basics', 'en', self.users[2].id)
+        self.assertFalse(singleflight.enroll_waiter(task_id, self.users[0].id, self.course.id))
+        self.assertTrue(singleflight.enroll_waiter(task_id, self.users[2].id, self.course.id))
+        self.assertEqual(
+            set(UserCourse.objects.filter(course=self.course).values_list('user_id', flat=True)),
+            {self.users[1].id, self.users[2].id}
+        )
+
+
+class StreakMiddlewareTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='learner', password='secret')
+        self.middleware = StreakMiddleware(lambda request: HttpResponse())
+        self.session = SessionStore()
+
+    def request(self, path='/dashboard/', **headers):
+        request = RequestFactory().get(path, **headers)
+        request.user = self.user
+        request.session = self.session
+        return self.middleware(request)
+
+    def test_streak_is_written_once_per_day(self):
+        UserStreak.objects.create(user=self.user, current_streak=3, max_streak=3,
+                                  last_activity=timezone.now().date() - timedelta(days=1))
+        with self.assertNumQueries(1):
+            self.request()
+        with self.assertNumQueries(0):
+            self.request()
+            self.request('/task-status/abc/')
+            self.request('/lesson/1/chatbot/', HTTP_HX_REQUEST='true')
+
+        streak = UserStreak.objects.get(user=self.user)
+        self.assertEqual((streak.current_streak, streak.max_streak), (4, 4))
+
+    def test_missed_day_restarts_the_streak(self):
+        UserStreak.objects.create(user=self.user, current_streak=5, max_streak=7,
+                                  last_activity=timezone.now().date() - timedelta(days=3))
+        self.assertTrue(UserStreak.record_activity(self.user))
+        self.assertFalse(UserStreak.record_activity(self.user))
+
+        streak = UserStreak.objects.get(user=self.user)
+        self.assertEqual((streak.current_streak, streak.max_streak, streak.last_activity), (1, 7, timezone.now().date()))
+
+    def test_skipped_requests_do_not_count(self):
+        self.request('/task-status/abc/')
+        self.request('/lesson/1/chatbot/', HTTP_HX_REQUEST='true')
+        self.assertFalse(UserStreak.objects.filter(user=self.user).exists())
+        self.request()
+        self.assertTrue(UserStreak.objects.filter(user=self.user).exists())
+
+
+class UserXPTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='learner', password='secret')
+        course = Course.objects.create(title='Course', description='Description')
+        module = Module.objects.create(course=course, title='Module', order=1)
+        self.lessons = [
+            Lesson.objects.create(module=module, title=f'Lesson {order}', content='Content', order=order)
+            for order in (1, 2)
+        ]
+
+    def test_attempts_add_up_per_lesson_and_in_total(self):
+        record_quiz_attempt(self.user, self.lessons[0], 10)
+        record_quiz_attempt(self.user, self.lessons[0], -5)
+        record_quiz_attempt(self.user, self.lessons[1], 10)
+
+        self.assertEqual(UserProgress.objects.get(user=self.user, lesson=self.lessons[0]).score, 5)
+        self.assertEqual(UserProgress.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(self.user.total_xp, 15)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_xp, 15)
+
+    def test_stale_user_instances_do_not_lose_increments(self):
+        other_copy = CustomUser.objects.get(pk=self.user.pk)
+        record_quiz_attempt(self.user, self.lessons[0], 10)
+        record_quiz_attempt(other_copy, self.lessons[1], 10)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_xp, 20)
+
+    def test_rebuild_user_xp_check_then_reconcile(self):
+        record_quiz_attempt(self.user, self.lessons[0], 10)
+        CustomUser.objects.filter(pk=self.user.pk).update(total_xp=99)
+
+        out = StringIO()
+        call_command('rebuild_user_xp', '--check', stdout=out)
+        self.assertIn('stored 99, expected 10', out.getvalue())
+        self.assertIn('1 users out of sync', out.getvalue())
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).total_xp, 99)
+
+        call_command('rebuild_user_xp', stdout=StringIO())
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).total_xp, 10)
+        out = StringIO()
+        call_command('rebuild_user_xp', '--check', stdout=out)
+        self.assertIn('0 users out of sync', out.getvalue())
+
+
+class LeaderboardPagingTests(TestCase):
+    def setUp(self):
+        # 30, 20, 20, 20, 10 XP: three users tie for rank 2
+        for n, xp in enumerate([30, 20, 20, 20, 10]):
+            CustomUser.objects.create_user(username=f'user{n}', password='secret', total_xp=xp)
+
+    def collect_pages(self, limit):
+        pages, cursor = [], None
+        while True:
+            users, cursor = get_leaderboard_page(cursor, limit=limit)
+            pages.append([(user.username, user.rank) for user in users])
+            if cursor is None:
+                return pages
+
+    def test_cursor_pages_through_ties_without_gaps_or_repeats(self):
+        full = [entry for page in self.collect_pages(limit=100) for entry in page]
+        self.assertEqual([rank for _, rank in full], [1, 2, 2, 2, 5])
+
+        # Pages of two split the tied users, ranks stay global
+        pages = self.collect_pages(limit=2)
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual([entry for page in pages for entry in page], full)
+
+    def test_malformed_cursor_returns_the_first_page(self):
+        first_page, _ = get_leaderboard_page(limit=2)
+        for cursor in ['garbage', '2', '2:x', '1:2:3', '']:
+            with self.subTest(cursor=cursor):
+                users, _ = get_leaderboard_page(cursor, limit=2)
+                self.assertEqual(users, first_page)
+
+
+class RankingTests(TestCase):
+    def setUp(self):
+        ranking._ranking = None
+        self.addCleanup(setattr, ranking, '_ranking', None)
+        # 30, 20, 20, 10 XP and one user without XP
+        self.users = [
+            CustomUser.objects.create_user(username=f'user{n}', password='secret', total_xp=xp)
+            for n, xp in enumerate([30, 20, 20, 10, 0])
+        ]
+        self.keys = [ranking.member_key(user.id) for user in self.users]
+
+    def memory_ranking(self):
+        sorted_set = ranking.SortedSetRanking()
+        ranking.rebuild_from_db(sorted_set)
+        return sorted_set
+
+    def test_backends_agree_on_counts_ranks_and_tie_order(self):
+        # Ties come back in descending user id order, like the database
+        expected_order = [self.keys[0], self.keys[2], self.keys[1], self.keys[3]]
+        for backend in (self.memory_ranking(), ranking.DatabaseRanking()):
+            with self.subTest(backend=type(backend).__name__):
+                self.assertEqual(backend.zcard(), 4)
+                self.assertEqual(backend.zcount('(20', '+inf'), 1)
+                self.assertEqual(backend.zcount(20, '+inf'), 3)
+                self.assertEqual(backend.zcount('(10', 20), 2)
+                self.assertEqual(backend.zrevrange(0, -1), expected_order)
+                self.assertEqual(backend.zrevrange(1, 2, withscores=True), [(self.keys[2], 20), (self.keys[1], 20)])
+                self.assertEqual(backend.zrevrange(-2, -1), expected_order[2:])
+                self.assertEqual([backend.zrevrank(key) for key in expected_order], [0, 1, 2, 3])
+                self.assertIsNone(backend.zrevrank(self.keys[4]))
+
+    def test_sorted_set_updates(self):
+        sorted_set = self.memory_ranking()
+        self.assertEqual(sorted_set.zincrby(15, self.keys[3]), 25)
+        self.assertEqual(sorted_set.zrevrank(self.keys[3]), 1)
+        sorted_set.zrem(self.keys[0])
+        self.assertEqual(sorted_set.zrevrange(0, 0), [self.keys[3]])
+        self.assertEqual(sorted_set.zcount('-inf', '+inf'), 3)
+
+    def test_memory_backend_resyncs_and_drift_is_detected(self):
+        with override_settings(LEADERBOARD_BACKEND='memory', LEADERBOARD_RANKING_RESYNC=300):
+            memory = ranking.get_ranking()
+            self.assertFalse(memory.is_stale())
+            # Another process changed XP: this one doesn't see it until the resync
+            CustomUser.objects.filter(pk=self.users[3].pk).update(total_xp=50)
+            self.assertEqual(ranking.check_consistency(memory), [(self.users[3].id, 10, 50)])
+
+            memory.loaded_at -= 301
+            self.assertTrue(memory.is_stale())
+            self.assertIs(ranking.get_ranking(), memory)
+            self.assertEqual(ranking.check_consistency(memory), [])
+            self.assertEqual(memory.zrevrank(self.keys[3]), 0)
+
+    def test_ranks_from_the_database_backend(self):
+        self.assertEqual([get_user_rank(user) for user in self.users], [1, 2, 2, 4, None])
+        around = get_users_around(self.users[3], radius=1)
+        self.assertEqual([(entry['username'], entry['rank']) for entry in around], [('user1', 2), ('user3', 4)])
+        self.assertEqual(get_users_around(self.users[4]), [])
+
+
+class MarkdownSanitizerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_raw_html_is_escaped(self):
+        html = render_markdown('<script>alert(1)</script>\n\nText with <b onclick="steal()">bold</b>')
+
+        self.assertNotIn('<script', html)
+        self.assertNotIn('<b onclick', html)
+        self.assertIn('&lt;script&gt;', html)
+        self.assertIn('&lt;b onclick=', html)
+
+    def test_scripting_urls_are_stripped(self):
+        html = render_markdown(
+            '[click](javascript:alert(1)) [case](JavaScript:alert(1)) '
+            '![pixel](data:image/png;base64,AAAA) [site](https://example.com) [next](/lesson/2/) '
+            '[entity](javascript&#58;alert(1)) [named](javascript&colon;alert(1)) [tab](java\tscript:alert(1)) '
+            '[hex](&#x6A;avascript:alert(1))'
+        )
+
+        self.assertNotIn('javascript', html.lower())
+        self.assertNotIn('script:', html)
+        self.assertNotIn('data:', html)
+        self.assertEqual(html.count('href='), 2)
+        self.assertIn('href="https://example.com"', html)
+        self.assertIn('href="/lesson/2/"', html)
+
+    def test_admin_edit_drops_the_cached_html(self):
+        course = Course.objects.create(title='Course', description='Description')
+        module = Module.objects.create(course=course, title='Module', order=1)
+        lesson = Lesson.objects.create(module=module, title='Lesson', content='# Old', order=1)
+        self.assertIn('Old', get_lesson_html(lesson))
+        old_key = content_cache_key('# Old')
+        self.assertIsNotNone(cache.get(old_key))
+
+        lesson.content = '# New'
+        form = SimpleNamespace(changed_data=['content'], initial={'content': '# Old'})
+        admin.site._registry[Lesson].save_model(RequestFactory().post('/admin/'), lesson, form, change=True)
+
+        self.assertIsNone(cache.get(old_key))
+        self.assertIn('New', get_lesson_html(Lesson.objects.get(pk=lesson.pk)))
+
+
+class SaveCourseTreeTests(TestCase):
+    def course_tree(self, course):
+        """Everything saved for a course, ordered by insertion, with foreign keys checked"""
+        tree = []
+        for module in Module.objects.filter(course=course).order_by('id'):
+            lessons = []
+            for lesson in Lesson.objects.filter(module=module).order_by('id'):
+                self.assertEqual(lesson.module.course_id, course.id)
+                quizzes = [
+                    (quiz.question, quiz.options, quiz.correct_answer)
+                    for quiz in Quiz.objects.filter(lesson=lesson).order_by('id')
+                ]
+                lessons.append((lesson.title, lesson.content, lesson.order, quizzes))
+            tree.append((module.title, module.order, lessons))
+        return tree
+
+    def test_bulk_insert_saves_the_same_tree_as_per_row_inserts(self):
+        course_data = build_course_data(3, 4, 3)
+        for module_data in course_data['modules']:
+            for order, lesson_data in enumerate(module_data['lessons'], start=1):
+                lesson_data['order'] = order
+        per_row = save_course_per_row(course_data)
+        bulk = save_course_tree(course_data, prepare=False)
+
+        self.assertEqual((bulk.title, bulk.description, bulk.language), (per_row.title, per_row.description, 'en'))
+        self.assertEqual(self.course_tree(bulk), self.course_tree(per_row))
+        tree = self.course_tree(bulk)
+        self.assertEqual([module[1] for module in tree], [1, 2, 3])
+        self.assertEqual([lesson[2] for lesson in tree[0][2]], [1, 2, 3, 4])
+        # correct_answer is stored as the option text, not the index
+        self.assertEqual(tree[0][2][0][3][1], ('Question 1?', ['Option A', 'Option B', 'Option C', 'Option D'], 'Option B'))
+
+
+class GeminiAsyncClientTests(TestCase):
+    def make_backend(self, client_module):
+        original = ai_client.genai_client
+        ai_client.genai_client = client_module
+        self.addCleanup(setattr, ai_client, 'genai_client', original)
+        backend = ai_client.GeminiBackend()
+        backend.generate = lambda prompt, json_mode=False, timeout=None: f'sync: {prompt}'
+        backend.stream = lambda prompt, timeout=None: iter(['sync ', prompt])
+        return backend
+
+    async def collect(self, stream):
+        return [text async for text in stream]
+
+    def test_falls_back_to_threads_without_sdk_internals(self):
+        backend = self.make_backend(SimpleNamespace())
+
+        self.assertEqual(asyncio.run(backend.agenerate('hi')), 'sync: hi')
+        self.assertEqual(asyncio.run(self.collect(backend.astream('hi'))), ['sync ', 'hi'])
+        self.assertFalse(backend._use_async_client)
+
+    def test_uses_threads_once_event_loops_are_per_request(self):
+        manager = SimpleNamespace(make_client=lambda name: object())
+        backend = self.make_backend(SimpleNamespace(_client_manager=manager))
+
+        async def get_model():
+            return backend._async_model()
+
+        self.assertIsNotNone(asyncio.run(get_model()))
+        # A second loop, as with async views under WSGI
+        self.assertIsNone(asyncio.run(get_model()))
+        self.assertEqual(asyncio.run(backend.agenerate('hi')), 'sync: hi')
+
+
+class FirstModuleFailsBackend(ai_client.FakeBackend):
+    """Rejects the first module for good"""
+
+    def __init__(self):
+        self.prompts = []
+
+    def generate(self, prompt, json_mode=False, timeout=None):
+        self.prompts.append(prompt)
+        if 'Write module 1' in prompt:
+            raise api_exceptions.PermissionDenied('API key not valid')
+        return super().generate(prompt, json_mode, timeout)
+
+
+@override_settings(AI_FAKE_LATENCY=0, COURSE_GENERATION_WORKERS=1)
+class StagedGenerationFailureTests(TestCase):
+    def setUp(self):
+        ai_client._backend = None
+        self.addCleanup(setattr, ai_client, '_backend', None)
+
+    @override_settings(AI_BACKEND='core.tests.FirstModuleFailsBackend')
+    def test_failed_module_cancels_the_others(self):
+        with self.assertRaises(api_exceptions.PermissionDenied):
+            generate_course_staged('Python basics')
+
+        prompts = ai_client.get_backend().prompts
+        self.assertEqual(len(prompts), 2)  # outline, module 1
+        self.assertFalse(any('Write module 2' in prompt for prompt in prompts))
+
+    @override_settings(AI_BACKEND='core.tests.FirstModuleFailsBackend')
+    def test_progressive_failure_cancels_the_others(self):
+        user = CustomUser.objects.create_user(username='cancelled', password='pass')
+
+        with self.assertRaises(api_exceptions.PermissionDenied):
+            generate_course_progressively('Python basics', 'en', user)
+
+        self.assertEqual(len(ai_client.get_backend().prompts), 2)
+        self.assertFalse(Course.objects.exists())
+
+    @override_settings(AI_BACKEND='core.tests.FlakyModuleBackend')
+    def test_prompts_keep_the_localized_final_exam_and_language_rules(self):
+        generate_course_staged('Python asoslari', 'uz')
+        outline_prompt, *module_prompts = ai_client.get_backend().prompts
+
+        self.assertIn('"Yakuniy imtihon"', outline_prompt)
+        self.assertIn('"Yakuniy sinov"', outline_prompt)
+        self.assertNotIn('Final Exam', outline_prompt)
+        for prompt in module_prompts:
+            self.assertIn("Rus yoki boshqa tillarni aralashtirmang.", prompt)
+
+
+class PrepareCourseTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.course = Course.objects.create(title='Python', description='Basics')
+        module = Module.objects.create(course=self.course, title='Module', order=1)
+        self.lesson = Lesson.objects.create(module=module, title='Lists', content='# Lists', order=1)
+
+    def test_renders_lessons_into_the_cache(self):
+        self.assertTrue(prepare_course(self.course))
+
+        self.assertIsNotNone(cache.get(content_cache_key('# Lists')))
+        self.assertEqual(Lesson.objects.get(id=self.lesson.id).position, 1)
+
+    @override_settings(USE_CELERY=True)
+    def test_celery_worker_with_a_local_cache_only_indexes_lessons(self):
+        # The worker's local memory cache is never read by the web processes
+        self.assertTrue(prepare_course(self.course))
+
+        self.assertIsNone(cache.get(content_cache_key('# Lists')))
+        self.assertEqual(Lesson.objects.get(id=self.lesson.id).position, 1)
+        self.assertIsNotNone(Course.objects.get(id=self.course.id).prepared_at)
@@ -0,0 +1,96 @@
+"""
+Topic index for generated courses.
+
+Every course stores a canonical form of the topic it was generated for
+(Course.topic_key), so that asking for "Python basics" again in the same
+language finds the existing course instead of spending another 10-30 s
+on Gemini. Keys are case- and punctuation-insensitive, ignore filler
+words and word order ("The basics of Python" and "python basics" share
+"basics python").
+
+Close but not identical topics are matched with trigram similarity in the
+style of PostgreSQL's pg_trgm, computed in Python since SQLite has no
+trigram index. Candidates are narrowed in the database to courses in the
+same language sharing at least one topic word. A close match must still
+agree on every significant token: "Python 3.10" is not "Python 3.11",
+however many trigrams they share.
+"""
+
+import re
+import unicodedata
+from django.conf import settings
+from django.db.models import Q
+
+FILLER_WORDS = {
+    'a', 'an', 'the', 'and', 'of', 'for', 'in', 'on', 'to', 'with', 'about',
+    'course', 'learn', 'introduction', 'intro', 'i', 'want', 'how',
+}
+
+MAX_CANDIDATES = 50
+
+# Numbers and versions, "C++"/"C#" style names and operators
+SIGNIFICANT_TOKEN = re.compile(r'\w*\d\w*|\w+(?:\+\+|#)|[-+*/%=<>!&|^~]+')
+
+
+def normalize_topic(topic):
+    """Canonical topic key: lowercase words without punctuation, fillers or order"""
+    topic = unicodedata.normalize('NFKC', topic or '').casefold()
+    words = re.sub(r'[^\w\s]', ' ', topic).split()
+    meaningful = sorted({word for word in words if word not in FILLER_WORDS})
+    # A topic made only of filler words still needs a key
+    return ' '.join(meaningful or sorted(set(words)))[:200]
+
+
+def trigrams(text):
+    grams = set()
+    for word in text.split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def significant_tokens(text):
+    """Tokens two texts must share to be treated as the same, see SIGNIFICANT_TOKEN"""
+    return sorted(SIGNIFICANT_TOKEN.findall(unicodedata.normalize('NFKC', text or '').casefold()))
+
+
+def trigram_similarity(a, b):
+    """Shared trigrams over all trigrams of both strings, like pg_trgm's similarity()"""
+    a, b = trigrams(a), trigrams(b)
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def find_course_for_topic(topic, language):
+    """
+    The existing course in `language` whose topic matches `topic` exactly or
+    with at least COURSE_REUSE_SIMILARITY trigram similarity and the same
+    significant tokens, or None.
+    """
+    from .models import Course
+
+    key = normalize_topic(topic)
+    if not key:
+        return None
+    courses = Course.objects.filter(language=language)
+
+    exact = courses.filter(topic_key=key).order_by('-created_at').first()
+    if exact or settings.COURSE_REUSE_SIMILARITY >= 1:
+        return exact
+
+    shares_a_word = Q()
+    for word in key.split():
+        shares_a_word |= Q(topic_key__contains=word)
+    candidates = courses.filter(shares_a_word).order_by('-created_at').values_list('id', 'topic_key')
+
+    required = significant_tokens(key)
+    best_id, best_score = None, 0.0
+    for course_id, candidate_key in candidates[:MAX_CANDIDATES]:
+        if significant_tokens(candidate_key) != required:
+            continue
+        score = trigram_similarity(key, candidate_key)
+        # Ties go to the newest course
+        if score >= settings.COURSE_REUSE_SIMILARITY and score > best_score:
+            best_id, best_score = course_id, score
+    return courses.get(id=best_id) if best_id else None
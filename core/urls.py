@@ -8,6 +8,7 @@ urlpatterns = [
     path('logout/', views.LogoutView.as_view(), name='logout'),
     path('chatbot/', views.ChatbotView.as_view(), name='chatbot'),
     path('send-message/', views.send_message, name='send_message'),
+    path('send-message/stream/', views.send_message_stream, name='send_message_stream'),
     path('generate-course/', views.generate_course_view, name='generate_course'),
     path('dashboard/', views.DashboardView.as_view(), name='dashboard'),
     path('course/<int:pk>/', views.CourseDetailView.as_view(), name='course_detail'),
@@ -1,27 +1,44 @@
-from django.shortcuts import render, get_object_or_404, redirect
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
 from django.views.generic import ListView, DetailView, TemplateView
 from django.views import View
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.utils.decorators import method_decorator
 from django.views.decorators.http import require_POST
-from django.db.models import Sum
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.utils import translation
-from .models import Course, Lesson, UserProgress, Quiz, ChatMessage, UserCourse, CustomUser
-from .services import generate_course_from_ai, chatbot_response
+from asgiref.sync import sync_to_async
+from .models import Course, Module, Lesson, UserProgress, Quiz, ChatMessage, ChatSummary, UserCourse, CustomUser
+from .services import (
+    agenerate_course_from_ai, reuse_existing_course, achatbot_response, achatbot_response_stream, save_chatbot_reply, TopicMarkerFilter,
+    record_quiz_attempt, get_adjacent_lessons, get_course_tree
+)
 from .forms import CustomUserCreationForm, CustomAuthenticationForm
 from .certificate import generate_certificate
+from .rendering import get_lesson_html, get_message_html
+from .chat_cache import get_cached_answer, cache_answer
+from .chat_context import aget_chat_context, schedule_chat_summary
+from .task_status import wait_for_status_change
+from .ratelimit import acheck_rate_limit, acheck_generation_backlog
+from .singleflight import claim_generation, release_generation, enroll_waiter
+from . import ai_client
+from .leaderboard import get_leaderboard_page, get_user_rank, get_users_around, get_snapshot
 import json
-import re
 from django.views.generic import TemplateView
 from django.contrib.auth import get_user_model
 from .models import UserStreak
 User = get_user_model()
-# Helper to get user XP
+# Helper to get user XP (denormalized, see `manage.py rebuild_user_xp`)
 def get_user_xp(user):
-    return UserProgress.objects.filter(user=user).aggregate(Sum('score'))['score__sum'] or 0
+    return user.total_xp
+
+# Helper to count rows of `queryset` per outer object, for use in annotate()
+def count_subquery(queryset, group_by):
+    counts = queryset.order_by().values(group_by).annotate(count=Count('pk')).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
 
 # Helper to check if course is completed
 def is_course_completed(user, course):
@@ -89,53 +106,148 @@ class ChatbotView(LoginRequiredMixin, TemplateView):
     template_name = 'chatbot.html'
 
     def get_context_data(self, **kwargs):
+        from django.conf import settings
+
         context = super().get_context_data(**kwargs)
         context['chat_messages'] = ChatMessage.objects.filter(user=self.request.user)
+        # With Celery replies come from a worker instead of a stream
+        context['use_celery'] = getattr(settings, 'USE_CELERY', False)
         context['user_xp'] = get_user_xp(self.request.user)
         return context
 
 @login_required
 @require_POST
-def send_message(request):
-    """Handle chatbot message sending"""
+async def send_message(request):
+    """
+    Handle chatbot message sending
+
+    With Celery the reply is generated by chatbot_response_task and the
+    response carries its task_id instead; if the broker can't be reached
+    the reply is generated here.
+    """
+    from django.conf import settings
+
     user_message = request.POST.get('message', '').strip()
 
     if not user_message:
         return JsonResponse({'error': 'Message cannot be empty'}, status=400)
 
+    user = await request.auser()
+
+    throttle = await acheck_rate_limit('chat', user.id)
+    if throttle:
+        return throttled_response(throttle)
+
     # Save user message
-    ChatMessage.objects.create(user=request.user, message=user_message, is_user=True)
+    saved = await ChatMessage.objects.acreate(user=user, message=user_message, is_user=True)
+
+    if getattr(settings, 'USE_CELERY', False):
+        # Leave the model call to a worker; the reply is delivered through
+        # /task-status/<id>/ like course generation
+        try:
+            from .tasks import chatbot_response_task
+            task = await sync_to_async(chatbot_response_task.delay)(
+                user.id, user_message, user.preferred_language, message_id=saved.id
+            )
+            return JsonResponse({
+                'success': True,
+                'task_id': task.id,
+                'status_url': f'/task-status/{task.id}/'
+            })
+        except Exception as e:
+            print(f"Could not queue chatbot response, answering inline: {e}")
 
-    # Get chat history
-    chat_history = ChatMessage.objects.filter(user=request.user).order_by('created_at')
+    # Recent messages and the summary of older ones (see core.chat_context)
+    context = await aget_chat_context(user, before_id=saved.id)
 
     # Get bot response
-    bot_reply = chatbot_response(user_message, chat_history, request.user.preferred_language)
-
-    # Check if topic is clear
-    topic_clear = False
-    topic = None
-    if 'TOPIC_CLEAR:' in bot_reply:
-        topic_clear = True
-        # Extract topic
-        match = re.search(r'TOPIC_CLEAR:\s*(.+)', bot_reply)
-        if match:
-            topic = match.group(1).strip()
-            # Remove the TOPIC_CLEAR marker from the message
-            bot_reply = re.sub(r'TOPIC_CLEAR:.+', '', bot_reply).strip()
-
-    # Save bot message
-    ChatMessage.objects.create(user=request.user, message=bot_reply, is_user=False)
-
-    return JsonResponse({
-        'bot_message': bot_reply,
-        'topic_clear': topic_clear,
-        'topic': topic
-    })
+    bot_reply = await achatbot_response(user_message, context, user.preferred_language)
+
+    # Save it without the TOPIC_CLEAR marker
+    return JsonResponse(await sync_to_async(save_chatbot_reply)(user.id, bot_reply, context))
+
+def throttled_response(throttle):
+    """429 (rate limited) or 503 (generation backlog) JSON with a Retry-After header"""
+    response = JsonResponse(throttle.to_dict(), status=503 if throttle.reason == 'backlog' else 429)
+    response['Retry-After'] = str(throttle.to_dict()['retry_after'])
+    return response
+
+def sse_event(data, event=None):
+    """Format one Server-Sent Event with a JSON payload"""
+    message = f'data: {json.dumps(data)}\n\n'
+    if event:
+        message = f'event: {event}\n{message}'
+    return message
 
 @login_required
 @require_POST
-def generate_course_view(request):
+async def send_message_stream(request):
+    """
+    Streaming variant of send_message.
+
+    Relays the reply as Server-Sent Events while the model is still
+    generating it: "data" events carry {"delta": text}, and a final "done"
+    event carries the same fields send_message returns. The stream is an
+    async generator, so under ASGI it doesn't hold a thread per chunk. The
+    bot message is saved once the stream has ended, or with the text sent
+    so far if the client disconnects first.
+    """
+    user_message = request.POST.get('message', '').strip()
+
+    if not user_message:
+        return JsonResponse({'error': 'Message cannot be empty'}, status=400)
+
+    user = await request.auser()
+
+    throttle = await acheck_rate_limit('chat', user.id)
+    if throttle:
+        return throttled_response(throttle)
+
+    saved = await ChatMessage.objects.acreate(user=user, message=user_message, is_user=True)
+    context = await aget_chat_context(user, before_id=saved.id)
+
+    async def events():
+        # Send something immediately so headers and the first byte go out before the model answers
+        yield ': stream open\n\n'
+
+        marker_filter = TopicMarkerFilter()
+        parts = []
+        reply_saved = False
+        try:
+            async for chunk in achatbot_response_stream(user_message, context, user.preferred_language):
+                visible = marker_filter.feed(chunk)
+                if visible:
+                    parts.append(visible)
+                    yield sse_event({'delta': visible})
+            visible = marker_filter.finish()
+            if visible:
+                parts.append(visible)
+                yield sse_event({'delta': visible})
+
+            bot_reply = ''.join(parts).strip()
+            await ChatMessage.objects.acreate(user=user, message=bot_reply, is_user=False)
+            reply_saved = True
+            yield sse_event({
+                'bot_message': bot_reply,
+                'topic_clear': marker_filter.topic_clear,
+                'topic': marker_filter.topic
+            }, event='done')
+        finally:
+            if not reply_saved and parts:
+                # The client went away mid-stream: keep what it was shown
+                await ChatMessage.objects.acreate(user=user, message=''.join(parts).strip(), is_user=False)
+        # After the client has the reply
+        await sync_to_async(schedule_chat_summary)(user.id, context)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@login_required
+@require_POST
+async def generate_course_view(request):
     """Handle course generation - async with Celery or sync without"""
     from django.conf import settings
     
@@ -144,16 +256,57 @@ def generate_course_view(request):
     if not topic:
         return JsonResponse({'error': 'Topic cannot be empty'}, status=400)
 
+    user = await request.auser()
+
     try:
+        # A course on this topic may already exist: enroll instead of generating
+        course = await sync_to_async(reuse_existing_course)(topic, user.preferred_language, user)
+        if course:
+            return JsonResponse({
+                'success': True,
+                'course_id': course.id,
+                'title': course.title,
+                'reused': True,
+                'message': f'You have been enrolled in the existing course "{course.title}".',
+                'redirect_url': '/dashboard/',
+                'sync': True
+            })
+
+        use_celery = getattr(settings, 'USE_CELERY', False)
+        if use_celery:
+            from .tasks import generate_course_task
+            # The same course may already be in flight: join its task (see core.singleflight)
+            task_id, started = await sync_to_async(claim_generation)(topic, user.preferred_language, user.id)
+            if not started:
+                return JsonResponse({
+                    'success': True,
+                    'task_id': task_id,
+                    'joined': True,
+                    'message': 'This course is already being generated. You will be enrolled when it is ready.',
+                    'status_url': f'/task-status/{task_id}/'
+                })
+
+        # Don't queue more work while the heavy queue is backed up (see core.ratelimit)
+        throttle = await acheck_generation_backlog()
+        if throttle is None:
+            throttle = await acheck_rate_limit('course_generation', user.id)
+        if throttle:
+            if use_celery:
+                await sync_to_async(release_generation)(topic, user.preferred_language, task_id)
+            return throttled_response(throttle)
+
         # Check if Celery is enabled
-        if getattr(settings, 'USE_CELERY', False):
+        if use_celery:
             # Async mode with Celery
-            from .tasks import generate_course_task
-            task = generate_course_task.delay(
-                topic=topic,
-                language=request.user.preferred_language,
-                user_id=request.user.id
-            )
+            try:
+                # apply_async() talks to the broker synchronously
+                task = await sync_to_async(generate_course_task.apply_async)(
+                    kwargs={'topic': topic, 'language': user.preferred_language, 'user_id': user.id},
+                    task_id=task_id
+                )
+            except Exception:
+                await sync_to_async(release_generation)(topic, user.preferred_language, task_id)
+                raise
             return JsonResponse({
                 'success': True,
                 'task_id': task.id,
@@ -161,9 +314,8 @@ def generate_course_view(request):
                 'status_url': f'/task-status/{task.id}/'
             })
         else:
-            # Sync mode without Celery (for PythonAnywhere)
-            from .services import generate_course_from_ai
-            course = generate_course_from_ai(topic, request.user.preferred_language, request.user)
+            # Without Celery (for PythonAnywhere): generate in the request, without blocking the worker under ASGI
+            course = await agenerate_course_from_ai(topic, user.preferred_language, user)
             return JsonResponse({
                 'success': True,
                 'course_id': course.id,
@@ -184,8 +336,20 @@ class DashboardView(LoginRequiredMixin, ListView):
     context_object_name = 'courses'
 
     def get_queryset(self):
-        # Only show courses the user is enrolled in
-        return Course.objects.filter(enrolled_users__user=self.request.user)
+        # Only show courses the user is enrolled in, with module/lesson
+        # counts and the user's completed lessons attached in the same query
+        return Course.objects.filter(enrolled_users__user=self.request.user).annotate(
+            module_count=count_subquery(Module.objects.filter(course=OuterRef('pk')), 'course'),
+            total_lessons=count_subquery(Lesson.objects.filter(module__course=OuterRef('pk')), 'module__course'),
+            completed_lessons=count_subquery(
+                UserProgress.objects.filter(
+                    user=self.request.user,
+                    lesson__module__course=OuterRef('pk'),
+                    is_completed=True
+                ),
+                'lesson__module__course'
+            ),
+        )
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -196,15 +360,8 @@ class DashboardView(LoginRequiredMixin, ListView):
 
         # Calculate progress for each course
         for course in context['courses']:
-            total_lessons = Lesson.objects.filter(module__course=course).count()
-            completed_lessons = UserProgress.objects.filter(
-                user=self.request.user,
-                lesson__module__course=course,
-                is_completed=True
-            ).count()
-
-            if total_lessons > 0:
-                course.progress = int((completed_lessons / total_lessons) * 100)
+            if course.total_lessons > 0:
+                course.progress = int((course.completed_lessons / course.total_lessons) * 100)
             else:
                 course.progress = 0
 
@@ -217,13 +374,21 @@ class CourseDetailView(LoginRequiredMixin, DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # Fetch completed lesson IDs
-        completed_ids = UserProgress.objects.filter(
-            user=self.request.user, is_completed=True
-        ).values_list('lesson_id', flat=True)
-        context['completed_lesson_ids'] = set(completed_ids)
+        # Module -> lesson outline from the cache, without Lesson.content
+        course_tree = get_course_tree(self.object.id, self.object.is_generating)
+        # Fetch completed lesson IDs for this course only
+        completed_ids = set(UserProgress.objects.filter(
+            user=self.request.user, lesson__module__course=self.object, is_completed=True
+        ).values_list('lesson_id', flat=True))
+        lesson_ids = [lesson['id'] for module in course_tree for lesson in module['lessons']]
+        context['course_tree'] = course_tree
+        context['completed_lesson_ids'] = completed_ids
         context['user_xp'] = get_user_xp(self.request.user)
-        context['is_completed'] = is_course_completed(self.request.user, self.object)
+        context['is_completed'] = bool(lesson_ids) and completed_ids.issuperset(lesson_ids)
+        # Continue where the user left off: first lesson in sequence not completed yet
+        context['resume_lesson_id'] = next(
+            (lesson_id for lesson_id in lesson_ids if lesson_id not in completed_ids), None
+        )
         return context
 
 class LessonView(LoginRequiredMixin, DetailView):
@@ -231,44 +396,27 @@ class LessonView(LoginRequiredMixin, DetailView):
     template_name = 'lesson.html'
     context_object_name = 'lesson'
 
+    def get_queryset(self):
+        return Lesson.objects.select_related('module__course')
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['user_xp'] = get_user_xp(self.request.user)
+        context['lesson_html'] = get_lesson_html(self.object)
         # Check if already completed
         context['is_completed'] = UserProgress.objects.filter(
             user=self.request.user, lesson=self.object, is_completed=True
         ).exists()
 
-        # Get current module and all lessons in order
-        current_module = self.object.module
-        all_lessons = current_module.lessons.order_by('order')
-
-        # Find next and previous lessons
-        current_index = None
-        for idx, lesson in enumerate(all_lessons):
-            if lesson.id == self.object.id:
-                current_index = idx
-                break
-
-        if current_index is not None:
-            # Get previous lesson
-            if current_index > 0:
-                context['previous_lesson'] = all_lessons[current_index - 1]
-            else:
-                context['previous_lesson'] = None
-
-            # Get next lesson
-            if current_index < len(all_lessons) - 1:
-                context['next_lesson'] = all_lessons[current_index + 1]
-            else:
-                context['next_lesson'] = None
+        # Previous and next lessons from the course-wide sequence
+        context['previous_lesson'], context['next_lesson'] = get_adjacent_lessons(self.object)
 
         return context
 
 @login_required
 @require_POST
 def submit_quiz(request, lesson_id):
-    lesson = get_object_or_404(Lesson, id=lesson_id)
+    lesson = get_object_or_404(Lesson.objects.select_related('module'), id=lesson_id)
     quiz_id = request.POST.get('quiz_id')
     selected_option = request.POST.get('option')
 
@@ -285,30 +433,18 @@ def submit_quiz(request, lesson_id):
 
     is_correct = selected_option == quiz.correct_answer
 
-    # Update progress
-    progress, created = UserProgress.objects.get_or_create(
-        user=request.user, lesson=lesson
-    )
-
-    # Mark as completed regardless of outcome (as per user request)
-    if not progress.is_completed:
-        progress.is_completed = True
-        progress.save()
+    # Update progress: marked as completed regardless of outcome (as per user request),
+    # 10 XP per correct answer, -5 XP for an incorrect one
+    record_quiz_attempt(request.user, lesson, 10 if is_correct else -5)
 
     if is_correct:
-        progress.score += 10 # 10 XP per correct answer
-        progress.save()
-
         return render(request, 'partials/quiz_result.html', {
             'success': True,
             'lesson': lesson,
             'quiz': quiz,
-            'next_lesson': Lesson.objects.filter(module=lesson.module, order__gt=lesson.order).first() or
-                           Lesson.objects.filter(module__course=lesson.module.course, module__order__gt=lesson.module.order).first()
+            'next_lesson': get_adjacent_lessons(lesson)[1]
         })
     else:
-        progress.score -= 5 # Deduct 5 XP for incorrect answer
-        progress.save()
         return render(request, 'partials/quiz_result.html', {
             'success': False,
             'correct_answer': quiz.correct_answer,
@@ -321,26 +457,29 @@ class LeaderboardView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        # Get all users with their total XP
-        users_with_xp = []
-        for user in CustomUser.objects.all():
-            total_xp = get_user_xp(user)
-            if total_xp > 0:  # Only include users with XP
-                users_with_xp.append({
-                    'user': user,
-                    'total_xp': total_xp,
-                    'league': self.get_league(total_xp),
-                    'badge_color': self.get_badge_color(total_xp)
-                })
-
-        # Sort by XP descending and limit to top 100
-        users_with_xp.sort(key=lambda x: x['total_xp'], reverse=True)
-        users_with_xp = users_with_xp[:100]  # Limit to top 100
+        # The first page comes from the shared snapshot, later pages are
+        # one ranked query each (see core.leaderboard)
+        cursor = self.request.GET.get('after')
+        if cursor:
+            users, next_cursor = get_leaderboard_page(after=cursor)
+            users = [
+                {'id': user.id, 'username': user.username, 'total_xp': user.total_xp, 'rank': user.rank}
+                for user in users
+            ]
+        else:
+            snapshot = get_snapshot()
+            users, next_cursor = snapshot['users'], snapshot['next_cursor']
 
-        # Add rank
-        for index, user_data in enumerate(users_with_xp, start=1):
-            user_data['rank'] = index
-            user_data['is_current_user'] = user_data['user'].id == self.request.user.id
+        users_with_xp = []
+        for user in users:
+            users_with_xp.append({
+                'user': user,
+                'total_xp': user['total_xp'],
+                'rank': user['rank'],
+                'league': self.get_league(user['total_xp']),
+                'badge_color': self.get_badge_color(user['total_xp']),
+                'is_current_user': user['id'] == self.request.user.id
+            })
 
         # Get current user stats
         current_user_xp = get_user_xp(self.request.user)
@@ -357,6 +496,13 @@ class LeaderboardView(LoginRequiredMixin, TemplateView):
             xp_to_next_league = 0
 
         context['leaderboard'] = users_with_xp
+        context['is_first_page'] = not cursor
+        context['next_cursor'] = next_cursor
+        context['current_user_rank'] = get_user_rank(self.request.user)
+        context['users_around_me'] = [
+            dict(user, is_current_user=user['id'] == self.request.user.id)
+            for user in get_users_around(self.request.user)
+        ]
         context['current_user_xp'] = current_user_xp
         context['current_user_league'] = current_user_league
         context['xp_to_next_league'] = xp_to_next_league
@@ -394,19 +540,11 @@ class GamificationView(LoginRequiredMixin, TemplateView):
         # Add user XP to context
         context['user_xp'] = get_user_xp(self.request.user)
 
-        # Get top 5 users for leaderboard preview
-        users_with_xp = []
-        for user in CustomUser.objects.all():
-            total_xp = get_user_xp(user)
-            if total_xp > 0:
-                users_with_xp.append({
-                    'username': user.username,
-                    'xp': total_xp
-                })
-
-        # Sort by XP and get top 5
-        users_with_xp.sort(key=lambda x: x['xp'], reverse=True)
-        context['top_users'] = users_with_xp[:5]
+        # Top 5 users for leaderboard preview, from the shared snapshot
+        context['top_users'] = [
+            {'username': user['username'], 'xp': user['total_xp']}
+            for user in get_snapshot()['users'][:5]
+        ]
 
         return context
 
@@ -459,11 +597,11 @@ def change_language(request):
 
 @login_required
 @require_POST
-def lesson_chatbot(request, lesson_id):
+async def lesson_chatbot(request, lesson_id):
     """
     AI chatbot that helps with lesson content but refuses to answer quiz questions
     """
-    lesson = get_object_or_404(Lesson, id=lesson_id)
+    lesson = await aget_object_or_404(Lesson.objects.select_related('module__course'), id=lesson_id)
     user_message = request.POST.get('message', '').strip()
 
     if not user_message:
@@ -471,7 +609,7 @@ def lesson_chatbot(request, lesson_id):
 
     # Get lesson content and quiz questions
     lesson_content = lesson.content[:2000]  # Limit content length
-    quiz_questions = [q.question for q in lesson.quizzes.all()]
+    quiz_questions = [q.question async for q in lesson.quizzes.all()]
     course_language = lesson.module.course.language
 
     # Language-specific prompts
@@ -540,65 +678,78 @@ MÁNISLI QÁǴIDELER:
     if is_quiz_question:
         response_text = prompt_data['refusal']
     else:
+        # Answers are shared by everyone asking the same question about this lesson
+        response_text = await sync_to_async(get_cached_answer, thread_sensitive=False)(
+            lesson.id, course_language, user_message
+        )
+    if response_text is None:
+        # Only questions that reach the model count against the limits
+        user = await request.auser()
+        throttle = await acheck_rate_limit('lesson_chat', user.id)
+        if throttle:
+            response = render(request, 'partials/lesson_chatbot_message.html', {
+                'message': get_message_html(throttle.message),
+                'is_ai': True
+            })
+            response['Retry-After'] = str(throttle.to_dict()['retry_after'])
+            return response
+
         # Generate AI response
         try:
-            import google.generativeai as genai
-            from django.conf import settings
-
-            genai.configure(api_key=settings.GEMINI_API_KEY)
-            model = genai.GenerativeModel('gemini-2.5-flash')
-
             full_prompt = f"{system_prompt}\n\nStudent question: {user_message}\n\nYour response:"
-            response = model.generate_content(full_prompt)
-            response_text = response.text.strip()
+            response_text = await ai_client.agenerate_text(full_prompt)
         except Exception as e:
             print(f"Error in lesson chatbot: {e}")
             response_text = "Sorry, I encountered an error. Please try again." if course_language == 'en' else \
                            "Извините, произошла ошибка. Попробуйте снова." if course_language == 'ru' else \
                            "Keshiriń, qátelik júz berdi. Qaytadan háreket etiń."
+        else:
+            await sync_to_async(cache_answer, thread_sensitive=False)(
+                lesson.id, course_language, user_message, response_text
+            )
 
-    # Return formatted response
+    # Return formatted response, Markdown rendered and sanitized like lessons
     return render(request, 'partials/lesson_chatbot_message.html', {
-        'message': response_text,
+        'message': get_message_html(response_text),
         'is_ai': True
     })
 
 
 @login_required
-def check_task_status(request, task_id):
+async def check_task_status(request, task_id):
     """
     Check the status of a Celery task (for course generation)
-    
-    Returns JSON with task status and result
+
+    Returns JSON with task status and result, and an ETag. With
+    If-None-Match and ?wait=<seconds> the request is held open until the
+    status differs from that ETag (long polling, at most
+    TASK_STATUS_LONG_POLL_TIMEOUT seconds), then answered 304 if nothing
+    changed, so clients get progress as it happens without polling on a timer.
     """
-    from celery.result import AsyncResult
-    
-    task = AsyncResult(task_id)
-    
-    response_data = {
-        'task_id': task_id,
-        'status': task.state,
-    }
-    
-    if task.state == 'PENDING':
-        response_data['message'] = 'Task is waiting to start...'
-    elif task.state == 'STARTED':
-        response_data['message'] = 'Generating course... This may take 10-30 seconds.'
-    elif task.state == 'SUCCESS':
-        result = task.result
-        response_data['message'] = result.get('message', 'Course generated successfully!')
-        response_data['course_id'] = result.get('course_id')
-        response_data['title'] = result.get('title')
-        response_data['redirect_url'] = '/dashboard/'
-    elif task.state == 'FAILURE':
-        response_data['message'] = f'Error: {str(task.info)}'
-        response_data['error'] = True
-    elif task.state == 'RETRY':
-        response_data['message'] = 'Retrying... Please wait.'
+    from django.conf import settings
+
+    etag = request.headers.get('If-None-Match')
+    try:
+        wait = min(max(float(request.GET.get('wait', 0)), 0), settings.TASK_STATUS_LONG_POLL_TIMEOUT)
+    except ValueError:
+        wait = 0
+
+    response_data, new_etag = await wait_for_status_change(task_id, etag, wait if etag else 0)
+    # A chat reply is only shown to the user it answers
+    user = await request.auser()
+    if response_data.get('user_id', user.id) != user.id:
+        return JsonResponse({'error': 'Task not found'}, status=404)
+    if response_data.get('course_id'):
+        # Users who joined this generation get the course too (see core.singleflight)
+        await sync_to_async(enroll_waiter)(task_id, user.id, response_data['course_id'])
+
+    if new_etag == etag:
+        response = HttpResponseNotModified()
     else:
-        response_data['message'] = f'Task status: {task.state}'
-    
-    return JsonResponse(response_data)
+        response = JsonResponse(response_data)
+    response['ETag'] = new_etag
+    response['Cache-Control'] = 'no-cache'
+    return response
 
 
 @login_required
@@ -611,6 +762,7 @@ def clear_chat_history(request):
     """
     try:
         ChatMessage.objects.filter(user=request.user).delete()
+        ChatSummary.objects.filter(user=request.user).delete()
         return JsonResponse({
             'success': True,
             'message': 'Chat history cleared successfully!'